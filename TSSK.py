@@ -2,19 +2,64 @@ import requests
 import yaml
 from datetime import datetime, timedelta, timezone
 from collections import defaultdict
+import argparse
+import contextlib
+import io
 import sys
 import os
+import hashlib
+import json
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from movies_history import (
     process_radarr_url,
     get_this_month_in_history,
+    merge_movie_lists,
     create_movie_overlay_yaml,
     create_movie_collection_yaml,
 )
-from movies_in_theaters import get_in_theaters
+from movies_in_theaters import NOW_PLAYING_CACHE_HOURS, get_in_theaters
+from movies_upcoming import (
+    RELEASE_FIELDS,
+    get_release_days,
+    get_upcoming_releases,
+    within_days,
+)
+import movies_history
+import movies_upcoming
+import transport
+from cassette import Cassette, shifted_datetime
+from checkpoint import CHECKPOINT_PATH, get_checkpoint, start_checkpoint
+from label_manifest import (
+    category_label,
+    get_label_manifest,
+    label_builder,
+    write_label_manifest,
+)
+from membership import Membership, category_name, load_membership
+from overlay_state import (
+    OVERLAY_STATE_PATH,
+    get_overlay_state,
+    load_overlay_state,
+    save_overlay_state,
+    write_delta_manifest,
+)
+from profiler import get_profiler, start_profiler
+from scope_filters import apply_scope_filter, get_scope_filters, set_scope_filter
+from sonarr_cache import get_sonarr_cache, save_sonarr_caches
+from state_store import close_state_store, get_state_store
+from yaml_output import (
+    DEFAULT_OUTPUT_DIR,
+    OutputWriter,
+    QuotedString,
+    dump_yaml,
+    format_date,
+    write_placeholder,
+)
 
 
 # Constants
-IS_DOCKER = os.getenv("DOCKER", "false").lower() == "true"
 VERSION = "2.1"
 # Repository used for version checks
 GITHUB_REPO = os.getenv(
@@ -34,9 +79,10 @@ def check_for_updates():
     print(f"Checking for updates to TSSK {VERSION} from {GITHUB_REPO}...")
 
     try:
-        response = requests.get(
+        response = transport.get(
             f"https://api.github.com/repos/{GITHUB_REPO}/releases/latest",
             timeout=10,
+            revalidate=True,
         )
         response.raise_for_status()
 
@@ -102,7 +148,10 @@ def convert_utc_to_local(utc_date_str, utc_offset):
     return local_date
 
 
-def process_sonarr_url(base_url, api_key):
+SONARR_API_PATHS = ["/api/v3", "/sonarr/api/v3"]
+
+
+def sonarr_base_url(base_url):
     base_url = base_url.rstrip("/")
 
     if base_url.startswith("http"):
@@ -110,14 +159,20 @@ def process_sonarr_url(base_url, api_key):
         next_slash = base_url.find("/", protocol_end)
         if next_slash != -1:
             base_url = base_url[:next_slash]
+    return base_url
 
-    api_paths = ["/api/v3", "/sonarr/api/v3"]
+
+def process_sonarr_url(base_url, api_key):
+    base_url = sonarr_base_url(base_url)
+    api_paths = SONARR_API_PATHS
 
     for path in api_paths:
         test_url = f"{base_url}{path}"
         try:
             headers = {"X-Api-Key": api_key}
-            response = requests.get(f"{test_url}/health", headers=headers, timeout=10)
+            response = transport.get(
+                f"{test_url}/health", headers=headers, timeout=10, retries=0
+            )
             if response.status_code == 200:
                 print(f"Successfully connected to Sonarr at: {test_url}")
                 return test_url
@@ -132,70 +187,447 @@ def process_sonarr_url(base_url, api_key):
     )
 
 
-def get_tmdb_status(tvdb_id, tmdb_api_key):
-    """Retrieve the status of a show from TMDB using its TVDB id"""
-    if not tmdb_api_key or not tvdb_id:
+# Threads for TMDB lookups in bulk; transport limits how many hit TMDB at once
+TMDB_WORKERS = transport.CONCURRENCY_MAX
+
+# Run-wide TMDB caches so a show is only looked up once per run
+_tmdb_id_cache = {}  # tvdbId -> TMDB tv id (None when TMDB has no match)
+_tmdb_status_cache = {}  # TMDB tv id -> status
+
+
+def find_tmdb_id(tvdb_id, tmdb_api_key):
+    """Map a TVDB id to a TMDB tv id using TMDB's /find endpoint"""
+    if tvdb_id in _tmdb_id_cache:
+        return _tmdb_id_cache[tvdb_id]
+
+    find_url = (
+        f"https://api.themoviedb.org/3/find/{tvdb_id}?api_key="
+        f"{tmdb_api_key}&external_source=tvdb_id"
+    )
+    resp = transport.get(find_url, timeout=10, revalidate=True)
+    resp.raise_for_status()
+    data = resp.json()
+    tv_results = data.get("tv_results") or []
+    tmdb_id = tv_results[0].get("id") if tv_results else None
+    _tmdb_id_cache[tvdb_id] = tmdb_id
+    return tmdb_id
+
+
+def get_tmdb_status(tvdb_id, tmdb_api_key, tmdb_id=None):
+    """Retrieve the status of a show from TMDB.
+
+    ``tmdb_id`` is used directly when Sonarr already knows it; otherwise the
+    TMDB id is looked up from the TVDB id first.
+    """
+    if not tmdb_api_key or not (tvdb_id or tmdb_id):
         return None
 
     try:
-        # First call to find the TMDB id from the TVDB id
-        find_url = (
-            f"https://api.themoviedb.org/3/find/{tvdb_id}?api_key="
-            f"{tmdb_api_key}&external_source=tvdb_id"
-        )
-        resp = requests.get(find_url, timeout=10)
-        resp.raise_for_status()
-        data = resp.json()
-        tv_results = data.get("tv_results") or []
-        if not tv_results:
-            return None
-        tmdb_id = tv_results[0].get("id")
+        if not tmdb_id:
+            tmdb_id = find_tmdb_id(tvdb_id, tmdb_api_key)
         if not tmdb_id:
             return None
 
+        if tmdb_id in _tmdb_status_cache:
+            return _tmdb_status_cache[tmdb_id]
+
         details_url = f"https://api.themoviedb.org/3/tv/{tmdb_id}?api_key={tmdb_api_key}"
-        resp = requests.get(details_url, timeout=10)
+        resp = transport.get(details_url, timeout=10, revalidate=True)
         resp.raise_for_status()
         info = resp.json()
-        return info.get("status")
+        status = info.get("status")
+        _tmdb_status_cache[tmdb_id] = status
+        return status
     except Exception as e:
         print(f"{ORANGE}Failed to fetch TMDB status for {tvdb_id}: {e}{RESET}")
         return None
 
 
+def get_tmdb_statuses(series_list, tmdb_api_key):
+    """Resolve TMDB statuses for many Sonarr series at once.
+
+    Series are deduplicated by tvdbId and looked up concurrently. The
+    ``tmdbId`` from the Sonarr payload is used when present so TMDB /find is
+    only called for series Sonarr has no TMDB id for. Returns a dict of
+    tvdbId -> status (or None).
+    """
+    lookups = {}
+    for series in series_list:
+        tvdb_id = series.get("tvdbId")
+        if tvdb_id and tvdb_id not in lookups:
+            # Sonarr reports 0 when it doesn't know the TMDB id
+            lookups[tvdb_id] = series.get("tmdbId") or None
+
+    if not tmdb_api_key or not lookups:
+        return {}
+
+    with ThreadPoolExecutor(max_workers=TMDB_WORKERS) as pool:
+        futures = {
+            tvdb_id: pool.submit(get_tmdb_status, tvdb_id, tmdb_api_key, tmdb_id)
+            for tvdb_id, tmdb_id in lookups.items()
+        }
+    return {tvdb_id: future.result() for tvdb_id, future in futures.items()}
+
+
 def get_sonarr_series(sonarr_url, api_key):
+    checkpoint = get_checkpoint()
+    series = checkpoint.get_series(sonarr_url)
+    if series is not None:
+        return series
+
+    cache = get_sonarr_cache(sonarr_url)
     try:
         url = f"{sonarr_url}/series"
         headers = {"X-Api-Key": api_key}
-        response = requests.get(url, headers=headers, timeout=10)
+        response = transport.get(url, headers=headers, timeout=10)
         response.raise_for_status()
-        return response.json()
+        series = response.json()
+        # The cache keeps every series so changing the filters needs no refetch
+        cache.store_series(series)
+        series = scope_series(sonarr_url, series)
+        checkpoint.record_series(sonarr_url, series)
+        return series
     except requests.exceptions.RequestException as e:
+        if cache.series is not None:
+            print(
+                f"{ORANGE}Error connecting to Sonarr: {str(e)} - using the last-known series list{RESET}"
+            )
+            series = scope_series(sonarr_url, cache.series)
+            checkpoint.record_series(sonarr_url, series)
+            return series
         print(f"{RED}Error connecting to Sonarr: {str(e)}{RESET}")
         sys.exit(1)
 
 
+def scope_series(sonarr_url, series):
+    """Drop the series excluded by the instance's ``sonarr_filters``."""
+    kept = apply_scope_filter(sonarr_url, series)
+    if len(kept) != len(series):
+        print(f"Sonarr filters: {len(kept)} of {len(series)} series in scope for {sonarr_url}")
+    return kept
+
+
+def print_scope_warnings():
+    for scope_filter in get_scope_filters().values():
+        for warning in scope_filter.warnings:
+            print(f"{ORANGE}{warning}{RESET}")
+
+
 def get_sonarr_episodes(sonarr_url, api_key, series_id):
+    # Each series is fetched once per run (or taken from a resumed checkpoint)
+    checkpoint = get_checkpoint()
+    episodes = checkpoint.get_episodes(sonarr_url, series_id)
+    if episodes is not None:
+        return episodes
+
+    cache = get_sonarr_cache(sonarr_url)
     try:
         url = f"{sonarr_url}/episode?seriesId={series_id}"
         headers = {"X-Api-Key": api_key}
-        response = requests.get(url, headers=headers, timeout=10)
+        response = transport.get(url, headers=headers, timeout=10)
         response.raise_for_status()
-        return response.json()
+        episodes = response.json()
+        cache.store_episodes(series_id, episodes)
     except requests.exceptions.RequestException as e:
-        print(f"{RED}Error fetching episodes from Sonarr: {str(e)}{RESET}")
-        sys.exit(1)
+        # Degrade gracefully: classify this series from its last-known episodes
+        episodes = cache.cached_episodes(series_id)
+        if episodes is None:
+            print(
+                f"{ORANGE}Error fetching episodes for series {series_id} from Sonarr: {str(e)} - no cached episodes, skipping{RESET}"
+            )
+            episodes = []
+        else:
+            print(
+                f"{ORANGE}Error fetching episodes for series {series_id} from Sonarr: {str(e)} - using last-known episodes{RESET}"
+            )
+    checkpoint.record_episodes(sonarr_url, series_id, episodes)
+    return episodes
+
+
+def get_arr_instances(config, kind):
+    """Return the configured Sonarr or Radarr instances in precedence order.
+
+    ``<kind>_instances`` is a list of ``{name, url, api_key}`` entries. When it
+    isn't set, the single ``<kind>_url``/``<kind>_api_key`` pair is used.
+    Earlier instances win when the same show or movie is in several of them.
+    Each instance uses its own ``filters`` or else ``<kind>_filters``.
+    """
+    filters = config.get(f"{kind}_filters") or {}
+    instances = config.get(f"{kind}_instances")
+    if not instances:
+        url = config.get(f"{kind}_url")
+        api_key = config.get(f"{kind}_api_key")
+        if not url or not api_key:
+            return []
+        instances = [{"name": kind, "url": url, "api_key": api_key}]
+
+    return [
+        {
+            "name": instance.get("name") or f"{kind}{i + 1}",
+            "url": instance["url"],
+            "api_key": instance["api_key"],
+            "filters": instance.get("filters", filters) or {},
+        }
+        for i, instance in enumerate(instances)
+    ]
+
+
+# Threads for per-series /episode requests (transport limits how many hit
+# Sonarr at once). Sonarr's /episode only filters by a single seriesId, so
+# there is no bulk form to batch them into.
+EPISODE_WORKERS = transport.CONCURRENCY_MAX
+
+
+def get_prefilter_cutoff(profiles):
+    """Oldest air date that can still put a series in a recent category of any profile."""
+    recent_days = max(
+        max(settings["recent_days_season_finale"], settings["recent_days_final_episode"])
+        for settings in (get_tv_settings(config) for _, config, _ in profiles)
+    )
+    # The extra day covers any utc_offset
+    return datetime.now(timezone.utc) - timedelta(days=recent_days + 1)
+
+
+# How far ahead the calendar is searched for airing series
+AIRING_CALENDAR_YEARS = 100
+
+
+def get_airing_series(instance, prefilter_cutoff):
+    """Ids of the series with an episode airing on or after ``prefilter_cutoff``.
+
+    Sonarr's ``nextAiring``/``previousAiring`` only look at monitored
+    episodes, so the calendar is asked for unmonitored ones as well. Every
+    dated category needs such an episode; any other series is classified
+    from its series data alone. Returns None (fetch every series) without a
+    cutoff or when the calendar can't be read.
+    """
+    if prefilter_cutoff is None:
+        return None
+    # A day earlier, in case Sonarr reads the dates in its own timezone
+    start = (prefilter_cutoff - timedelta(days=1)).date()
+    end = start + timedelta(days=365 * AIRING_CALENDAR_YEARS)
+    try:
+        response = transport.get(
+            f"{instance['url']}/calendar",
+            headers={"X-Api-Key": instance["api_key"]},
+            params={
+                "start": start.isoformat(),
+                "end": end.isoformat(),
+                "unmonitored": "true",
+            },
+            timeout=30,
+        )
+        response.raise_for_status()
+        return {ep["seriesId"] for ep in response.json()}
+    except (requests.exceptions.RequestException, ValueError, KeyError) as e:
+        print(
+            f"{ORANGE}Error reading the Sonarr calendar of {instance['name']}: {str(e)} - fetching every series{RESET}"
+        )
+        return None
+
+
+def fetch_sonarr_episodes(instance, series_list, airing_series=None):
+    """Fetch the episodes of ``series_list`` into the run snapshot.
+
+    Series are requested concurrently, one ``/episode`` request each. With
+    ``airing_series`` (see :func:`get_airing_series`), series not in it get
+    an empty episode list without any request.
+    """
+    with get_profiler().phase(f"fetch_sonarr_episodes:{instance['name']}"):
+        _fetch_sonarr_episodes(instance, series_list, airing_series)
+
+
+def _fetch_sonarr_episodes(instance, series_list, airing_series):
+    url, api_key = instance["url"], instance["api_key"]
+    checkpoint = get_checkpoint()
+    if airing_series is not None:
+        for series in series_list:
+            # Nothing in any window: the classification doesn't need episodes
+            if (
+                series["id"] not in airing_series
+                and checkpoint.get_episodes(url, series["id"]) is None
+            ):
+                checkpoint.record_episodes(url, series["id"], [])
+    missing = [
+        series["id"]
+        for series in series_list
+        if checkpoint.get_episodes(url, series["id"]) is None
+    ]
+
+    if missing:
+        with ThreadPoolExecutor(max_workers=EPISODE_WORKERS) as pool:
+            list(
+                pool.map(
+                    lambda series_id: get_sonarr_episodes(url, api_key, series_id),
+                    missing,
+                )
+            )
+
+
+def load_sonarr_library(instances, prefilter_cutoff=None):
+    """Fetch every instance's series and episodes concurrently into the run snapshot.
+
+    With several instances, a show is only kept in the first instance that
+    lists it (matched by tvdbId), so each show is classified exactly once.
+    """
+    with ThreadPoolExecutor(max_workers=len(instances)) as pool:
+        series_lists = list(
+            pool.map(lambda i: get_sonarr_series(i["url"], i["api_key"]), instances)
+        )
+    series_lists = dedupe_instance_series(instances, series_lists)
+
+    with ThreadPoolExecutor(max_workers=len(instances)) as pool:
+        list(
+            pool.map(
+                lambda instance, series_list: fetch_sonarr_episodes(
+                    instance,
+                    series_list,
+                    get_airing_series(instance, prefilter_cutoff),
+                ),
+                instances,
+                series_lists,
+            )
+        )
+
+
+# Series fetched and classified together in streaming mode
+STREAM_BATCH_SIZE = 50
+# Episode categories whose finder returns (matched, skipped) or (ended, cancelled)
+PAIRED_CATEGORIES = {"new_season", "upcoming_episode", "upcoming_finale", "ended"}
+
+
+def extend_result(result, new):
+    """Add a batch's finder result to the result collected so far."""
+    if isinstance(result, tuple):
+        for part, new_part in zip(result, new):
+            part.extend(new_part)
+    else:
+        result.extend(new)
+
+
+def stream_sonarr_library(
+    instances, profiles, tmdb_api_key, save_cache=True, prefilter_cutoff=None
+):
+    """Classify each series as soon as its episodes arrive instead of keeping them all.
+
+    Used by ``streaming_mode`` for big libraries on small containers: episodes
+    are fetched a batch at a time, every episode-based category of every
+    profile is evaluated for just those series (the finders accept a
+    ``series_list``) and the episode lists are dropped again. Only the
+    category results are kept, in the run snapshot, where
+    ``generate_tv_outputs`` picks them up. Fresh episodes go straight to the
+    state store (or are discarded when ``save_cache`` is off, for dry runs).
+    Each batch's results are checkpointed, so a resumed run carries on with
+    the next batch.
+    """
+    checkpoint = get_checkpoint()
+    with ThreadPoolExecutor(max_workers=len(instances)) as pool:
+        series_lists = list(
+            pool.map(lambda i: get_sonarr_series(i["url"], i["api_key"]), instances)
+        )
+    series_lists = dedupe_instance_series(instances, series_lists)
+
+    categories = []
+    for profile, profile_config, base_dir in profiles:
+        category_prefix = f"{profile}:" if len(profiles) > 1 else ""
+        episode_categories = get_episode_categories(
+            get_tv_settings(profile_config), tmdb_api_key
+        )
+        for name, (finder, *args) in episode_categories.items():
+            # Categories finished before an interrupted run are kept as they are
+            if f"{category_prefix}{name}" not in checkpoint.categories:
+                categories.append((f"{category_prefix}{name}", finder, args))
+    if not categories:
+        return
+    results = {
+        name: ([], []) if name.rpartition(":")[2] in PAIRED_CATEGORIES else []
+        for name, finder, args in categories
+    }
+    # Batches classified before an interrupted run
+    for batch_results in checkpoint.classified_results:
+        for name, result in batch_results.items():
+            if name in results:
+                extend_result(results[name], result)
+
+    for instance, series_list in zip(instances, series_lists):
+        url, api_key = instance["url"], instance["api_key"]
+        classified = checkpoint.classified.get(url, set())
+        series_list = [s for s in series_list if s["id"] not in classified]
+        airing_series = get_airing_series(instance, prefilter_cutoff)
+        for start in range(0, len(series_list), STREAM_BATCH_SIZE):
+            batch = series_list[start : start + STREAM_BATCH_SIZE]
+            fetch_sonarr_episodes(instance, batch, airing_series)
+            batch_results = {}
+            for name, finder, args in categories:
+                with get_profiler().phase(finder.__name__):
+                    result = finder(url, api_key, *args, series_list=batch)
+                batch_results[name] = result
+                extend_result(results[name], result)
+            checkpoint.record_classified(
+                url, [series["id"] for series in batch], batch_results
+            )
+            for series in batch:
+                checkpoint.drop_episodes(url, series["id"])
+            # Hand fresh episodes to the state store instead of holding them
+            if save_cache:
+                get_sonarr_cache(url).save()
+            else:
+                get_sonarr_cache(url).discard_episodes()
+
+    for name, result in results.items():
+        checkpoint.record_category(name, result)
+
+
+def dedupe_instance_series(instances, series_lists):
+    """Keep each show only in the first instance listing it and record that in the snapshot."""
+    if len(instances) < 2:
+        return series_lists
+
+    # Series without a tvdbId fall back to their title for deduplication
+    def series_key(series):
+        return series.get("tvdbId") or ("title", series.get("title"))
+
+    checkpoint = get_checkpoint()
+    claimed = set()
+    deduped = []
+    for instance, series_list in zip(instances, series_lists):
+        kept = [series for series in series_list if series_key(series) not in claimed]
+        claimed.update(series_key(series) for series in kept)
+        deduped.append(kept)
+        checkpoint.record_series(instance["url"], kept)
+    return deduped
+
+
+def find_across_instances(instances, finder, *args):
+    """Run a ``find_*`` function against every Sonarr instance and merge the results."""
+    with get_profiler().phase(finder.__name__):
+        results = [
+            finder(instance["url"], instance["api_key"], *args)
+            for instance in instances
+        ]
+    if isinstance(results[0], tuple):
+        return tuple(sum(parts, []) for parts in zip(*results))
+    return sum(results, [])
 
 
 def find_new_season_shows(
-    sonarr_url, api_key, future_days_new_season, utc_offset=0, skip_unmonitored=False
+    sonarr_url,
+    api_key,
+    future_days_new_season,
+    utc_offset=0,
+    skip_unmonitored=False,
+    series_list=None,
 ):
     cutoff_date = datetime.now(timezone.utc) + timedelta(days=future_days_new_season)
     now_local = datetime.now(timezone.utc) + timedelta(hours=utc_offset)
     matched_shows = []
     skipped_shows = []
 
-    all_series = get_sonarr_series(sonarr_url, api_key)
+    all_series = (
+        series_list
+        if series_list is not None
+        else get_sonarr_series(sonarr_url, api_key)
+    )
 
     for series in all_series:
         episodes = get_sonarr_episodes(sonarr_url, api_key, series["id"])
@@ -288,6 +720,7 @@ def find_upcoming_regular_episodes(
     future_days_upcoming_episode,
     utc_offset=0,
     skip_unmonitored=False,
+    series_list=None,
 ):
     """Find shows with upcoming non-premiere, non-finale episodes within the specified days"""
     cutoff_date = datetime.now(timezone.utc) + timedelta(
@@ -297,7 +730,11 @@ def find_upcoming_regular_episodes(
     matched_shows = []
     skipped_shows = []
 
-    all_series = get_sonarr_series(sonarr_url, api_key)
+    all_series = (
+        series_list
+        if series_list is not None
+        else get_sonarr_series(sonarr_url, api_key)
+    )
 
     for series in all_series:
         episodes = get_sonarr_episodes(sonarr_url, api_key, series["id"])
@@ -390,6 +827,7 @@ def find_upcoming_finales(
     future_days_upcoming_finale,
     utc_offset=0,
     skip_unmonitored=False,
+    series_list=None,
 ):
     """Find shows with upcoming season finales within the specified days"""
     cutoff_date = datetime.now(timezone.utc) + timedelta(
@@ -398,7 +836,11 @@ def find_upcoming_finales(
     matched_shows = []
     skipped_shows = []
 
-    all_series = get_sonarr_series(sonarr_url, api_key)
+    all_series = (
+        series_list
+        if series_list is not None
+        else get_sonarr_series(sonarr_url, api_key)
+    )
 
     for series in all_series:
         episodes = get_sonarr_episodes(sonarr_url, api_key, series["id"])
@@ -487,13 +929,18 @@ def find_upcoming_finales(
     return matched_shows, skipped_shows
 
 
-def find_ended_shows(sonarr_url, api_key, tmdb_api_key=None):
+def find_ended_shows(sonarr_url, api_key, tmdb_api_key=None, series_list=None):
     """Find shows that have ended and have no upcoming regular episodes (ignoring specials).
     Returns a tuple of (ended_shows, cancelled_shows)."""
     ended_shows = []
     cancelled_shows = []
+    ended_series = []
 
-    all_series = get_sonarr_series(sonarr_url, api_key)
+    all_series = (
+        series_list
+        if series_list is not None
+        else get_sonarr_series(sonarr_url, api_key)
+    )
 
     for series in all_series:
         if series.get("status") == "ended":
@@ -516,14 +963,20 @@ def find_ended_shows(sonarr_url, api_key, tmdb_api_key=None):
                         break
 
             if not has_future_regular_episodes:
-                tvdb_id = series.get("tvdbId")
-                show_dict = {"title": series["title"], "tvdbId": tvdb_id}
+                ended_series.append(series)
 
-                tmdb_status = get_tmdb_status(tvdb_id, tmdb_api_key)
-                if tmdb_status and "cancel" in tmdb_status.lower():
-                    cancelled_shows.append(show_dict)
-                else:
-                    ended_shows.append(show_dict)
+    # Look up TMDB statuses for all ended shows in one batch
+    tmdb_statuses = get_tmdb_statuses(ended_series, tmdb_api_key)
+
+    for series in ended_series:
+        tvdb_id = series.get("tvdbId")
+        show_dict = {"title": series["title"], "tvdbId": tvdb_id}
+
+        tmdb_status = tmdb_statuses.get(tvdb_id)
+        if tmdb_status and "cancel" in tmdb_status.lower():
+            cancelled_shows.append(show_dict)
+        else:
+            ended_shows.append(show_dict)
 
     return ended_shows, cancelled_shows
 
@@ -551,14 +1004,23 @@ def find_returning_shows(sonarr_url, api_key, excluded_tvdb_ids):
 
 
 def find_recent_season_finales(
-    sonarr_url, api_key, recent_days_season_finale, utc_offset=0, skip_unmonitored=False
+    sonarr_url,
+    api_key,
+    recent_days_season_finale,
+    utc_offset=0,
+    skip_unmonitored=False,
+    series_list=None,
 ):
     """Find shows with status 'continuing' that had a season finale air within the specified days or have a future finale that's already downloaded"""
     now_local = datetime.now(timezone.utc) + timedelta(hours=utc_offset)
     cutoff_date = now_local - timedelta(days=recent_days_season_finale)
     matched_shows = []
 
-    all_series = get_sonarr_series(sonarr_url, api_key)
+    all_series = (
+        series_list
+        if series_list is not None
+        else get_sonarr_series(sonarr_url, api_key)
+    )
 
     for series in all_series:
         # Only include continuing shows
@@ -655,14 +1117,23 @@ def find_recent_season_finales(
 
 
 def find_recent_final_episodes(
-    sonarr_url, api_key, recent_days_final_episode, utc_offset=0, skip_unmonitored=False
+    sonarr_url,
+    api_key,
+    recent_days_final_episode,
+    utc_offset=0,
+    skip_unmonitored=False,
+    series_list=None,
 ):
     """Find shows with status 'ended' that had their final episode air within the specified days or have a future final episode that's already downloaded"""
     now_local = datetime.now(timezone.utc) + timedelta(hours=utc_offset)
     cutoff_date = now_local - timedelta(days=recent_days_final_episode)
     matched_shows = []
 
-    all_series = get_sonarr_series(sonarr_url, api_key)
+    all_series = (
+        series_list
+        if series_list is not None
+        else get_sonarr_series(sonarr_url, api_key)
+    )
 
     for series in all_series:
         # Only include ended shows
@@ -779,103 +1250,85 @@ def find_recent_final_episodes(
     return matched_shows
 
 
-def format_date(yyyy_mm_dd, date_format, capitalize=False):
-    dt_obj = datetime.strptime(yyyy_mm_dd, "%Y-%m-%d")
-
-    format_mapping = {
-        "mmm": "%b",  # Abbreviated month name
-        "mmmm": "%B",  # Full month name
-        "mm": "%m",  # 2-digit month
-        "m": "%-m",  # 1-digit month
-        "dddd": "%A",  # Full weekday name
-        "ddd": "%a",  # Abbreviated weekday name
-        "dd": "%d",  # 2-digit day
-        "d": str(dt_obj.day),  # 1-digit day - direct integer conversion
-        "yyyy": "%Y",  # 4-digit year
-        "yyy": "%Y",  # 3+ digit year
-        "yy": "%y",  # 2-digit year
-        "y": "%y",  # Year without century
-    }
-
-    # Sort format patterns by length (longest first) to avoid partial matches
-    patterns = sorted(format_mapping.keys(), key=len, reverse=True)
-
-    # First, replace format patterns with temporary markers
-    temp_format = date_format
-    replacements = {}
-    for i, pattern in enumerate(patterns):
-        marker = f"@@{i}@@"
-        if pattern in temp_format:
-            replacements[marker] = format_mapping[pattern]
-            temp_format = temp_format.replace(pattern, marker)
-
-    # Now replace the markers with strftime formats
-    strftime_format = temp_format
-    for marker, replacement in replacements.items():
-        strftime_format = strftime_format.replace(marker, replacement)
+def create_overlay_yaml(output_file, shows, config_sections, base_dir=None, labels=False):
+    """Write a category's overlay file.
 
-    try:
-        result = dt_obj.strftime(strftime_format)
-        if capitalize:
-            result = result.upper()
-        return result
-    except ValueError as e:
-        print(
-            f"{RED}Error: Invalid date format '{date_format}'. Using default format.{RESET}"
-        )
-        return yyyy_mm_dd  # Return original format as fallback
-
-
-def create_overlay_yaml(output_file, shows, config_sections):
-    import yaml
-    from copy import deepcopy
-    from datetime import datetime
+    With ``labels`` every block selects its shows by Plex label (see
+    :mod:`label_manifest`) instead of listing their tvdbIds.
+    """
+    # Check if this is a category that doesn't need dates
+    no_date_needed = "SEASON_FINALE" in output_file or "FINAL_EPISODE" in output_file
 
     # Ensure the directory exists
-    base_dir = "/config/kometa/tssk" if IS_DOCKER else "kometa"
+    base_dir = base_dir or DEFAULT_OUTPUT_DIR
     output_dir = os.path.join(base_dir, "tv", "overlays")
     os.makedirs(output_dir, exist_ok=True)
+    state_file = os.path.join("tv", "overlays", output_file)
+    category_file = output_file
     output_file = os.path.join(output_dir, output_file)
 
+    # Block key -> (block identity, tvdbIds) for the persisted overlay state.
+    # Date blocks are identified by their air date so label changes and
+    # daily rollover can be told apart from real membership changes.
+    block_members = {}
+    # Plex label -> tvdbIds in label mode
+    label_members = {}
+    errors = []
+
+    def shows_builder(tvdb_ids_str, tvdb_ids, air_date=None):
+        if not labels:
+            return {"tvdb_show": tvdb_ids_str}
+        label = category_label(category_file, air_date)
+        label_members[label] = tvdb_ids
+        return label_builder(label)
+
     if not shows:
-        with open(output_file, "w", encoding="utf-8") as f:
-            f.write("#No matching shows found")
-        return
+        write_placeholder(output_file, "#No matching shows found")
+        blocks = get_overlay_state().record(base_dir, state_file, {})
+        state = {"overlay_blocks": {state_file: blocks}}
+        if labels:
+            state["labels"] = {
+                state_file: get_label_manifest().record(base_dir, state_file, {})
+            }
+        return state
 
-    # Group shows by date if available
+    # Bucket tvdbIds by air date in a single pass over the shows
     date_to_tvdb_ids = defaultdict(list)
     all_tvdb_ids = set()
 
-    # Check if this is a category that doesn't need dates
-    no_date_needed = "SEASON_FINALE" in output_file or "FINAL_EPISODE" in output_file
-
     for s in shows:
-        if s.get("tvdbId"):
-            all_tvdb_ids.add(s["tvdbId"])
+        tvdb_id = s.get("tvdbId")
+        if tvdb_id:
+            all_tvdb_ids.add(tvdb_id)
 
         # Only add to date groups if the show has an air date and dates are needed
         if s.get("airDate") and not no_date_needed:
-            date_to_tvdb_ids[s["airDate"]].append(s.get("tvdbId"))
+            bucket = date_to_tvdb_ids[s["airDate"]]
+            if tvdb_id:
+                bucket.append(tvdb_id)
+
+    all_tvdb_ids_str = ", ".join(str(i) for i in sorted(all_tvdb_ids))
 
     overlays_dict = {}
 
     # -- Backdrop Block --
-    backdrop_config = deepcopy(config_sections.get("backdrop", {}))
+    # Shallow copies are enough: only top-level keys are popped or overridden
+    backdrop_config = dict(config_sections.get("backdrop", {}))
     # Extract enable flag and default to True if not specified
     enable_backdrop = backdrop_config.pop("enable", True)
 
     # Only add backdrop overlay if enabled
     if enable_backdrop and all_tvdb_ids:
         backdrop_config["name"] = "backdrop"
-        all_tvdb_ids_str = ", ".join(str(i) for i in sorted(all_tvdb_ids) if i)
 
         overlays_dict["backdrop"] = {
             "overlay": backdrop_config,
-            "tvdb_show": all_tvdb_ids_str,
+            **shows_builder(all_tvdb_ids_str, all_tvdb_ids),
         }
+        block_members["backdrop"] = ("backdrop", all_tvdb_ids)
 
     # -- Text Blocks --
-    text_config = deepcopy(config_sections.get("text", {}))
+    text_config = dict(config_sections.get("text", {}))
     enable_text = text_config.pop("enable", True)
 
     if enable_text and all_tvdb_ids:
@@ -883,89 +1336,92 @@ def create_overlay_yaml(output_file, shows, config_sections):
         use_text = text_config.pop("use_text", "New Season")
         capitalize_dates = text_config.pop("capitalize_dates", True)
 
-        # For categories that need dates and shows with air dates, create date-specific overlays
+        # For categories that need dates and shows with air dates, create date-specific overlays.
+        # Every block shares text_config as its base and only overrides the name.
         if date_to_tvdb_ids and not no_date_needed:
             for date_str in sorted(date_to_tvdb_ids):
-                formatted_date = format_date(date_str, date_format, capitalize_dates)
-                sub_overlay_config = deepcopy(text_config)
-                sub_overlay_config["name"] = f"text({use_text} {formatted_date})"
-
-                tvdb_ids_for_date = sorted(
-                    tvdb_id for tvdb_id in date_to_tvdb_ids[date_str] if tvdb_id
+                formatted_date, error = format_date(date_str, date_format, capitalize_dates)
+                if error:
+                    errors.append(error)
+                tvdb_ids_str = ", ".join(
+                    str(i) for i in sorted(date_to_tvdb_ids[date_str])
                 )
-                tvdb_ids_str = ", ".join(str(i) for i in tvdb_ids_for_date)
 
                 block_key = f"TSSK_{formatted_date}"
                 overlays_dict[block_key] = {
-                    "overlay": sub_overlay_config,
-                    "tvdb_show": tvdb_ids_str,
+                    "overlay": {**text_config, "name": f"text({use_text} {formatted_date})"},
+                    **shows_builder(tvdb_ids_str, date_to_tvdb_ids[date_str], date_str),
                 }
+                block_members[block_key] = (date_str, date_to_tvdb_ids[date_str])
         # For shows without air dates or categories that don't need dates, create a single overlay
         else:
-            sub_overlay_config = deepcopy(text_config)
-            sub_overlay_config["name"] = f"text({use_text})"
-
-            tvdb_ids_str = ", ".join(str(i) for i in sorted(all_tvdb_ids) if i)
-
             block_key = "TSSK_text"
             overlays_dict[block_key] = {
-                "overlay": sub_overlay_config,
-                "tvdb_show": tvdb_ids_str,
+                "overlay": {**text_config, "name": f"text({use_text})"},
+                **shows_builder(all_tvdb_ids_str, all_tvdb_ids),
             }
+            block_members[block_key] = (block_key, all_tvdb_ids)
 
     final_output = {"overlays": overlays_dict}
 
-    with open(output_file, "w", encoding="utf-8") as f:
-        yaml.dump(final_output, f, sort_keys=False)
+    dump_yaml(final_output, output_file)
+    blocks = get_overlay_state().record(
+        base_dir,
+        state_file,
+        {identity: (key, ids) for key, (identity, ids) in block_members.items()},
+    )
+    state = {"overlay_blocks": {state_file: blocks}}
+    if errors:
+        state["errors"] = errors
+    if labels:
+        state["labels"] = {
+            state_file: get_label_manifest().record(base_dir, state_file, label_members)
+        }
+    return state
 
 
-def create_collection_yaml(output_file, shows, config):
-    import yaml
-    from yaml.representer import SafeRepresenter
+def create_collection_yaml(output_file, shows, config, base_dir=None, labels=False):
+    """Write a category's collection file (selecting shows by Plex label with ``labels``)."""
     from copy import deepcopy
     from collections import OrderedDict
 
     # Ensure the directory exists
-    base_dir = "/config/kometa/tssk" if IS_DOCKER else "kometa"
+    base_dir = base_dir or DEFAULT_OUTPUT_DIR
     output_dir = os.path.join(base_dir, "tv", "collections")
     os.makedirs(output_dir, exist_ok=True)
+    file_name = output_file
+    state_file = os.path.join("tv", "collections", output_file)
     output_file = os.path.join(output_dir, output_file)
 
-    # Add representer for OrderedDict
-    def represent_ordereddict(dumper, data):
-        return dumper.represent_mapping("tag:yaml.org,2002:map", data.items())
-
-    yaml.add_representer(OrderedDict, represent_ordereddict, Dumper=yaml.SafeDumper)
-
     # Determine collection type and get the appropriate config section
     collection_config = {}
     collection_name = ""
 
-    if "SEASON_FINALE" in output_file:
+    if "SEASON_FINALE" in file_name:
         config_key = "collection_season_finale"
         summary = f"Shows with a season finale that aired within the past {config.get('recent_days_season_finale', 21)} days"
-    elif "FINAL_EPISODE" in output_file:
+    elif "FINAL_EPISODE" in file_name:
         config_key = "collection_final_episode"
         summary = f"Shows with a final episode that aired within the past {config.get('recent_days_final_episode', 21)} days"
-    elif "NEW_SHOW" in output_file:
+    elif "NEW_SHOW" in file_name:
         config_key = "collection_new_show"
         summary = f"Shows with a first season starting within {config.get('future_days_new_show', 31)} days"
-    elif "NEW_SEASON" in output_file:
+    elif "NEW_SEASON" in file_name:
         config_key = "collection_new_season"
         summary = f"Shows with a new season starting within {config.get('future_days_new_season', 31)} days"
-    elif "UPCOMING_EPISODE" in output_file:
+    elif "UPCOMING_EPISODE" in file_name:
         config_key = "collection_upcoming_episode"
         summary = f"Shows with an upcoming episode within {config.get('future_days_upcoming_episode', 31)} days"
-    elif "UPCOMING_FINALE" in output_file:
+    elif "UPCOMING_FINALE" in file_name:
         config_key = "collection_upcoming_finale"
         summary = f"Shows with a season finale within {config.get('future_days_upcoming_finale', 31)} days"
-    elif "ENDED" in output_file:
+    elif "ENDED" in file_name:
         config_key = "collection_ended"
         summary = "Shows that have completed their run"
-    elif "TV_CANCELLED" in output_file:
+    elif "TV_CANCELLED" in file_name:
         config_key = "collection_cancelled"
         summary = "Shows that where cancelled or not renewed before completing their run"
-    elif "RETURNING" in output_file:
+    elif "RETURNING" in file_name:
         config_key = "collection_returning"
         summary = (
             "Returning Shows without upcoming episodes within the chosen timeframes"
@@ -983,13 +1439,18 @@ def create_collection_yaml(output_file, shows, config):
         # Extract the collection name and remove it from the config
         collection_name = collection_config.pop("collection_name", "TV Collection")
 
-    class QuotedString(str):
-        pass
-
-    def quoted_str_presenter(dumper, data):
-        return dumper.represent_scalar("tag:yaml.org,2002:str", data, style='"')
-
-    yaml.add_representer(QuotedString, quoted_str_presenter, Dumper=yaml.SafeDumper)
+    tvdb_ids = [s["tvdbId"] for s in shows if s.get("tvdbId")]
+    # Returned for the checkpoint, like the overlay writer's state
+    state = None
+    if labels:
+        label = category_label(file_name)
+        state = {
+            "labels": {
+                state_file: get_label_manifest().record(
+                    base_dir, state_file, {label: tvdb_ids} if tvdb_ids else {}
+                )
+            }
+        }
 
     # Handle the case when no shows are found
     if not shows:
@@ -1005,11 +1466,9 @@ def create_collection_yaml(output_file, shows, config):
             }
         }
 
-        with open(output_file, "w", encoding="utf-8") as f:
-            yaml.dump(data, f, Dumper=yaml.SafeDumper, sort_keys=False)
-        return
+        dump_yaml(data, output_file)
+        return state
 
-    tvdb_ids = [s["tvdbId"] for s in shows if s.get("tvdbId")]
     if not tvdb_ids:
         # Create the template for empty collections
         data = {
@@ -1022,9 +1481,8 @@ def create_collection_yaml(output_file, shows, config):
             }
         }
 
-        with open(output_file, "w", encoding="utf-8") as f:
-            yaml.dump(data, f, Dumper=yaml.SafeDumper, sort_keys=False)
-        return
+        dump_yaml(data, output_file)
+        return state
 
     # Convert to comma-separated
     tvdb_ids_str = ", ".join(str(i) for i in sorted(tvdb_ids))
@@ -1044,8 +1502,11 @@ def create_collection_yaml(output_file, shows, config):
     # Add sync_mode after the config parameters
     collection_data["sync_mode"] = "sync"
 
-    # Add tvdb_show as the last item
-    collection_data["tvdb_show"] = tvdb_ids_str
+    # Add the shows as the last item
+    shows_key = "plex_search" if labels else "tvdb_show"
+    collection_data[shows_key] = (
+        label_builder(label)["plex_search"] if labels else tvdb_ids_str
+    )
 
     # Create the final structure with ordered keys
     ordered_collection = OrderedDict()
@@ -1055,463 +1516,1296 @@ def create_collection_yaml(output_file, shows, config):
     if "sort_title" in collection_data:
         ordered_collection["sort_title"] = collection_data["sort_title"]
 
-    # Add all other keys except sync_mode and tvdb_show
+    # Add all other keys except sync_mode and the shows
     for key, value in collection_data.items():
-        if key not in ["summary", "sort_title", "sync_mode", "tvdb_show"]:
+        if key not in ["summary", "sort_title", "sync_mode", shows_key]:
             ordered_collection[key] = value
 
-    # Add sync_mode and tvdb_show at the end
+    # Add sync_mode and the shows at the end
     ordered_collection["sync_mode"] = collection_data["sync_mode"]
-    ordered_collection["tvdb_show"] = collection_data["tvdb_show"]
+    ordered_collection[shows_key] = collection_data[shows_key]
 
     data = {"collections": {collection_name: ordered_collection}}
 
-    with open(output_file, "w", encoding="utf-8") as f:
-        # Use SafeDumper so our custom representer is used
-        yaml.dump(data, f, Dumper=yaml.SafeDumper, sort_keys=False)
+    dump_yaml(data, output_file)
+    return state
 
 
-def main():
-    start_time = datetime.now()
-    print(f"{BLUE}{'*' * 40}\n{'*' * 15} TSSK {VERSION} {'*' * 15}\n{'*' * 40}{RESET}")
-    check_for_updates()
+def get_output_profiles(config):
+    """Return ``(name, settings, output_dir)`` for every output profile.
 
-    config = load_config("config/config.yml")
+    ``profiles`` maps a profile name to settings that override the top-level
+    ones (e.g. ``utc_offset``, ``future_days_*`` or whole ``text_*`` blocks).
+    A profile's ``date_format`` applies to all of its text blocks and its
+    ``output_dir`` defaults to a sub folder named after the profile. Without
+    profiles the top-level settings are the only profile.
+    """
+    profiles = config.get("profiles")
+    if not profiles:
+        return [("default", config, None)]
 
-    try:
-        # Process and validate Sonarr URL
-        sonarr_url = process_sonarr_url(config["sonarr_url"], config["sonarr_api_key"])
-        sonarr_api_key = config["sonarr_api_key"]
-
-        # Get category-specific future_days values, with fallback to main future_days
-        future_days = config.get("future_days", 14)
-        future_days_new_season = config.get("future_days_new_season", future_days)
-        future_days_new_show = config.get("future_days_new_show", future_days)
-        future_days_upcoming_episode = config.get(
-            "future_days_upcoming_episode", future_days
+    result = []
+    for name, overrides in profiles.items():
+        overrides = dict(overrides or {})
+        output_dir = overrides.pop("output_dir", None) or os.path.join(
+            DEFAULT_OUTPUT_DIR, str(name)
         )
-        future_days_upcoming_finale = config.get(
+        date_format = overrides.pop("date_format", None)
+
+        profile_config = {**config, **overrides}
+        if date_format:
+            for key, value in profile_config.items():
+                if key.startswith("text_") and isinstance(value, dict):
+                    profile_config[key] = {**value, "date_format": date_format}
+
+        result.append((str(name), profile_config, output_dir))
+    return result
+
+
+def get_tv_settings(config):
+    """Category windows and options of one (profile) config."""
+    # Get category-specific future_days values, with fallback to main future_days
+    future_days = config.get("future_days", 14)
+    return {
+        "future_days_new_season": config.get("future_days_new_season", future_days),
+        "future_days_new_show": config.get("future_days_new_show", future_days),
+        "future_days_upcoming_episode": config.get(
+            "future_days_upcoming_episode", future_days
+        ),
+        "future_days_upcoming_finale": config.get(
             "future_days_upcoming_finale", future_days
-        )
-
+        ),
         # Get recent days values
-        recent_days_season_finale = config.get("recent_days_season_finale", 14)
-        recent_days_final_episode = config.get("recent_days_final_episode", 14)
+        "recent_days_season_finale": config.get("recent_days_season_finale", 14),
+        "recent_days_final_episode": config.get("recent_days_final_episode", 14),
+        "utc_offset": float(config.get("utc_offset", 0)),
+        "skip_unmonitored": str(config.get("skip_unmonitored", "false")).lower()
+        == "true",
+        "labels": is_label_mode(config),
+    }
 
-        utc_offset = float(config.get("utc_offset", 0))
-        skip_unmonitored = (
-            str(config.get("skip_unmonitored", "false")).lower() == "true"
-        )
-        tmdb_api_key = config.get("tmdb_api_key")
-        radarr_url = config.get("radarr_url")
-        radarr_api_key = config.get("radarr_api_key")
-        movie_release_country = config.get("movie_release_country")
-        if radarr_url and radarr_api_key:
-            radarr_url = process_radarr_url(radarr_url, radarr_api_key)
-        else:
-            radarr_url = None
-
-        # Print chosen values
-        print(f"future_days_new_show: {future_days_new_show}")
-        print(f"future_days_new_season: {future_days_new_season}")
-        print(f"future_days_upcoming_episode: {future_days_upcoming_episode}")
-        print(f"future_days_upcoming_finale: {future_days_upcoming_finale}")
-        print(f"recent_days_season_finale: {recent_days_season_finale}")
-        print(f"recent_days_final_episode: {recent_days_final_episode}")
-        print(f"skip_unmonitored: {skip_unmonitored}\n")
-        print(f"UTC offset: {utc_offset} hours\n")
-
-        # Track all tvdbIds to exclude from other categories
-        all_excluded_tvdb_ids = set()
-
-        # ---- Recent Season Finales ----
-        season_finale_shows = find_recent_season_finales(
-            sonarr_url,
-            sonarr_api_key,
-            recent_days_season_finale,
+
+def is_label_mode(config):
+    """Whether TV files select shows by Plex label (``output_mode: labels``)."""
+    return str(config.get("output_mode", "ids")).lower() == "labels"
+
+
+def get_episode_categories(settings, tmdb_api_key):
+    """Finder and arguments of each TV category that reads episode lists, in evaluation order."""
+    utc_offset = settings["utc_offset"]
+    skip_unmonitored = settings["skip_unmonitored"]
+    return {
+        "season_finale": (
+            find_recent_season_finales,
+            settings["recent_days_season_finale"],
             utc_offset,
             skip_unmonitored,
-        )
+        ),
+        "final_episode": (
+            find_recent_final_episodes,
+            settings["recent_days_final_episode"],
+            utc_offset,
+        ),
+        # New shows and new seasons come from one search over the longer window
+        "new_season": (
+            find_new_season_shows,
+            max(settings["future_days_new_season"], settings["future_days_new_show"]),
+            utc_offset,
+            skip_unmonitored,
+        ),
+        "upcoming_episode": (
+            find_upcoming_regular_episodes,
+            settings["future_days_upcoming_episode"],
+            utc_offset,
+            skip_unmonitored,
+        ),
+        "upcoming_finale": (
+            find_upcoming_finales,
+            settings["future_days_upcoming_finale"],
+            utc_offset,
+            skip_unmonitored,
+        ),
+        "ended": (find_ended_shows, tmdb_api_key),
+    }
 
-        # Add to excluded IDs
-        for show in season_finale_shows:
-            if show.get("tvdbId"):
-                all_excluded_tvdb_ids.add(show["tvdbId"])
 
-        if season_finale_shows:
-            print(
-                f"{GREEN}Shows with a season finale that aired within the past {recent_days_season_finale} days:{RESET}"
-            )
-            for show in season_finale_shows:
-                print(
-                    f"- {show['title']} (S{show['seasonNumber']}E{show['episodeNumber']}) aired on {show['airDate']}"
-                )
+def generate_tv_outputs(
+    config,
+    sonarr_instances,
+    tmdb_api_key,
+    checkpoint,
+    writer,
+    base_dir=None,
+    profile=None,
+):
+    """Classify the Sonarr snapshot with one profile's settings and queue its TV files.
+
+    ``config`` holds the (profile) settings, ``base_dir`` the output directory
+    and ``profile`` the profile name used to keep its checkpointed categories
+    apart. Sonarr data comes from the shared run snapshot, so calling this for
+    several profiles doesn't fetch anything again.
+    """
+    category_prefix = f"{profile}:" if profile else ""
+
+    settings = get_tv_settings(config)
+    future_days_new_season = settings["future_days_new_season"]
+    future_days_new_show = settings["future_days_new_show"]
+    future_days_upcoming_episode = settings["future_days_upcoming_episode"]
+    future_days_upcoming_finale = settings["future_days_upcoming_finale"]
+    recent_days_season_finale = settings["recent_days_season_finale"]
+    recent_days_final_episode = settings["recent_days_final_episode"]
+    utc_offset = settings["utc_offset"]
+    skip_unmonitored = settings["skip_unmonitored"]
+    labels = settings["labels"]
+    episode_categories = get_episode_categories(settings, tmdb_api_key)
+
+    # Print chosen values
+    print(f"future_days_new_show: {future_days_new_show}")
+    print(f"future_days_new_season: {future_days_new_season}")
+    print(f"future_days_upcoming_episode: {future_days_upcoming_episode}")
+    print(f"future_days_upcoming_finale: {future_days_upcoming_finale}")
+    print(f"recent_days_season_finale: {recent_days_season_finale}")
+    print(f"recent_days_final_episode: {recent_days_final_episode}")
+    print(f"skip_unmonitored: {skip_unmonitored}\n")
+    print(f"UTC offset: {utc_offset} hours\n")
+
+    # Track all tvdbIds to exclude from other categories
+    all_excluded_tvdb_ids = set()
+
+    # ---- Recent Season Finales ----
+    season_finale_shows = checkpoint.run_category(
+        f"{category_prefix}season_finale",
+        find_across_instances,
+        sonarr_instances,
+        *episode_categories["season_finale"],
+    )
 
-        create_overlay_yaml(
-            "TSSK_TV_SEASON_FINALE_OVERLAYS.yml",
-            season_finale_shows,
-            {
-                "backdrop": config.get("backdrop_season_finale", {}),
-                "text": config.get("text_season_finale", {}),
-            },
-        )
+    # Add to excluded IDs
+    for show in season_finale_shows:
+        if show.get("tvdbId"):
+            all_excluded_tvdb_ids.add(show["tvdbId"])
 
-        create_collection_yaml(
-            "TSSK_TV_SEASON_FINALE_COLLECTION.yml", season_finale_shows, config
+    if season_finale_shows:
+        print(
+            f"{GREEN}Shows with a season finale that aired within the past {recent_days_season_finale} days:{RESET}"
         )
+        for show in season_finale_shows:
+            print(
+                f"- {show['title']} (S{show['seasonNumber']}E{show['episodeNumber']}) aired on {show['airDate']}"
+            )
 
-        # ---- Recent Final Episodes ----
-        final_episode_shows = find_recent_final_episodes(
-            sonarr_url, sonarr_api_key, recent_days_final_episode, utc_offset
-        )
+    writer.submit(
+        create_overlay_yaml,
+        "TSSK_TV_SEASON_FINALE_OVERLAYS.yml",
+        season_finale_shows,
+        {
+            "backdrop": config.get("backdrop_season_finale", {}),
+            "text": config.get("text_season_finale", {}),
+        },
+        base_dir=base_dir,
+        labels=labels,
+    )
 
-        # Add to excluded IDs
-        for show in final_episode_shows:
-            if show.get("tvdbId"):
-                all_excluded_tvdb_ids.add(show["tvdbId"])
+    writer.submit(
+        create_collection_yaml,
+        "TSSK_TV_SEASON_FINALE_COLLECTION.yml",
+        season_finale_shows,
+        config,
+        base_dir=base_dir,
+        labels=labels,
+    )
 
-        if final_episode_shows:
-            print(
-                f"\n{GREEN}Shows with a final episode that aired within the past {recent_days_final_episode} days:{RESET}"
-            )
-            for show in final_episode_shows:
-                print(
-                    f"- {show['title']} (S{show['seasonNumber']}E{show['episodeNumber']}) aired on {show['airDate']}"
-                )
+    # ---- Recent Final Episodes ----
+    final_episode_shows = checkpoint.run_category(
+        f"{category_prefix}final_episode",
+        find_across_instances,
+        sonarr_instances,
+        *episode_categories["final_episode"],
+    )
 
-        create_overlay_yaml(
-            "TSSK_TV_FINAL_EPISODE_OVERLAYS.yml",
-            final_episode_shows,
-            {
-                "backdrop": config.get("backdrop_final_episode", {}),
-                "text": config.get("text_final_episode", {}),
-            },
-        )
+    # Add to excluded IDs
+    for show in final_episode_shows:
+        if show.get("tvdbId"):
+            all_excluded_tvdb_ids.add(show["tvdbId"])
 
-        create_collection_yaml(
-            "TSSK_TV_FINAL_EPISODE_COLLECTION.yml", final_episode_shows, config
+    if final_episode_shows:
+        print(
+            f"\n{GREEN}Shows with a final episode that aired within the past {recent_days_final_episode} days:{RESET}"
         )
+        for show in final_episode_shows:
+            print(
+                f"- {show['title']} (S{show['seasonNumber']}E{show['episodeNumber']}) aired on {show['airDate']}"
+            )
 
-        # Track all tvdbIds to exclude from the "returning" category
-        all_included_tvdb_ids = set()
+    writer.submit(
+        create_overlay_yaml,
+        "TSSK_TV_FINAL_EPISODE_OVERLAYS.yml",
+        final_episode_shows,
+        {
+            "backdrop": config.get("backdrop_final_episode", {}),
+            "text": config.get("text_final_episode", {}),
+        },
+        base_dir=base_dir,
+        labels=labels,
+    )
 
+    writer.submit(
+        create_collection_yaml,
+        "TSSK_TV_FINAL_EPISODE_COLLECTION.yml",
+        final_episode_shows,
+        config,
+        base_dir=base_dir,
+        labels=labels,
+    )
 
-        # ---- New Season and New Show ----
-        search_days = max(future_days_new_season, future_days_new_show)
-        matched_shows, skipped_shows = find_new_season_shows(
-            sonarr_url,
-            sonarr_api_key,
-            search_days,
-            utc_offset,
-            skip_unmonitored,
-        )
+    # Track all tvdbIds to exclude from the "returning" category
+    all_included_tvdb_ids = set()
 
-        new_show_shows = [s for s in skipped_shows if s.get("reason") == "New show (Season 1)"]
-        skipped_shows = [s for s in skipped_shows if s.get("reason") != "New show (Season 1)"]
-
-        cutoff_new_season = (
-            datetime.now(timezone.utc) + timedelta(days=future_days_new_season)
-        ).date().isoformat()
-        cutoff_new_show = (
-            datetime.now(timezone.utc) + timedelta(days=future_days_new_show)
-        ).date().isoformat()
-
-        matched_shows = [
-            show
-            for show in matched_shows
-            if show.get("tvdbId") not in all_excluded_tvdb_ids
-            and show.get("airDate") <= cutoff_new_season
-        ]
-        new_show_shows = [
-            show
-            for show in new_show_shows
-            if show.get("tvdbId") not in all_excluded_tvdb_ids
-            and show.get("airDate") <= cutoff_new_show
-        ]
 
-        for show in matched_shows + new_show_shows:
-            if show.get("tvdbId"):
-                all_included_tvdb_ids.add(show["tvdbId"])
+    # ---- New Season and New Show ----
+    matched_shows, skipped_shows = checkpoint.run_category(
+        f"{category_prefix}new_season",
+        find_across_instances,
+        sonarr_instances,
+        *episode_categories["new_season"],
+    )
 
-        if matched_shows:
+    new_show_shows = [s for s in skipped_shows if s.get("reason") == "New show (Season 1)"]
+    skipped_shows = [s for s in skipped_shows if s.get("reason") != "New show (Season 1)"]
+
+    cutoff_new_season = (
+        datetime.now(timezone.utc) + timedelta(days=future_days_new_season)
+    ).date().isoformat()
+    cutoff_new_show = (
+        datetime.now(timezone.utc) + timedelta(days=future_days_new_show)
+    ).date().isoformat()
+
+    matched_shows = [
+        show
+        for show in matched_shows
+        if show.get("tvdbId") not in all_excluded_tvdb_ids
+        and show.get("airDate") <= cutoff_new_season
+    ]
+    new_show_shows = [
+        show
+        for show in new_show_shows
+        if show.get("tvdbId") not in all_excluded_tvdb_ids
+        and show.get("airDate") <= cutoff_new_show
+    ]
+
+    for show in matched_shows + new_show_shows:
+        if show.get("tvdbId"):
+            all_included_tvdb_ids.add(show["tvdbId"])
+
+    if matched_shows:
+        print(
+            f"\n{GREEN}Shows with a new season starting within {future_days_new_season} days:{RESET}"
+        )
+        for show in matched_shows:
             print(
-                f"\n{GREEN}Shows with a new season starting within {future_days_new_season} days:{RESET}"
+                f"- {show['title']} (Season {show['seasonNumber']}) airs on {show['airDate']}"
             )
-            for show in matched_shows:
-                print(
-                    f"- {show['title']} (Season {show['seasonNumber']}) airs on {show['airDate']}"
-                )
-        else:
+    else:
+        print(
+            f"\n{RED}No shows with new seasons starting within {future_days_new_season} days.{RESET}"
+        )
+
+    if new_show_shows:
+        print(
+            f"\n{GREEN}New shows starting within {future_days_new_show} days:{RESET}"
+        )
+        for show in new_show_shows:
             print(
-                f"\n{RED}No shows with new seasons starting within {future_days_new_season} days.{RESET}"
+                f"- {show['title']} (Season {show['seasonNumber']}) airs on {show['airDate']}"
             )
+    else:
+        print(
+            f"\n{RED}No new shows starting within {future_days_new_show} days.{RESET}"
+        )
 
-        if new_show_shows:
+    if skipped_shows:
+        print(f"\n{ORANGE}Skipped shows (unmonitored):{RESET}")
+        for show in skipped_shows:
             print(
-                f"\n{GREEN}New shows starting within {future_days_new_show} days:{RESET}"
+                f"- {show['title']} (Season {show['seasonNumber']}) airs on {show['airDate']}"
             )
-            for show in new_show_shows:
-                print(
-                    f"- {show['title']} (Season {show['seasonNumber']}) airs on {show['airDate']}"
-                )
-        else:
+
+    writer.submit(
+        create_overlay_yaml,
+        "TSSK_TV_NEW_SHOW_OVERLAYS.yml",
+        new_show_shows,
+        {
+            "backdrop": config.get("backdrop_new_show", config.get("backdrop", {})),
+            "text": config.get("text_new_show", config.get("text", {})),
+        },
+        base_dir=base_dir,
+        labels=labels,
+    )
+
+    writer.submit(
+        create_collection_yaml,
+        "TSSK_TV_NEW_SHOW_COLLECTION.yml",
+        new_show_shows,
+        config,
+        base_dir=base_dir,
+        labels=labels,
+    )
+
+    writer.submit(
+        create_overlay_yaml,
+        "TSSK_TV_NEW_SEASON_OVERLAYS.yml",
+        matched_shows,
+        {
+            "backdrop": config.get(
+                "backdrop_new_season", config.get("backdrop", {})
+            ),
+            "text": config.get("text_new_season", config.get("text", {})),
+        },
+        base_dir=base_dir,
+        labels=labels,
+    )
+
+    writer.submit(
+        create_collection_yaml,
+        "TSSK_TV_NEW_SEASON_COLLECTION.yml",
+        matched_shows,
+        config,
+        base_dir=base_dir,
+        labels=labels,
+    )
+
+
+    # ---- Upcoming Non-Finale Episodes ----
+    upcoming_eps, skipped_eps = checkpoint.run_category(
+        f"{category_prefix}upcoming_episode",
+        find_across_instances,
+        sonarr_instances,
+        *episode_categories["upcoming_episode"],
+    )
+
+    # Filter out shows that are in the season finale or final episode categories
+    upcoming_eps = [
+        show
+        for show in upcoming_eps
+        if show.get("tvdbId") not in all_excluded_tvdb_ids
+    ]
+
+    # Add to excluded IDs for returning category
+    for show in upcoming_eps:
+        if show.get("tvdbId"):
+            all_included_tvdb_ids.add(show["tvdbId"])
+
+    if upcoming_eps:
+        print(
+            f"\n{GREEN}Shows with upcoming non-finale episodes within {future_days_upcoming_episode} days:{RESET}"
+        )
+        for show in upcoming_eps:
             print(
-                f"\n{RED}No new shows starting within {future_days_new_show} days.{RESET}"
+                f"- {show['title']} (S{show['seasonNumber']}E{show['episodeNumber']}) airs on {show['airDate']}"
             )
 
-        if skipped_shows:
-            print(f"\n{ORANGE}Skipped shows (unmonitored):{RESET}")
-            for show in skipped_shows:
-                print(
-                    f"- {show['title']} (Season {show['seasonNumber']}) airs on {show['airDate']}"
-                )
+    writer.submit(
+        create_overlay_yaml,
+        "TSSK_TV_UPCOMING_EPISODE_OVERLAYS.yml",
+        upcoming_eps,
+        {
+            "backdrop": config.get("backdrop_upcoming_episode", {}),
+            "text": config.get("text_upcoming_episode", {}),
+        },
+        base_dir=base_dir,
+        labels=labels,
+    )
 
-        create_overlay_yaml(
-            "TSSK_TV_NEW_SHOW_OVERLAYS.yml",
-            new_show_shows,
-            {
-                "backdrop": config.get("backdrop_new_show", config.get("backdrop", {})),
-                "text": config.get("text_new_show", config.get("text", {})),
-            },
-        )
+    writer.submit(
+        create_collection_yaml,
+        "TSSK_TV_UPCOMING_EPISODE_COLLECTION.yml",
+        upcoming_eps,
+        config,
+        base_dir=base_dir,
+        labels=labels,
+    )
 
-        create_collection_yaml(
-            "TSSK_TV_NEW_SHOW_COLLECTION.yml", new_show_shows, config
-        )
+    # ---- Upcoming Finale Episodes ----
+    finale_eps, skipped_finales = checkpoint.run_category(
+        f"{category_prefix}upcoming_finale",
+        find_across_instances,
+        sonarr_instances,
+        *episode_categories["upcoming_finale"],
+    )
 
-        create_overlay_yaml(
-            "TSSK_TV_NEW_SEASON_OVERLAYS.yml",
-            matched_shows,
-            {
-                "backdrop": config.get(
-                    "backdrop_new_season", config.get("backdrop", {})
-                ),
-                "text": config.get("text_new_season", config.get("text", {})),
-            },
-        )
+    # Filter out shows that are in the season finale or final episode categories
+    finale_eps = [
+        show
+        for show in finale_eps
+        if show.get("tvdbId") not in all_excluded_tvdb_ids
+    ]
+
+    # Add to excluded IDs for returning category
+    for show in finale_eps:
+        if show.get("tvdbId"):
+            all_included_tvdb_ids.add(show["tvdbId"])
 
-        create_collection_yaml(
-            "TSSK_TV_NEW_SEASON_COLLECTION.yml", matched_shows, config
+    if finale_eps:
+        print(
+            f"\n{GREEN}Shows with upcoming season finales within {future_days_upcoming_finale} days:{RESET}"
         )
+        for show in finale_eps:
+            print(
+                f"- {show['title']} (S{show['seasonNumber']}E{show['episodeNumber']}) airs on {show['airDate']}"
+            )
 
+    writer.submit(
+        create_overlay_yaml,
+        "TSSK_TV_UPCOMING_FINALE_OVERLAYS.yml",
+        finale_eps,
+        {
+            "backdrop": config.get("backdrop_upcoming_finale", {}),
+            "text": config.get("text_upcoming_finale", {}),
+        },
+        base_dir=base_dir,
+        labels=labels,
+    )
 
-        # ---- Upcoming Non-Finale Episodes ----
-        upcoming_eps, skipped_eps = find_upcoming_regular_episodes(
-            sonarr_url,
-            sonarr_api_key,
-            future_days_upcoming_episode,
-            utc_offset,
-            skip_unmonitored,
-        )
+    writer.submit(
+        create_collection_yaml,
+        "TSSK_TV_UPCOMING_FINALE_COLLECTION.yml",
+        finale_eps,
+        config,
+        base_dir=base_dir,
+        labels=labels,
+    )
 
-        # Filter out shows that are in the season finale or final episode categories
-        upcoming_eps = [
-            show
-            for show in upcoming_eps
-            if show.get("tvdbId") not in all_excluded_tvdb_ids
-        ]
+    # ---- Ended Shows ----
+    # The find_ended_shows function doesn't have a skip_unmonitored parameter
+    # as it's based on show status rather than monitoring status
+    ended_shows, cancelled_shows = checkpoint.run_category(
+        f"{category_prefix}ended",
+        find_across_instances,
+        sonarr_instances,
+        *episode_categories["ended"],
+    )
 
-        # Add to excluded IDs for returning category
-        for show in upcoming_eps:
-            if show.get("tvdbId"):
-                all_included_tvdb_ids.add(show["tvdbId"])
+    # Filter out shows that are in the season finale or final episode categories
+    ended_shows = [
+        show
+        for show in ended_shows
+        if show.get("tvdbId") not in all_excluded_tvdb_ids
+    ]
+
+    cancelled_shows = [
+        show
+        for show in cancelled_shows
+        if show.get("tvdbId") not in all_excluded_tvdb_ids
+    ]
+
+    # Add to excluded IDs for returning category
+    for show in ended_shows:
+        if show.get("tvdbId"):
+            all_included_tvdb_ids.add(show["tvdbId"])
+
+    for show in cancelled_shows:
+        if show.get("tvdbId"):
+            all_included_tvdb_ids.add(show["tvdbId"])
+
+    #        if ended_shows:
+    #            print(f"\n{GREEN}Shows that have ended:{RESET}")
+    #            for show in ended_shows:
+    #                print(f"- {show['title']}")
+
+    writer.submit(
+        create_overlay_yaml,
+        "TSSK_TV_ENDED_OVERLAYS.yml",
+        ended_shows,
+        {
+            "backdrop": config.get("backdrop_ended", {}),
+            "text": config.get("text_ended", {}),
+        },
+        base_dir=base_dir,
+        labels=labels,
+    )
+
+    writer.submit(
+        create_collection_yaml,
+        "TSSK_TV_ENDED_COLLECTION.yml",
+        ended_shows,
+        config,
+        base_dir=base_dir,
+        labels=labels,
+    )
 
-        if upcoming_eps:
+    # ---- Cancelled Shows ----
+    writer.submit(
+        create_overlay_yaml,
+        "TSSK_TV_CANCELLED_OVERLAYS.yml",
+        cancelled_shows,
+        {
+            "backdrop": config.get("backdrop_cancelled", {}),
+            "text": config.get("text_cancelled", {}),
+        },
+        base_dir=base_dir,
+        labels=labels,
+    )
+
+    writer.submit(
+        create_collection_yaml,
+        "TSSK_TV_CANCELLED_COLLECTION.yml",
+        cancelled_shows,
+        config,
+        base_dir=base_dir,
+        labels=labels,
+    )
+
+    # ---- Returning Shows ----
+    returning_shows = checkpoint.run_category(
+        f"{category_prefix}returning",
+        find_across_instances,
+        sonarr_instances,
+        find_returning_shows,
+        all_included_tvdb_ids,
+    )
+
+    # Filter out shows that are in the season finale or final episode categories
+    returning_shows = [
+        show
+        for show in returning_shows
+        if show.get("tvdbId") not in all_excluded_tvdb_ids
+    ]
+
+    #        if returning_shows:
+    #            print(f"\n{GREEN}Shows that are continuing but don't have scheduled episodes:{RESET}")
+    #            for show in returning_shows:
+    #                print(f"- {show['title']}")
+
+    writer.submit(
+        create_overlay_yaml,
+        "TSSK_TV_RETURNING_OVERLAYS.yml",
+        returning_shows,
+        {
+            "backdrop": config.get("backdrop_returning", {}),
+            "text": config.get("text_returning", {}),
+        },
+        base_dir=base_dir,
+        labels=labels,
+    )
+
+    writer.submit(
+        create_collection_yaml,
+        "TSSK_TV_RETURNING_COLLECTION.yml",
+        returning_shows,
+        config,
+        base_dir=base_dir,
+        labels=labels,
+    )
+
+
+def format_bytes(size):
+    for unit in ("B", "KB", "MB"):
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GB"
+
+
+def print_membership_changes(changes, previous):
+    since = f"the last run ({previous.created})" if previous.created else "the last run"
+    if not changes:
+        print(f"\n{GREEN}No category changes since {since}.{RESET}")
+        return
+
+    print(f"\n{BOLD}Category changes since {since}:{RESET}")
+    for category, change in changes.items():
+        print(
+            f"\n{BLUE}{category}{RESET}: {len(change['added'])} added, {len(change['removed'])} removed"
+        )
+        for item in change["added"]:
+            print(f"{GREEN}+ {item['title']} ({item['id']}){RESET}")
+        for item in change["removed"]:
+            print(f"{RED}- {item['title']} ({item['id']}){RESET}")
+
+
+class CategoryRecorder:
+    """Stands in for OutputWriter and keeps each category's shows instead of writing them."""
+
+    def __init__(self):
+        self.categories = {}
+
+    def submit(self, func, output_file, items, *args, **kwargs):
+        self.categories[category_name(output_file)] = items
+
+
+def load_cached_snapshot(config, store):
+    """Load the Sonarr library stored by the last run into the run snapshot.
+
+    Nothing is requested from Sonarr. Returns the configured Sonarr instances
+    that have cached data, with their stored API url.
+    """
+    stored_urls = store.instance_urls()
+    instances = []
+    for instance in get_arr_instances(config, "sonarr"):
+        base_url = sonarr_base_url(instance["url"])
+        url = next(
+            (
+                f"{base_url}{path}"
+                for path in SONARR_API_PATHS
+                if f"{base_url}{path}" in stored_urls
+            ),
+            None,
+        )
+        if url is None:
             print(
-                f"\n{GREEN}Shows with upcoming non-finale episodes within {future_days_upcoming_episode} days:{RESET}"
+                f"{ORANGE}No cached data for Sonarr instance {instance['name']} - run TSSK once first{RESET}"
+            )
+            continue
+        instances.append({**instance, "url": url})
+        # Queries stay offline, so only tag ids (not names) can be filtered on
+        set_scope_filter(url, instance["api_key"], instance["filters"], offline=True)
+
+    checkpoint = get_checkpoint()
+    series_lists = dedupe_instance_series(
+        instances,
+        [
+            apply_scope_filter(instance["url"], store.load_series(instance["url"]))
+            for instance in instances
+        ],
+    )
+    for instance, series_list in zip(instances, series_lists):
+        checkpoint.record_series(instance["url"], series_list)
+        episodes = store.load_episodes(instance["url"])
+        for series in series_list:
+            checkpoint.record_episodes(
+                instance["url"], series["id"], episodes.get(series["id"], [])
             )
-            for show in upcoming_eps:
-                print(
-                    f"- {show['title']} (S{show['seasonNumber']}E{show['episodeNumber']}) airs on {show['airDate']}"
-                )
 
-        create_overlay_yaml(
-            "TSSK_TV_UPCOMING_EPISODE_OVERLAYS.yml",
-            upcoming_eps,
-            {
-                "backdrop": config.get("backdrop_upcoming_episode", {}),
-                "text": config.get("text_upcoming_episode", {}),
-            },
+    print_scope_warnings()
+
+    # TMDB results of the last run, so the ended/cancelled split needs no lookups
+    _tmdb_id_cache.update(store.load_tmdb_ids())
+    _tmdb_status_cache.update(store.load_tmdb_statuses())
+    return instances
+
+
+def classify_snapshot(config, sonarr_instances, tmdb_api_key):
+    """Run the normal TV classification on the snapshot; returns ``{category: shows}``."""
+    recorder = CategoryRecorder()
+    with contextlib.redirect_stdout(io.StringIO()):
+        generate_tv_outputs(
+            config, sonarr_instances, tmdb_api_key, get_checkpoint(), recorder
+        )
+    return recorder.categories
+
+
+def describe_show(show):
+    parts = []
+    if show.get("seasonNumber") is not None and show.get("episodeNumber") is not None:
+        parts.append(f"S{show['seasonNumber']:02d}E{show['episodeNumber']:02d}")
+    if show.get("airDate"):
+        parts.append(f"on {show['airDate']}")
+    if show.get("reason"):
+        parts.append(f"({show['reason']})")
+    return " ".join(parts)
+
+
+# Labels for finders that return (matched, skipped) or (ended, cancelled)
+QUERY_RESULT_PARTS = {
+    "new_season": ("new season", "new show / skipped new season"),
+    "upcoming_episode": ("upcoming episode", "skipped upcoming episode"),
+    "upcoming_finale": ("upcoming finale", "skipped upcoming finale"),
+    "ended": ("ended", "cancelled"),
+}
+
+
+def query_show(tvdb_id, sonarr_instances, categories, utc_offset, store):
+    checkpoint = get_checkpoint()
+    for instance in sonarr_instances:
+        series = next(
+            (
+                s
+                for s in checkpoint.get_series(instance["url"])
+                if s.get("tvdbId") == tvdb_id
+            ),
+            None,
         )
+        if series:
+            break
+    else:
+        print(f"{RED}tvdb {tvdb_id} is not in the cached Sonarr library{RESET}")
+        return 1
 
-        create_collection_yaml(
-            "TSSK_TV_UPCOMING_EPISODE_COLLECTION.yml", upcoming_eps, config
+    print(f"{BOLD}{series['title']}{RESET} (tvdb {tvdb_id}, Sonarr instance {instance['name']})")
+    print(
+        f"Sonarr status: {series.get('status')}, "
+        f"monitored: {'yes' if series.get('monitored', True) else 'no'}"
+    )
+    tmdb_id = series.get("tmdbId") or _tmdb_id_cache.get(tvdb_id)
+    if tmdb_id in _tmdb_status_cache:
+        print(f"TMDB status: {_tmdb_status_cache[tmdb_id]}")
+
+    now_local = datetime.now(timezone.utc) + timedelta(hours=utc_offset)
+    aired, upcoming = [], []
+    for ep in checkpoint.get_episodes(instance["url"], series["id"]) or []:
+        air_date = convert_utc_to_local(ep.get("airDateUtc"), utc_offset)
+        if not ep.get("seasonNumber") or air_date is None:
+            continue
+        (aired if air_date <= now_local else upcoming).append((air_date, ep))
+    if aired:
+        air_date, ep = max(aired, key=lambda x: x[0])
+        print(
+            f"Last aired: S{ep['seasonNumber']:02d}E{ep['episodeNumber']:02d} on {air_date.date()}"
+            f"{'' if ep.get('hasFile') else ' (not downloaded)'}"
+        )
+    if upcoming:
+        air_date, ep = min(upcoming, key=lambda x: x[0])
+        print(f"Next airing: S{ep['seasonNumber']:02d}E{ep['episodeNumber']:02d} on {air_date.date()}")
+
+    print(f"\n{BLUE}Matched by (in evaluation order):{RESET}")
+    matched = 0
+    for name, result in checkpoint.categories.items():
+        parts = result if isinstance(result, tuple) else (result,)
+        labels = QUERY_RESULT_PARTS.get(name, (name.replace("_", " "),))
+        for label, shows in zip(labels, parts):
+            for show in shows:
+                if show.get("tvdbId") == tvdb_id:
+                    matched += 1
+                    print(f"- {label} {describe_show(show)}".rstrip())
+    if not matched:
+        print("- nothing")
+
+    print(f"\n{BLUE}Category files:{RESET}")
+    found = [
+        (name, show)
+        for name, shows in categories.items()
+        for show in shows
+        if show.get("tvdbId") == tvdb_id
+    ]
+    for name, show in found:
+        print(f"- {GREEN}{name}{RESET} {describe_show(show)}".rstrip())
+    if not found:
+        print("- none")
+    if matched > len(found):
+        print(
+            f"\n{ORANGE}Shows already in an earlier category (or outside a category's "
+            f"days window) are left out of later ones.{RESET}"
         )
 
-        # ---- Upcoming Finale Episodes ----
-        finale_eps, skipped_finales = find_upcoming_finales(
-            sonarr_url,
-            sonarr_api_key,
-            future_days_upcoming_finale,
-            utc_offset,
-            skip_unmonitored,
+    history = store.category_history(tvdb_id)
+    if history:
+        print(f"\n{BLUE}Categories in the last runs (newest first):{RESET}")
+        for finished_at, run_categories in history:
+            print(f"- {finished_at}: {', '.join(run_categories) or 'none'}")
+    return 0
+
+
+def query_date(day, sonarr_instances, categories, utc_offset, store):
+    checkpoint = get_checkpoint()
+    # Only the series each instance kept after deduplication
+    kept = {
+        (instance["url"], series["id"])
+        for instance in sonarr_instances
+        for series in checkpoint.get_series(instance["url"])
+    }
+    in_categories = defaultdict(list)
+    for name, shows in categories.items():
+        for show in shows:
+            in_categories[show.get("tvdbId")].append(name)
+
+    start = datetime(day.year, day.month, day.day, tzinfo=timezone.utc) - timedelta(
+        hours=utc_offset
+    )
+    rows = store.episodes_airing_between(
+        int(start.timestamp()), int((start + timedelta(days=1)).timestamp())
+    )
+    rows = [row for row in rows if (row["instance_url"], row["series_id"]) in kept]
+
+    print(f"{BOLD}Episodes airing on {day.isoformat()}:{RESET}")
+    for row in rows:
+        air_time = convert_utc_to_local(row["air_date_utc"], utc_offset).strftime("%H:%M")
+        categories_str = ", ".join(in_categories.get(row["tvdb_id"], [])) or "-"
+        print(
+            f"- {row['title']} S{row['season_number']:02d}E{row['episode_number']:02d} "
+            f"at {air_time} [{categories_str}]"
         )
+    if not rows:
+        print("- none")
+    return 0
 
-        # Filter out shows that are in the season finale or final episode categories
-        finale_eps = [
-            show
-            for show in finale_eps
-            if show.get("tvdbId") not in all_excluded_tvdb_ids
-        ]
 
-        # Add to excluded IDs for returning category
-        for show in finale_eps:
-            if show.get("tvdbId"):
-                all_included_tvdb_ids.add(show["tvdbId"])
+def query_finales(days, sonarr_instances, utc_offset):
+    """Print every show's next season finale within ``days`` days, from the cached episodes."""
+    checkpoint = get_checkpoint()
+    now_local = datetime.now(timezone.utc) + timedelta(hours=utc_offset)
+    cutoff = now_local + timedelta(days=days)
+    finales = []
+    for instance in sonarr_instances:
+        for series in checkpoint.get_series(instance["url"]):
+            episodes = [
+                ep
+                for ep in checkpoint.get_episodes(instance["url"], series["id"]) or []
+                if ep.get("seasonNumber")
+            ]
+            # A season's finale is its highest episode number (if it has more than one)
+            last_episode = defaultdict(int)
+            for ep in episodes:
+                season = ep["seasonNumber"]
+                last_episode[season] = max(last_episode[season], ep.get("episodeNumber", 0))
+            upcoming = []
+            for ep in episodes:
+                air_date = convert_utc_to_local(ep.get("airDateUtc"), utc_offset)
+                if (
+                    air_date is not None
+                    and now_local < air_date <= cutoff
+                    and ep.get("episodeNumber", 0) > 1
+                    and ep.get("episodeNumber") == last_episode[ep["seasonNumber"]]
+                ):
+                    upcoming.append((air_date, ep))
+            if not upcoming:
+                continue
 
-        if finale_eps:
-            print(
-                f"\n{GREEN}Shows with upcoming season finales within {future_days_upcoming_finale} days:{RESET}"
+            air_date, ep = min(upcoming, key=lambda x: x[0])
+            season_monitored = next(
+                (
+                    season.get("monitored", True)
+                    for season in series.get("seasons", [])
+                    if season.get("seasonNumber") == ep["seasonNumber"]
+                ),
+                True,
             )
-            for show in finale_eps:
-                print(
-                    f"- {show['title']} (S{show['seasonNumber']}E{show['episodeNumber']}) airs on {show['airDate']}"
-                )
+            notes = []
+            if ep.get("hasFile"):
+                notes.append("downloaded")
+            if not ep.get("monitored", True) or not season_monitored:
+                notes.append("unmonitored")
+            show = {
+                "title": series["title"],
+                "seasonNumber": ep["seasonNumber"],
+                "episodeNumber": ep["episodeNumber"],
+                "airDate": air_date.date().isoformat(),
+            }
+            note = f" ({', '.join(notes)})" if notes else ""
+            finales.append((show, note))
 
-        create_overlay_yaml(
-            "TSSK_TV_UPCOMING_FINALE_OVERLAYS.yml",
-            finale_eps,
-            {
-                "backdrop": config.get("backdrop_upcoming_finale", {}),
-                "text": config.get("text_upcoming_finale", {}),
-            },
-        )
+    print(f"{BOLD}Next season finale per show within {days} days:{RESET}")
+    for show, note in sorted(finales, key=lambda x: (x[0]["airDate"], x[0]["title"])):
+        print(f"- {show['title']} {describe_show(show)}{note}")
+    if not finales:
+        print("- none")
+    return 0
 
-        create_collection_yaml(
-            "TSSK_TV_UPCOMING_FINALE_COLLECTION.yml", finale_eps, config
-        )
 
-        # ---- Ended Shows ----
-        # The find_ended_shows function doesn't have a skip_unmonitored parameter
-        # as it's based on show status rather than monitoring status
-        ended_shows, cancelled_shows = find_ended_shows(
-            sonarr_url, sonarr_api_key, tmdb_api_key
+def run_query(args):
+    """Answer a ``query`` subcommand from the state store, without contacting Sonarr."""
+    config = load_config("config/config.yml")
+    profiles = get_output_profiles(config)
+    if args.output_profile:
+        profiles = [p for p in profiles if p[0] == args.output_profile]
+        if not profiles:
+            print(f"{RED}Unknown profile: {args.output_profile}{RESET}")
+            return 1
+    profile, profile_config, base_dir = profiles[0]
+    utc_offset = float(profile_config.get("utc_offset", 0))
+
+    # Queries only read: TMDB lookups and validators stay in memory
+    store = get_state_store(snapshot=True)
+    try:
+        sonarr_instances = load_cached_snapshot(config, store)
+        if not sonarr_instances:
+            print(f"{RED}No cached Sonarr data found in {store.path}{RESET}")
+            return 1
+
+        if args.query == "finales":
+            return query_finales(args.days, sonarr_instances, utc_offset)
+
+        categories = classify_snapshot(
+            profile_config, sonarr_instances, config.get("tmdb_api_key")
         )
+        if args.query == "show":
+            return query_show(
+                args.tvdb_id, sonarr_instances, categories, utc_offset, store
+            )
+        day = args.date or (datetime.now(timezone.utc) + timedelta(hours=utc_offset)).date()
+        return query_date(day, sonarr_instances, categories, utc_offset, store)
+    finally:
+        close_state_store()
 
-        # Filter out shows that are in the season finale or final episode categories
-        ended_shows = [
-            show
-            for show in ended_shows
-            if show.get("tvdbId") not in all_excluded_tvdb_ids
-        ]
 
-        cancelled_shows = [
-            show
-            for show in cancelled_shows
-            if show.get("tvdbId") not in all_excluded_tvdb_ids
-        ]
+def iso_date(value):
+    return datetime.strptime(value, "%Y-%m-%d").date()
 
-        # Add to excluded IDs for returning category
-        for show in ended_shows:
-            if show.get("tvdbId"):
-                all_included_tvdb_ids.add(show["tvdbId"])
-
-        for show in cancelled_shows:
-            if show.get("tvdbId"):
-                all_included_tvdb_ids.add(show["tvdbId"])
-
-        #        if ended_shows:
-        #            print(f"\n{GREEN}Shows that have ended:{RESET}")
-        #            for show in ended_shows:
-        #                print(f"- {show['title']}")
-
-        create_overlay_yaml(
-            "TSSK_TV_ENDED_OVERLAYS.yml",
-            ended_shows,
-            {
-                "backdrop": config.get("backdrop_ended", {}),
-                "text": config.get("text_ended", {}),
-            },
-        )
 
-        create_collection_yaml("TSSK_TV_ENDED_COLLECTION.yml", ended_shows, config)
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Create Kometa collection and overlay files from Sonarr/Radarr."
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="compute all categories and show what changed since the last run without writing any files",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="profile every phase (cProfile, sampled stacks, tracemalloc) into <output dir>/profile; phases still run concurrently",
+    )
+    parser.add_argument(
+        "--json",
+        action="store_true",
+        help="with --dry-run, print the changes as JSON on stdout (other output goes to stderr)",
+    )
+    cassette = parser.add_mutually_exclusive_group()
+    cassette.add_argument(
+        "--record",
+        metavar="CASSETTE",
+        help="save every API response (API keys scrubbed) and the config to a compressed cassette file",
+    )
+    cassette.add_argument(
+        "--replay",
+        metavar="CASSETTE",
+        help="run offline from a recorded cassette, with its config and clock",
+    )
 
-        # ---- Cancelled Shows ----
-        create_overlay_yaml(
-            "TSSK_TV_CANCELLED_OVERLAYS.yml",
-            cancelled_shows,
-            {
-                "backdrop": config.get("backdrop_cancelled", {}),
-                "text": config.get("text_cancelled", {}),
-            },
+    subparsers = parser.add_subparsers(dest="command")
+    query = subparsers.add_parser(
+        "query",
+        help="answer questions from the data cached by the last run, without contacting Sonarr",
+    )
+    query.add_argument(
+        "--output-profile",
+        help="use this output profile's settings (default: the first one)",
+    )
+    queries = query.add_subparsers(dest="query", required=True)
+    show = queries.add_parser("show", help="which categories a show is in and why")
+    show.add_argument("tvdb_id", type=int)
+    on_date = queries.add_parser("date", help="shows with an episode airing on a date")
+    on_date.add_argument(
+        "date", nargs="?", type=iso_date, help="YYYY-MM-DD (default: today)"
+    )
+    finales = queries.add_parser(
+        "finales", help="the next season finale per show, downloaded or not"
+    )
+    finales.add_argument(
+        "--days", type=int, default=365, help="how far ahead to look (default: 365)"
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.command == "query":
+        sys.exit(run_query(args))
+
+    console = sys.stdout
+    if args.json:
+        # Keep stdout clean for the JSON document
+        sys.stdout = sys.stderr
+
+    cassette = replay_dir = None
+    overlay_state_path = OVERLAY_STATE_PATH
+    if args.replay:
+        global datetime
+        cassette = Cassette.load(args.replay)
+        # Classify as of the recording, whenever it is replayed
+        datetime = shifted_datetime(cassette.recorded)
+        movies_history.datetime = movies_upcoming.datetime = datetime
+        # Files and state of a replay go to a temporary directory, never
+        # over the real ones
+        replay_dir = tempfile.mkdtemp(prefix="tssk-replay-")
+        overlay_state_path = os.path.join(replay_dir, "overlay_blocks.json")
+    elif args.record:
+        cassette = Cassette(args.record)
+    if cassette is not None:
+        transport.use_cassette(cassette)
+        # Start from an empty in-memory store so every response is requested
+        # in full and the real state is left alone
+        get_state_store(None, snapshot=True)
+    elif args.dry_run:
+        # Read the state of earlier runs without writing anything back
+        get_state_store(snapshot=True)
+
+    start_time = datetime.now()
+    if args.profile:
+        start_profiler(
+            os.path.join(DEFAULT_OUTPUT_DIR, "profile", start_time.strftime("%Y%m%d-%H%M%S"))
         )
+    print(f"{BLUE}{'*' * 40}\n{'*' * 15} TSSK {VERSION} {'*' * 15}\n{'*' * 40}{RESET}")
+    check_for_updates()
 
-        create_collection_yaml("TSSK_TV_CANCELLED_COLLECTION.yml", cancelled_shows, config)
+    if args.replay:
+        config = cassette.config
+        print(f"Replaying {args.replay} recorded at {cassette.recorded.isoformat(timespec='seconds')}\n")
+    else:
+        config = load_config("config/config.yml")
+    if args.record:
+        cassette.config = config
+
+    # TMDB ids don't change, so reuse the ones resolved by earlier runs
+    store = get_state_store()
+    _tmdb_id_cache.update(
+        (tvdb_id, tmdb_id)
+        for tvdb_id, tmdb_id in store.load_tmdb_ids().items()
+        if tmdb_id
+    )
 
-        # ---- Returning Shows ----
-        returning_shows = find_returning_shows(
-            sonarr_url, sonarr_api_key, all_included_tvdb_ids
+    # Resume an interrupted run with the same settings if one was checkpointed
+    config_fingerprint = hashlib.sha1(
+        json.dumps([VERSION, config], sort_keys=True, default=str).encode("utf-8")
+    ).hexdigest()
+    # A dry run writes nothing, so it only keeps the in-memory snapshot
+    if args.dry_run:
+        checkpoint = get_checkpoint()
+    else:
+        # A cassette run starts from scratch and leaves no checkpoint behind
+        checkpoint = start_checkpoint(
+            config_fingerprint, path=None if cassette else CHECKPOINT_PATH
+        )
+    if checkpoint.resumed:
+        resumed_at = datetime.fromtimestamp(checkpoint.created).strftime("%H:%M:%S")
+        print(
+            f"{ORANGE}Resuming the interrupted run started at {resumed_at} "
+            f"({sum(len(e) for e in checkpoint.episodes.values())} series fetched, "
+            f"{len(checkpoint.categories)} categories and {len(checkpoint.outputs)} files done){RESET}\n"
         )
 
-        # Filter out shows that are in the season finale or final episode categories
-        returning_shows = [
-            show
-            for show in returning_shows
-            if show.get("tvdbId") not in all_excluded_tvdb_ids
-        ]
+    # YAML files are written from a pool while the next category is computed
+    membership = Membership()
+    writer = OutputWriter(
+        checkpoint=checkpoint, membership=membership, dry_run=args.dry_run
+    )
+    movie_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="tssk-movies")
+    movie_futures = {}
 
-        #        if returning_shows:
-        #            print(f"\n{GREEN}Shows that are continuing but don't have scheduled episodes:{RESET}")
-        #            for show in returning_shows:
-        #                print(f"- {show['title']}")
-
-        create_overlay_yaml(
-            "TSSK_TV_RETURNING_OVERLAYS.yml",
-            returning_shows,
-            {
-                "backdrop": config.get("backdrop_returning", {}),
-                "text": config.get("text_returning", {}),
-            },
-        )
+    try:
+        # Process and validate the Sonarr URLs
+        sonarr_instances = get_arr_instances(config, "sonarr")
+        if not sonarr_instances:
+            raise ConnectionError("No Sonarr instance configured (sonarr_url / sonarr_api_key).")
+        for instance in sonarr_instances:
+            instance["url"] = process_sonarr_url(instance["url"], instance["api_key"])
+            set_scope_filter(instance["url"], instance["api_key"], instance["filters"])
 
-        create_collection_yaml(
-            "TSSK_TV_RETURNING_COLLECTION.yml", returning_shows, config
+        tmdb_api_key = config.get("tmdb_api_key")
+        movie_release_country = config.get("movie_release_country")
+        radarr_instances = get_arr_instances(config, "radarr")
+        for instance in radarr_instances:
+            instance["url"] = process_radarr_url(instance["url"], instance["api_key"])
+            set_scope_filter(instance["url"], instance["api_key"], instance["filters"])
+
+        # The Radarr/TMDB movie features don't depend on any Sonarr results,
+        # so fetch them in the background while the TV categories are built.
+        now_playing_cache_hours = float(
+            config.get("now_playing_cache_hours", NOW_PLAYING_CACHE_HOURS)
         )
-
-        # ---- This Month in History ----
-        if radarr_url and radarr_api_key:
-            month_history = get_this_month_in_history(
-                radarr_url, radarr_api_key, tmdb_api_key, movie_release_country
+        # Every output profile is computed from the same snapshot
+        profiles = get_output_profiles(config)
+        if replay_dir and not args.dry_run:
+            profiles = [
+                (profile, profile_config, os.path.join(replay_dir, "kometa", profile))
+                for profile, profile_config, base_dir in profiles
+            ]
+        # Radarr's calendar is read once for the longest window of any profile
+        release_days = {
+            feature: max(
+                get_release_days(profile_config)[feature]
+                for _, profile_config, _ in profiles
             )
-            month_name = datetime.now().strftime("%B")
-            create_movie_overlay_yaml(
-                "TSSK_THIS_MONTH_IN_HISTORY_OVERLAYS.yml",
-                month_history,
-                {
-                    "backdrop": config.get("backdrop_this_month_in_history", {}),
-                    "text": config.get("text_this_month_in_history", {}),
-                },
+            for feature in RELEASE_FIELDS
+        }
+        for instance in radarr_instances:
+            for feature, func, options in (
+                ("this_month_in_history", get_this_month_in_history, {}),
+                ("in_cinema", get_in_theaters, {"cache_hours": now_playing_cache_hours}),
+            ):
+                movie_futures[(feature, instance["name"])] = movie_pool.submit(
+                    checkpoint.run_category,
+                    f"{feature}:{instance['name']}",
+                    get_profiler().wrap(f"{feature}:{instance['name']}", func),
+                    instance["url"],
+                    instance["api_key"],
+                    tmdb_api_key,
+                    movie_release_country,
+                    **options,
+                )
+            # Upcoming releases only need Radarr's calendar for their window
+            for feature, release_field in RELEASE_FIELDS.items():
+                movie_futures[(feature, instance["name"])] = movie_pool.submit(
+                    checkpoint.run_category,
+                    f"{feature}:{instance['name']}",
+                    get_profiler().wrap(f"{feature}:{instance['name']}", get_upcoming_releases),
+                    instance["url"],
+                    instance["api_key"],
+                    release_field,
+                    release_days[feature],
+                )
+
+        # Only fetch episodes of series that can be in a dated category
+        prefilter_cutoff = (
+            get_prefilter_cutoff(profiles)
+            if config.get("series_prefilter", True)
+            else None
+        )
+        if config.get("streaming_mode", False):
+            stream_sonarr_library(
+                sonarr_instances,
+                profiles,
+                tmdb_api_key,
+                save_cache=not args.dry_run,
+                prefilter_cutoff=prefilter_cutoff,
             )
-            create_movie_collection_yaml(
-                "TSSK_THIS_MONTH_IN_HISTORY_COLLECTION.yml",
-                month_history,
-                config,
-                "collection_this_month_in_history",
-                "This Month in History",
-                f"Movies released in {month_name} in previous years",
+        else:
+            # Fetch every Sonarr instance's library concurrently up front
+            load_sonarr_library(sonarr_instances, prefilter_cutoff)
+        for profile, profile_config, base_dir in profiles:
+            if len(profiles) > 1:
+                print(f"{BLUE}{'=' * 15} Profile: {profile} {'=' * 15}{RESET}\n")
+            generate_tv_outputs(
+                profile_config,
+                sonarr_instances,
+                tmdb_api_key,
+                checkpoint,
+                writer,
+                base_dir,
+                profile if len(profiles) > 1 else None,
             )
 
-            in_theaters = get_in_theaters(
-                radarr_url, radarr_api_key, tmdb_api_key, movie_release_country
+        # ---- This Month in History / In Cinema / upcoming releases ----
+        if radarr_instances:
+            month_history = merge_movie_lists(
+                movie_futures[("this_month_in_history", instance["name"])].result()
+                for instance in radarr_instances
             )
-            create_movie_overlay_yaml(
-                "TSSK_IN_CINEMA_OVERLAYS.yml",
-                in_theaters,
-                {
-                    "backdrop": config.get("backdrop_in_cinema", {}),
-                    "text": config.get("text_in_cinema", {}),
-                },
+            in_theaters = merge_movie_lists(
+                movie_futures[("in_cinema", instance["name"])].result()
+                for instance in radarr_instances
             )
-            create_movie_collection_yaml(
-                "TSSK_IN_CINEMA_COLLECTION.yml",
-                in_theaters,
-                config,
-                "collection_in_cinema",
-                "In Cinema",
-                "Movies currently in cinemas",
+            upcoming_releases = {
+                feature: merge_movie_lists(
+                    movie_futures[(feature, instance["name"])].result()
+                    for instance in radarr_instances
+                )
+                for feature in RELEASE_FIELDS
+            }
+            month_name = datetime.now().strftime("%B")
+
+            for profile, profile_config, base_dir in profiles:
+                writer.submit(
+                    create_movie_overlay_yaml,
+                    "TSSK_THIS_MONTH_IN_HISTORY_OVERLAYS.yml",
+                    month_history,
+                    {
+                        "backdrop": profile_config.get(
+                            "backdrop_this_month_in_history", {}
+                        ),
+                        "text": profile_config.get("text_this_month_in_history", {}),
+                    },
+                    base_dir=base_dir,
+                )
+                writer.submit(
+                    create_movie_collection_yaml,
+                    "TSSK_THIS_MONTH_IN_HISTORY_COLLECTION.yml",
+                    month_history,
+                    profile_config,
+                    "collection_this_month_in_history",
+                    "This Month in History",
+                    f"Movies released in {month_name} in previous years",
+                    base_dir=base_dir,
+                )
+
+                writer.submit(
+                    create_movie_overlay_yaml,
+                    "TSSK_IN_CINEMA_OVERLAYS.yml",
+                    in_theaters,
+                    {
+                        "backdrop": profile_config.get("backdrop_in_cinema", {}),
+                        "text": profile_config.get("text_in_cinema", {}),
+                    },
+                    base_dir=base_dir,
+                )
+                writer.submit(
+                    create_movie_collection_yaml,
+                    "TSSK_IN_CINEMA_COLLECTION.yml",
+                    in_theaters,
+                    profile_config,
+                    "collection_in_cinema",
+                    "In Cinema",
+                    "Movies currently in cinemas",
+                    base_dir=base_dir,
+                )
+
+                profile_release_days = get_release_days(profile_config)
+                for feature, movies in upcoming_releases.items():
+                    kind = feature.split("_")[0]  # digital / physical
+                    movies = within_days(movies, profile_release_days[feature])
+                    writer.submit(
+                        create_movie_overlay_yaml,
+                        f"TSSK_{feature.upper()}_OVERLAYS.yml",
+                        movies,
+                        {
+                            "backdrop": profile_config.get(f"backdrop_{feature}", {}),
+                            "text": profile_config.get(f"text_{feature}", {}),
+                        },
+                        base_dir=base_dir,
+                    )
+                    writer.submit(
+                        create_movie_collection_yaml,
+                        f"TSSK_{feature.upper()}_COLLECTION.yml",
+                        movies,
+                        profile_config,
+                        f"collection_{feature}",
+                        f"{kind.capitalize()} Release Soon",
+                        f"Movies with a {kind} release within {profile_release_days[feature]} days",
+                        base_dir=base_dir,
+                    )
+
+        # Writers run in a pool, so their errors are printed from here
+        for error in writer.wait():
+            print(f"{RED}{error}{RESET}")
+
+        if args.dry_run:
+            previous = load_membership(store)
+            changes = membership.diff(previous)
+            if args.json:
+                json.dump(
+                    {"previous_run": previous.created, "categories": changes},
+                    console,
+                    indent=2,
+                )
+                console.write("\n")
+            else:
+                print_membership_changes(changes, previous)
+        else:
+            save_sonarr_caches()
+            store.save_tmdb_lookups(_tmdb_id_cache, _tmdb_status_cache)
+            store.record_run(start_time, membership.categories)
+
+            previous_overlays = load_overlay_state(overlay_state_path)
+            if config.get("overlay_delta_manifest", False):
+                for profile, profile_config, base_dir in profiles:
+                    write_delta_manifest(
+                        get_overlay_state(),
+                        previous_overlays,
+                        base_dir or DEFAULT_OUTPUT_DIR,
+                    )
+            save_overlay_state(get_overlay_state(), previous_overlays, overlay_state_path)
+            for profile, profile_config, base_dir in profiles:
+                if is_label_mode(profile_config):
+                    write_label_manifest(
+                        get_label_manifest(), base_dir or DEFAULT_OUTPUT_DIR
+                    )
+            checkpoint.clear()
+
+        print_scope_warnings()
+
+        degraded = sum(
+            len(get_sonarr_cache(instance["url"]).degraded)
+            for instance in sonarr_instances
+        )
+        if degraded:
+            print(
+                f"\n{ORANGE}Sonarr errors for {degraded} series - classified from last-known episodes where cached{RESET}"
             )
 
-        print(f"\nAll YAML files created successfully")
+        if args.dry_run:
+            print("\nDry run - no files were written")
+        else:
+            print(f"\nAll YAML files created successfully")
 
         # Calculate and display runtime
         end_time = datetime.now()
@@ -1522,12 +2816,45 @@ def main():
 
         print(f"Total runtime: {runtime_formatted}")
 
+        stats = transport.get_transfer_stats()
+        unknown = f", {stats.unknown_size} of unknown size" if stats.unknown_size else ""
+        print(
+            f"HTTP: {stats.requests} requests, {format_bytes(stats.bytes_received)} transferred "
+            f"({format_bytes(stats.bytes_decoded)} uncompressed){unknown}, "
+            f"{stats.not_modified} not modified"
+        )
+        limits = transport.get_concurrency_limits()
+        if limits:
+            print(
+                "Concurrency: "
+                + ", ".join(
+                    f"{host} {int(limiter.limit)} (peak {limiter.peak}"
+                    + (f", backed off {limiter.decreases}x" if limiter.decreases else "")
+                    + ")"
+                    for host, limiter in sorted(limits.items())
+                )
+            )
+
     except ConnectionError as e:
         print(f"{RED}Error: {str(e)}{RESET}")
         sys.exit(1)
     except Exception as e:
         print(f"{RED}Unexpected error: {str(e)}{RESET}")
         sys.exit(1)
+    finally:
+        for future in movie_futures.values():
+            future.cancel()
+        movie_pool.shutdown(wait=True)
+        writer.shutdown()
+        checkpoint.close()
+        close_state_store()
+        if args.record:
+            print(f"Recorded {cassette.save()} responses to {args.record}")
+        if replay_dir:
+            shutil.rmtree(replay_dir, ignore_errors=True)
+        if get_profiler().enabled:
+            print(f"Profile written to {get_profiler().finish()}")
+        sys.stdout = console
 
 
 if __name__ == "__main__":
@@ -0,0 +1,162 @@
+"""Record API responses to a cassette and replay them offline.
+
+``python TSSK.py --record run.cassette`` runs as usual and saves every
+response :func:`transport.get` received (Sonarr, Radarr, TMDB, GitHub) to a
+gzip compressed cassette, together with the config and the time of the run.
+``python TSSK.py --replay run.cassette`` then runs ``main()`` again without
+any network access: the config comes from the cassette, every request is
+answered from it and the clock starts at the recorded time, so categories
+come out the same on any machine.
+
+API keys are scrubbed: they are left out of the request keys, replaced by
+``REDACTED`` wherever a response body echoes them and removed from the
+stored config. Both modes start from an empty state store and checkpoint so
+every response is requested (and recorded) in full.
+"""
+
+import base64
+import gzip
+import json
+import threading
+from collections import defaultdict
+from datetime import datetime, timezone
+
+import requests
+
+from transport import CircuitOpenError
+
+CASSETTE_VERSION = 1
+REDACTED = "REDACTED"
+# Config keys holding credentials
+SECRET_CONFIG_KEYS = ("api_key", "token", "password")
+
+# Request errors that can be replayed, by name
+REPLAYABLE_ERRORS = {
+    "ConnectionError": requests.exceptions.ConnectionError,
+    "Timeout": requests.exceptions.Timeout,
+    "ReadTimeout": requests.exceptions.ReadTimeout,
+    "ConnectTimeout": requests.exceptions.ConnectTimeout,
+    "CircuitOpenError": CircuitOpenError,
+}
+
+
+class CassetteMiss(requests.exceptions.ConnectionError):
+    """Raised when a replayed run requests something that wasn't recorded."""
+
+
+class Cassette:
+    """Responses per request key, in the order they were received."""
+
+    def __init__(self, path, replaying=False, recorded=None, config=None):
+        self.path = path
+        self.replaying = replaying
+        self.recorded = recorded or datetime.now().astimezone()
+        self.config = config
+        self.interactions = defaultdict(list)  # key -> [interaction]
+        self._played = defaultdict(int)  # key -> interactions served
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path):
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            header = json.loads(f.readline())
+            if header.get("version") != CASSETTE_VERSION:
+                raise ValueError(f"Unsupported cassette version in {path}")
+            cassette = cls(
+                path,
+                replaying=True,
+                recorded=datetime.fromisoformat(header["recorded"]),
+                config=header["config"],
+            )
+            for line in f:
+                interaction = json.loads(line)
+                cassette.interactions[interaction["key"]].append(interaction)
+        return cassette
+
+    def add(self, key, response=None, error=None, secrets=()):
+        """Remember the response (or request error) received for ``key``."""
+        if error is not None:
+            interaction = {"key": key, "error": type(error).__name__}
+        else:
+            body = response.content or b""
+            for secret in secrets:
+                body = body.replace(secret.encode("utf-8"), REDACTED.encode("utf-8"))
+            interaction = {
+                "key": key,
+                "status": response.status_code,
+                "content_type": response.headers.get("Content-Type"),
+            }
+            try:
+                interaction["body"] = body.decode("utf-8")
+            except UnicodeDecodeError:
+                interaction["body_base64"] = base64.b64encode(body).decode("ascii")
+        with self._lock:
+            self.interactions[key].append(interaction)
+
+    def play(self, key):
+        """Return the next recorded response for ``key``; the last one repeats."""
+        with self._lock:
+            recorded = self.interactions.get(key)
+            if not recorded:
+                raise CassetteMiss(f"Not in cassette {self.path}: {key}")
+            interaction = recorded[min(self._played[key], len(recorded) - 1)]
+            self._played[key] += 1
+
+        if "error" in interaction:
+            error = REPLAYABLE_ERRORS.get(
+                interaction["error"], requests.exceptions.RequestException
+            )
+            raise error(f"{interaction['error']} (replayed from {self.path})")
+
+        response = requests.models.Response()
+        response.status_code = interaction["status"]
+        if "body_base64" in interaction:
+            response._content = base64.b64decode(interaction["body_base64"])
+        else:
+            response._content = interaction["body"].encode("utf-8")
+        response.headers = requests.structures.CaseInsensitiveDict(
+            {"Content-Type": interaction["content_type"] or ""}
+        )
+        response.url = key
+        response.encoding = "utf-8"
+        return response
+
+    def save(self):
+        header = {
+            "version": CASSETTE_VERSION,
+            "recorded": self.recorded.isoformat(timespec="seconds"),
+            "config": scrub_config(self.config),
+        }
+        with gzip.open(self.path, "wt", encoding="utf-8") as f:
+            f.write(json.dumps(header) + "\n")
+            for interactions in self.interactions.values():
+                for interaction in interactions:
+                    f.write(json.dumps(interaction, separators=(",", ":")) + "\n")
+        return sum(len(i) for i in self.interactions.values())
+
+
+def scrub_config(value):
+    """Copy of a config with every credential replaced by ``REDACTED``."""
+    if isinstance(value, dict):
+        return {
+            key: REDACTED
+            if item and any(secret in str(key).lower() for secret in SECRET_CONFIG_KEYS)
+            else scrub_config(item)
+            for key, item in value.items()
+        }
+    if isinstance(value, list):
+        return [scrub_config(item) for item in value]
+    return value
+
+
+def shifted_datetime(recorded):
+    """``datetime`` whose clock starts at ``recorded`` and then runs normally."""
+    offset = recorded - datetime.now(timezone.utc)
+
+    class ReplayDatetime(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            moment = datetime.now(timezone.utc) + offset
+            return moment.astimezone(tz) if tz else moment.astimezone().replace(tzinfo=None)
+
+    return ReplayDatetime
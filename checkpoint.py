@@ -0,0 +1,231 @@
+"""Checkpoint and resume support for long runs.
+
+While TSSK runs, every fetched Sonarr series list, every series' episodes,
+every finished category result and every written YAML file (with the
+overlay blocks recorded while writing it) is appended to a journal in
+``config/cache``. If the run is killed (container restart,
+OOM, ...) the next run replays the journal and continues from there:
+fetched data isn't requested from Sonarr again, finished categories aren't
+recomputed and finished YAML files aren't rewritten. The journal is removed
+once a run completes.
+
+In streaming mode the category results of each classified batch of series
+are journaled as well; a resumed run keeps those results and skips the
+episodes of these series when replaying the journal.
+
+The checkpoint also acts as the run's snapshot: each series' episodes are
+fetched once per run no matter how many categories look at them.
+"""
+
+import json
+import os
+import threading
+import time
+
+CHECKPOINT_PATH = os.path.join("config", "cache", "checkpoint.jsonl")
+# A checkpoint older than this is considered stale and ignored
+CHECKPOINT_MAX_AGE = 12 * 3600  # seconds
+
+
+class Checkpoint:
+    """In-run snapshot of fetched data and results, optionally journaled to disk."""
+
+    def __init__(self, fingerprint=None, path=None):
+        self.fingerprint = fingerprint
+        self.path = path
+        self.created = time.time()
+        self.series = {}  # sonarr_url -> series list
+        self.episodes = {}  # sonarr_url -> {series_id: episodes}
+        self.classified = {}  # sonarr_url -> ids of series classified in streaming mode
+        self.classified_results = []  # {category name: result} of each classified batch
+        self.categories = {}  # category name -> result
+        self.outputs = {}  # finished output file name -> state recorded writing it
+        self.resumed = False
+        self._journal = None
+        self._lock = threading.RLock()
+
+    # -- persistence --------------------------------------------------------
+
+    def load(self):
+        """Replay a matching, recent journal. Returns True when resuming."""
+        if not self.path:
+            return False
+        try:
+            journal = open(self.path, "r", encoding="utf-8")
+        except OSError:
+            return False
+
+        with journal:
+            header = _parse(journal.readline())
+            if not header or header.get("type") != "header":
+                return False
+            if header.get("fingerprint") != self.fingerprint:
+                return False
+            if time.time() - header.get("created", 0) > CHECKPOINT_MAX_AGE:
+                return False
+
+            # Series already classified in streaming mode don't need their episodes
+            classified = set()
+            for line in journal:
+                if line.startswith('{"type":"classified"'):
+                    record = _parse(line)
+                    if record is None:
+                        break
+                    classified.update((record["url"], i) for i in record["ids"])
+            journal.seek(0)
+            journal.readline()
+
+            self.created = header["created"]
+            for line in journal:
+                record = _parse(line)
+                if record is None:
+                    # The last line may be cut short if the run was killed mid-write
+                    break
+                if (
+                    record.get("type") == "episodes"
+                    and (record["url"], record["id"]) in classified
+                ):
+                    continue
+                self._apply(record)
+        self.resumed = True
+        return True
+
+    def _apply(self, record):
+        kind = record.get("type")
+        if kind == "series":
+            self.series[record["url"]] = record["data"]
+        elif kind == "episodes":
+            self.episodes.setdefault(record["url"], {})[record["id"]] = record["data"]
+        elif kind == "classified":
+            self.classified.setdefault(record["url"], set()).update(record["ids"])
+            self.classified_results.append(record["data"])
+        elif kind == "category":
+            self.categories[record["name"]] = record["data"]
+        elif kind == "output":
+            self.outputs[record["name"]] = record.get("state")
+
+    def start(self):
+        """Open the journal for appending, rewriting it when not resuming."""
+        if not self.path:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        if self.resumed:
+            self._journal = open(self.path, "a", encoding="utf-8")
+            return
+        self._journal = open(self.path, "w", encoding="utf-8")
+        self._append(
+            {"type": "header", "fingerprint": self.fingerprint, "created": self.created}
+        )
+
+    def _append(self, record):
+        if self._journal is None:
+            return
+        self._journal.write(json.dumps(record, separators=(",", ":")) + "\n")
+        self._journal.flush()
+
+    def close(self):
+        with self._lock:
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
+
+    def clear(self):
+        """Remove the journal after a successful run."""
+        self.close()
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+
+    # -- fetched data -------------------------------------------------------
+
+    def get_series(self, sonarr_url):
+        with self._lock:
+            return self.series.get(sonarr_url)
+
+    def record_series(self, sonarr_url, series):
+        with self._lock:
+            self.series[sonarr_url] = series
+            self._append({"type": "series", "url": sonarr_url, "data": series})
+
+    def get_episodes(self, sonarr_url, series_id):
+        with self._lock:
+            return self.episodes.get(sonarr_url, {}).get(series_id)
+
+    def record_episodes(self, sonarr_url, series_id, episodes):
+        with self._lock:
+            self.episodes.setdefault(sonarr_url, {})[series_id] = episodes
+            self._append(
+                {"type": "episodes", "url": sonarr_url, "id": series_id, "data": episodes}
+            )
+
+    def drop_episodes(self, sonarr_url, series_id):
+        """Forget a series' episodes once they have been classified (streaming mode)."""
+        with self._lock:
+            self.episodes.get(sonarr_url, {}).pop(series_id, None)
+
+    # -- results ------------------------------------------------------------
+
+    def record_classified(self, sonarr_url, series_ids, results):
+        """Record the category results of a batch of series (streaming mode)."""
+        with self._lock:
+            self.classified.setdefault(sonarr_url, set()).update(series_ids)
+            self.classified_results.append(results)
+            self._append(
+                {"type": "classified", "url": sonarr_url, "ids": series_ids, "data": results}
+            )
+
+    def run_category(self, name, func, *args, **kwargs):
+        """Return the checkpointed result for ``name`` or compute and record it."""
+        with self._lock:
+            if name in self.categories:
+                return self.categories[name]
+        result = func(*args, **kwargs)
+        self.record_category(name, result)
+        return result
+
+    def record_category(self, name, result):
+        with self._lock:
+            self.categories[name] = result
+            self._append({"type": "category", "name": name, "data": result})
+
+    def output_done(self, name):
+        with self._lock:
+            return name in self.outputs
+
+    def output_state(self, name):
+        """State (e.g. overlay blocks) recorded while writing a finished output."""
+        with self._lock:
+            return self.outputs.get(name)
+
+    def record_output(self, name, state=None):
+        with self._lock:
+            self.outputs[name] = state
+            record = {"type": "output", "name": name}
+            if state:
+                record["state"] = state
+            self._append(record)
+
+
+def _parse(line):
+    try:
+        return json.loads(line)
+    except ValueError:
+        return None
+
+
+# Without an explicit checkpoint the run still gets an in-memory snapshot
+_active = Checkpoint()
+
+
+def get_checkpoint():
+    """Return the checkpoint of the current run."""
+    return _active
+
+
+def start_checkpoint(fingerprint, path=CHECKPOINT_PATH):
+    """Create (or resume) the on-disk checkpoint for this run and activate it."""
+    global _active
+    checkpoint = Checkpoint(fingerprint, path)
+    checkpoint.load()
+    checkpoint.start()
+    _active = checkpoint
+    return checkpoint
@@ -0,0 +1,102 @@
+"""Plex label assignments for ``output_mode: labels``.
+
+In label mode the TV collection and overlay files don't list tvdbIds;
+every block selects the shows carrying a Plex label instead (a
+``plex_search`` on ``TSSK_TV_ENDED``, ``TSSK_TV_NEW_SEASON_2025-06-01``,
+...), which Kometa resolves with a single library search. Which shows
+should carry which label is written to ``TSSK_LABELS.json`` next to the
+output files, together with the labels added to and removed from shows
+since the previous manifest, for whatever applies the labels in Plex.
+"""
+
+import json
+import os
+import threading
+from datetime import datetime
+
+from membership import category_name
+
+LABEL_MANIFEST_NAME = "TSSK_LABELS.json"
+
+
+def category_label(output_file, air_date=None):
+    """Plex label for a category's shows, or for those airing on ``air_date``."""
+    label = category_name(output_file)
+    return f"{label}_{air_date}" if air_date else label
+
+
+def label_builder(label):
+    """Kometa builder selecting the shows with ``label``."""
+    return {"plex_search": {"all": {"label": label}}}
+
+
+class LabelManifest:
+    """Labels per output file: ``{base_dir: {file: {label: [tvdbIds]}}}``."""
+
+    def __init__(self):
+        self.files = {}
+        self._lock = threading.Lock()
+
+    def record(self, base_dir, output_file, labels):
+        """Record the shows (``{label: tvdb_ids}``) labelled for one output file."""
+        recorded = {label: sorted(set(ids)) for label, ids in labels.items()}
+        self.restore(base_dir, output_file, recorded)
+        return recorded
+
+    def restore(self, base_dir, output_file, recorded):
+        """Put back the labels :meth:`record` returned, e.g. for a file written before a resume."""
+        with self._lock:
+            self.files.setdefault(base_dir, {})[output_file] = recorded
+
+
+_active = LabelManifest()
+
+
+def get_label_manifest():
+    """Return the label assignments collected during this run."""
+    return _active
+
+
+def load_label_manifest(base_dir):
+    try:
+        with open(os.path.join(base_dir, LABEL_MANIFEST_NAME), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_label_manifest(manifest, base_dir):
+    """Write ``TSSK_LABELS.json`` for the files under ``base_dir``.
+
+    Only files written this run (or restored from an interrupted run's
+    checkpoint) are listed; files no longer written drop their labels.
+    """
+    previous = load_label_manifest(base_dir)
+    files = manifest.files.get(base_dir, {})
+
+    labels = {}
+    for file_labels in files.values():
+        for label, ids in file_labels.items():
+            labels.setdefault(label, set()).update(ids)
+
+    before = {label: set(ids) for label, ids in previous.get("labels", {}).items()}
+    changes = {}
+    for label in sorted(set(labels) | set(before)):
+        added = sorted(labels.get(label, set()) - before.get(label, set()))
+        removed = sorted(before.get(label, set()) - labels.get(label, set()))
+        if added or removed:
+            changes[label] = {"added": added, "removed": removed}
+
+    data = {
+        "generated": datetime.now().isoformat(timespec="seconds"),
+        "previous_run": previous.get("generated"),
+        "labels": {label: sorted(ids) for label, ids in sorted(labels.items())},
+        "changes": changes,
+        "files": files,
+    }
+    os.makedirs(base_dir, exist_ok=True)
+    path = os.path.join(base_dir, LABEL_MANIFEST_NAME)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, separators=(",", ":"))
+    os.replace(tmp_path, path)
@@ -0,0 +1,72 @@
+"""Category membership of a run and the changes since the previous run.
+
+After every run the tvdbIds (TV) and tmdbIds (movies) in each category are
+recorded in the state store (``config/cache/tssk.db``). A dry run compares
+the freshly computed categories against the last recorded run to show which
+shows would be added to or removed from each category, without writing
+anything.
+"""
+
+import os
+import threading
+
+
+def category_name(output_file, base_dir=None):
+    """Category key for an output file, e.g. ``TSSK_TV_ENDED`` (prefixed with a profile's output dir)."""
+    name = os.path.basename(output_file)
+    for suffix in ("_OVERLAYS.yml", "_COLLECTION.yml", ".yml"):
+        if name.endswith(suffix):
+            name = name[: -len(suffix)]
+            break
+    return f"{base_dir}:{name}" if base_dir else name
+
+
+class Membership:
+    """Ids (and titles) per category for one run."""
+
+    def __init__(self, categories=None, created=None):
+        self.categories = categories or {}
+        self.created = created
+        self._lock = threading.Lock()
+
+    def record(self, category, items):
+        members = {}
+        for item in items:
+            item_id = item.get("tvdbId") or item.get("tmdbId")
+            if item_id:
+                members[str(item_id)] = item.get("title")
+        with self._lock:
+            self.categories[category] = members
+
+    def diff(self, previous):
+        """Return ``{category: {"added": [...], "removed": [...]}}`` for changed categories."""
+        changes = {}
+        for category in sorted(set(self.categories) | set(previous.categories)):
+            current = self.categories.get(category, {})
+            before = previous.categories.get(category, {})
+            added = sorted(set(current) - set(before), key=_id_sort_key)
+            removed = sorted(set(before) - set(current), key=_id_sort_key)
+            if added or removed:
+                changes[category] = {
+                    "added": [
+                        {"id": _id_value(i), "title": current[i]} for i in added
+                    ],
+                    "removed": [
+                        {"id": _id_value(i), "title": before[i]} for i in removed
+                    ],
+                }
+        return changes
+
+
+def _id_value(item_id):
+    return int(item_id) if item_id.isdigit() else item_id
+
+
+def _id_sort_key(item_id):
+    return (not item_id.isdigit(), int(item_id) if item_id.isdigit() else 0, item_id)
+
+
+def load_membership(store):
+    """Return the membership of the last run recorded in ``store`` (empty if there is none)."""
+    finished_at, categories = store.last_run_membership()
+    return Membership(categories, finished_at)
@@ -9,9 +9,17 @@ import os
 from datetime import datetime
 import requests
 from copy import deepcopy
-import yaml
 
-IS_DOCKER = os.getenv("DOCKER", "false").lower() == "true"
+import transport
+from scope_filters import apply_scope_filter
+
+from yaml_output import (
+    DEFAULT_OUTPUT_DIR,
+    QuotedString,
+    dump_yaml,
+    format_date,
+    write_placeholder,
+)
 
 
 def process_radarr_url(base_url, api_key):
@@ -27,8 +35,8 @@ def process_radarr_url(base_url, api_key):
         test_url = f"{base_url}{path}"
         try:
             headers = {"X-Api-Key": api_key}
-            response = requests.get(
-                f"{test_url}/system/status", headers=headers, timeout=10
+            response = transport.get(
+                f"{test_url}/system/status", headers=headers, timeout=10, retries=0
             )
             if response.status_code == 200:
                 print(f"Successfully connected to Radarr at: {test_url}")
@@ -39,12 +47,23 @@ def process_radarr_url(base_url, api_key):
 
 
 def get_radarr_movies(radarr_url, api_key):
-    """Return all movies from Radarr."""
+    """Return the movies from Radarr that pass the instance's ``radarr_filters``."""
     url = f"{radarr_url}/movie"
     headers = {"X-Api-Key": api_key}
-    response = requests.get(url, headers=headers, timeout=10)
+    # Radarr doesn't always send validators; the transport only revalidates if it does
+    response = transport.get(url, headers=headers, timeout=10, revalidate=True)
     response.raise_for_status()
-    return response.json()
+    return apply_scope_filter(radarr_url, response.json())
+
+
+def merge_movie_lists(movie_lists):
+    """Merge movie lists from several Radarr instances, keeping the first entry per tmdbId."""
+    merged = []
+    seen = set()
+    for movies in movie_lists:
+        merged.extend(m for m in movies if m.get("tmdbId") not in seen)
+        seen.update(m["tmdbId"] for m in movies if m.get("tmdbId"))
+    return merged
 
 
 def get_this_month_in_history(radarr_url, radarr_api_key, tmdb_api_key, country_code):
@@ -63,7 +82,7 @@ def get_this_month_in_history(radarr_url, radarr_api_key, tmdb_api_key, country_
         if tmdb_id and tmdb_api_key and country_code:
             try:
                 url = f"https://api.themoviedb.org/3/movie/{tmdb_id}/release_dates?api_key={tmdb_api_key}"
-                response = requests.get(url, timeout=10)
+                response = transport.get(url, timeout=10, revalidate=True)
                 if response.status_code == 200:
                     data = response.json()
                     for result in data.get("results", []):
@@ -92,20 +111,24 @@ def get_this_month_in_history(radarr_url, radarr_api_key, tmdb_api_key, country_
     return movies
 
 
-def create_movie_overlay_yaml(output_file, movies, config_sections=None):
-    """Create overlay YAML for movies using tmdbId identifiers."""
+def create_movie_overlay_yaml(output_file, movies, config_sections=None, base_dir=None):
+    """Create overlay YAML for movies using tmdbId identifiers.
+
+    Movies with a ``releaseDate`` get a text block per date, labelled with
+    the text block's ``date_format`` like the TV overlays.
+    """
     if config_sections is None:
         config_sections = {}
-    base_dir = "/config/kometa/tssk" if IS_DOCKER else "kometa"
+    base_dir = base_dir or DEFAULT_OUTPUT_DIR
     output_dir = os.path.join(base_dir, "movies", "overlays")
     os.makedirs(output_dir, exist_ok=True)
     output_file = os.path.join(output_dir, output_file)
     if not movies:
-        with open(output_file, "w", encoding="utf-8") as f:
-            f.write("#No matching movies found")
+        write_placeholder(output_file, "#No matching movies found")
         return
     tmdb_ids = ", ".join(str(m["tmdbId"]) for m in movies if m.get("tmdbId"))
     overlays = {}
+    errors = []
 
     # Backdrop block
     backdrop_config = deepcopy(config_sections.get("backdrop", {}))
@@ -128,15 +151,36 @@ def create_movie_overlay_yaml(output_file, movies, config_sections=None):
         text_config.setdefault("vertical_offset", 35)
         text_config.setdefault("font_size", 70)
         text_config.setdefault("font_color", "#FFFFFF")
-        text_config["name"] = f"text({use_text})"
-        overlays["text"] = {
-            "overlay": text_config,
-            "tmdb_movie": tmdb_ids,
-        }
+        date_format = text_config.pop("date_format", "yyyy-mm-dd")
+        capitalize_dates = text_config.pop("capitalize_dates", True)
+
+        date_to_tmdb_ids = {}
+        for movie in movies:
+            if movie.get("releaseDate") and movie.get("tmdbId"):
+                date_to_tmdb_ids.setdefault(movie["releaseDate"], []).append(movie["tmdbId"])
+
+        if date_to_tmdb_ids:
+            for date_str in sorted(date_to_tmdb_ids):
+                formatted_date, error = format_date(date_str, date_format, capitalize_dates)
+                if error:
+                    errors.append(error)
+                overlays[f"TSSK_{formatted_date}"] = {
+                    "overlay": {**text_config, "name": f"text({use_text} {formatted_date})"},
+                    "tmdb_movie": ", ".join(
+                        str(i) for i in sorted(date_to_tmdb_ids[date_str])
+                    ),
+                }
+        else:
+            text_config["name"] = f"text({use_text})"
+            overlays["text"] = {
+                "overlay": text_config,
+                "tmdb_movie": tmdb_ids,
+            }
 
     data = {"overlays": overlays}
-    with open(output_file, "w", encoding="utf-8") as f:
-        yaml.dump(data, f, sort_keys=False)
+    dump_yaml(data, output_file)
+    if errors:
+        return {"errors": errors}
 
 
 def create_movie_collection_yaml(
@@ -146,6 +190,7 @@ def create_movie_collection_yaml(
     collection_key="collection_this_month_in_history",
     default_name="This Month in History",
     summary="",
+    base_dir=None,
 ):
     """Create collection YAML for movies using tmdbId identifiers.
 
@@ -163,13 +208,15 @@ def create_movie_collection_yaml(
         Default collection name when ``collection_name`` is not provided.
     summary : str, optional
         Summary text for the collection. If empty, the field is omitted.
+    base_dir : str, optional
+        Output directory; defaults to the standard Kometa output location.
     """
     from collections import OrderedDict
 
     if config is None:
         config = {}
 
-    base_dir = "/config/kometa/tssk" if IS_DOCKER else "kometa"
+    base_dir = base_dir or DEFAULT_OUTPUT_DIR
     output_dir = os.path.join(base_dir, "movies", "collections")
     os.makedirs(output_dir, exist_ok=True)
     output_file = os.path.join(output_dir, output_file)
@@ -178,17 +225,8 @@ def create_movie_collection_yaml(
     collection_config = deepcopy(config.get(collection_key, {}))
     collection_name = collection_config.pop("collection_name", default_name)
 
-    class QuotedString(str):
-        pass
-
-    def quoted_str_presenter(dumper, data):
-        return dumper.represent_scalar("tag:yaml.org,2002:str", data, style='"')
-
-    yaml.add_representer(QuotedString, quoted_str_presenter, Dumper=yaml.SafeDumper)
-
     if not tmdb_ids:
-        with open(output_file, "w", encoding="utf-8") as f:
-            f.write("#No matching movies found")
+        write_placeholder(output_file, "#No matching movies found")
         return
 
     tmdb_ids_str = ", ".join(str(i) for i in sorted(tmdb_ids))
@@ -218,5 +256,4 @@ def create_movie_collection_yaml(
     ordered["tmdb_movie"] = collection_data["tmdb_movie"]
 
     data = {"collections": {collection_name: ordered}}
-    with open(output_file, "w", encoding="utf-8") as f:
-        yaml.dump(data, f, Dumper=yaml.SafeDumper, sort_keys=False)
+    dump_yaml(data, output_file)
@@ -3,10 +3,74 @@
 Functions for historical movie queries are located in ``movies_history``.
 """
 
+import threading
+from datetime import timedelta
+
 import requests
 from typing import List, Dict, Optional
 
+import transport
 from movies_history import get_radarr_movies
+from state_store import get_state_store
+
+# How long TMDB's now playing list of a region is reused (``now_playing_cache_hours``)
+NOW_PLAYING_CACHE_HOURS = 12
+
+# Region -> (tmdb ids in TMDB's order, index of them) for this run
+_now_playing = {}
+_now_playing_lock = threading.Lock()
+
+
+def _fetch_now_playing(tmdb_api_key: str, country_code: Optional[str]):
+    """Return every now playing movie id and whether all pages were fetched."""
+    tmdb_ids: List[int] = []
+    page = 1
+    while True:
+        url = (
+            f"https://api.themoviedb.org/3/movie/now_playing?api_key={tmdb_api_key}&page={page}"
+        )
+        if country_code:
+            url += f"&region={country_code}"
+        try:
+            # Not revalidated: the complete list is kept in tmdb_now_playing instead
+            response = transport.get(url, timeout=10)
+            if response.status_code != 200:
+                return tmdb_ids, False
+            data = response.json()
+        except requests.exceptions.RequestException:
+            return tmdb_ids, False
+
+        tmdb_ids.extend(result.get("id") for result in data.get("results", []))
+
+        if page >= data.get("total_pages", 1):
+            return tmdb_ids, True
+        page += 1
+
+
+def get_now_playing(
+    tmdb_api_key: str,
+    country_code: Optional[str] = None,
+    cache_hours: float = NOW_PLAYING_CACHE_HOURS,
+):
+    """Return ``(tmdb ids, set of them)`` of the movies now playing in a region.
+
+    The list only changes about once a day, so a complete list is kept in
+    the state store and reused for ``cache_hours``; within a run every
+    Radarr instance shares it.
+    """
+    region = country_code or ""
+    with _now_playing_lock:
+        if region not in _now_playing:
+            store = get_state_store()
+            tmdb_ids = store.load_now_playing(region, timedelta(hours=cache_hours))
+            if tmdb_ids is None:
+                tmdb_ids, complete = _fetch_now_playing(tmdb_api_key, country_code)
+                # A partial list is used for this run but not kept, and a
+                # dry run keeps nothing
+                if complete and not store.snapshot:
+                    store.save_now_playing(region, tmdb_ids)
+            _now_playing[region] = (tmdb_ids, frozenset(tmdb_ids))
+        return _now_playing[region]
 
 
 def get_in_theaters(
@@ -14,12 +78,14 @@ def get_in_theaters(
     radarr_api_key: str,
     tmdb_api_key: str,
     country_code: Optional[str] = None,
+    cache_hours: float = NOW_PLAYING_CACHE_HOURS,
 ) -> List[Dict[str, int]]:
     """Return Radarr movies that are currently playing in theaters.
 
-    The function fetches the TMDb ``now_playing`` list for the provided
-    ``country_code`` (if supplied) and filters it against the movies present in
-    Radarr. Only titles already tracked by Radarr will be returned.
+    The function takes TMDb's ``now_playing`` list for the provided
+    ``country_code`` (if supplied, see :func:`get_now_playing`) and filters it
+    against the movies present in Radarr. Only titles already tracked by
+    Radarr will be returned.
     """
 
     radarr_movies = get_radarr_movies(radarr_url, radarr_api_key)
@@ -29,30 +95,13 @@ def get_in_theaters(
         if movie.get("tmdbId")
     }
 
+    now_playing, now_playing_index = get_now_playing(
+        tmdb_api_key, country_code, cache_hours
+    )
+    owned = now_playing_index & radarr_tmdb.keys()
     movies: List[Dict[str, int]] = []
-    page = 1
-    while True:
-        url = (
-            f"https://api.themoviedb.org/3/movie/now_playing?api_key={tmdb_api_key}&page={page}"
-        )
-        if country_code:
-            url += f"&region={country_code}"
-        try:
-            response = requests.get(url, timeout=10)
-            if response.status_code != 200:
-                break
-            data = response.json()
-        except requests.exceptions.RequestException:
-            break
-
-        for result in data.get("results", []):
-            tmdb_id = result.get("id")
-            if tmdb_id in radarr_tmdb:
-                movies.append({"title": radarr_tmdb[tmdb_id], "tmdbId": tmdb_id})
-
-        if page >= data.get("total_pages", 1):
-            break
-        page += 1
+    for tmdb_id in now_playing:
+        if tmdb_id in owned:
+            movies.append({"title": radarr_tmdb[tmdb_id], "tmdbId": tmdb_id})
 
     return movies
-
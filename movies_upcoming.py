@@ -0,0 +1,68 @@
+"""Movies with a digital or physical release coming up.
+
+Only the release window is requested from Radarr's ``/calendar`` endpoint,
+so unlike This Month in History and In Cinema these categories don't need
+the whole library. Movies currently in theaters are handled by
+``movies_in_theaters``.
+"""
+
+from datetime import datetime, timedelta
+
+import transport
+from scope_filters import apply_scope_filter
+
+# Radarr field of each upcoming release category
+RELEASE_FIELDS = {
+    "digital_release": "digitalRelease",
+    "physical_release": "physicalRelease",
+}
+
+
+def get_upcoming_releases(radarr_url, radarr_api_key, release_field, days):
+    """Return Radarr movies whose ``release_field`` date is within ``days`` days.
+
+    Each movie is ``{"title", "tmdbId", "releaseDate"}`` (``YYYY-MM-DD``),
+    sorted by release date.
+    """
+    today = datetime.now().date()
+    end = today + timedelta(days=days)
+    response = transport.get(
+        f"{radarr_url}/calendar",
+        headers={"X-Api-Key": radarr_api_key},
+        params={
+            "start": today.isoformat(),
+            "end": end.isoformat(),
+            "unmonitored": "true",
+        },
+        timeout=10,
+    )
+    response.raise_for_status()
+
+    movies = []
+    # The calendar also lists movies for their other release dates
+    for movie in apply_scope_filter(radarr_url, response.json()):
+        release_date = (movie.get(release_field) or "")[:10]
+        if movie.get("tmdbId") and today.isoformat() <= release_date <= end.isoformat():
+            movies.append(
+                {
+                    "title": movie.get("title"),
+                    "tmdbId": movie["tmdbId"],
+                    "releaseDate": release_date,
+                }
+            )
+    movies.sort(key=lambda movie: (movie["releaseDate"], movie["title"] or ""))
+    return movies
+
+
+def get_release_days(config):
+    """Window in days of each upcoming release category for one (profile) config."""
+    return {
+        feature: int(config.get(f"future_days_{feature}", config.get("future_days", 14)))
+        for feature in RELEASE_FIELDS
+    }
+
+
+def within_days(movies, days):
+    """The movies of :func:`get_upcoming_releases` released within ``days`` days."""
+    end = (datetime.now().date() + timedelta(days=days)).isoformat()
+    return [movie for movie in movies if movie["releaseDate"] <= end]
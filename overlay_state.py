@@ -0,0 +1,150 @@
+"""Per-block overlay membership and the delta manifest for Kometa.
+
+Every overlay file written by :func:`TSSK.create_overlay_yaml` records
+which tvdbIds each of its blocks (``backdrop``, ``TSSK_<date>``,
+``TSSK_text``) contains. The state is kept in
+``config/cache/overlay_blocks.json`` and, when ``overlay_delta_manifest``
+is enabled, compared with the previous run to write
+``TSSK_OVERLAY_DELTA.json`` next to the output files. It lists the blocks
+that gained or lost shows so downstream tooling can run Kometa for those
+only.
+
+Date blocks are identified by their air date rather than their key, so a
+block whose label changes (e.g. a new ``date_format``) is reported as
+renamed, and blocks for dates that have passed are reported as expired
+instead of every block looking new after the daily rollover.
+"""
+
+import json
+import os
+import threading
+from datetime import date, datetime
+
+OVERLAY_STATE_PATH = os.path.join("config", "cache", "overlay_blocks.json")
+DELTA_MANIFEST_NAME = "TSSK_OVERLAY_DELTA.json"
+
+
+class OverlayState:
+    """Blocks per overlay file: ``{base_dir: {file: {identity: {"key", "ids"}}}}``."""
+
+    def __init__(self, files=None, created=None):
+        self.files = files or {}
+        self.created = created
+        self._lock = threading.Lock()
+
+    def record(self, base_dir, output_file, blocks):
+        """Record ``blocks`` ({identity: (block_key, tvdb_ids)}) for one overlay file."""
+        recorded = {
+            identity: {"key": key, "ids": sorted(ids)}
+            for identity, (key, ids) in blocks.items()
+        }
+        self.restore(base_dir, output_file, recorded)
+        return recorded
+
+    def restore(self, base_dir, output_file, recorded):
+        """Put back the blocks :meth:`record` returned, e.g. for a file written before a resume."""
+        with self._lock:
+            self.files.setdefault(base_dir, {})[output_file] = recorded
+
+    def delta(self, previous, base_dir, today=None):
+        """Return the per-file block changes for ``base_dir`` since ``previous``."""
+        today = (today or date.today()).isoformat()
+        current_files = self.files.get(base_dir, {})
+        previous_files = previous.files.get(base_dir, {})
+
+        files = {}
+        for output_file, blocks in current_files.items():
+            before = previous_files.get(output_file, {})
+            changed_blocks = {}
+            for identity, block in blocks.items():
+                old = before.get(identity)
+                if old is None:
+                    changed_blocks[block["key"]] = {
+                        "status": "new",
+                        "added": block["ids"],
+                        "removed": [],
+                    }
+                    continue
+                added = sorted(set(block["ids"]) - set(old["ids"]))
+                removed = sorted(set(old["ids"]) - set(block["ids"]))
+                renamed = old["key"] != block["key"]
+                if added or removed or renamed:
+                    entry = {
+                        "status": "renamed" if renamed else "changed",
+                        "added": added,
+                        "removed": removed,
+                    }
+                    if renamed:
+                        entry["previous_key"] = old["key"]
+                    changed_blocks[block["key"]] = entry
+
+            removed_blocks = [
+                {
+                    # Date blocks whose day has passed simply rolled over
+                    "status": "expired" if _is_past_date(identity, today) else "removed",
+                    "key": old["key"],
+                    "ids": old["ids"],
+                }
+                for identity, old in before.items()
+                if identity not in blocks
+            ]
+
+            if changed_blocks or removed_blocks:
+                files[output_file] = {
+                    "changed_blocks": changed_blocks,
+                    "removed_blocks": removed_blocks,
+                }
+        return files
+
+
+def _is_past_date(identity, today):
+    try:
+        return date.fromisoformat(identity).isoformat() < today
+    except ValueError:
+        return False
+
+
+_active = OverlayState()
+
+
+def get_overlay_state():
+    """Return the overlay block state collected during this run."""
+    return _active
+
+
+def load_overlay_state(path=OVERLAY_STATE_PATH):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return OverlayState()
+    return OverlayState(data.get("files", {}), data.get("created"))
+
+
+def save_overlay_state(state, previous, path=OVERLAY_STATE_PATH):
+    """Persist ``state``, keeping ``previous`` entries for files not written this run."""
+    files = {base_dir: dict(entries) for base_dir, entries in previous.files.items()}
+    for base_dir, entries in state.files.items():
+        files.setdefault(base_dir, {}).update(entries)
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(
+            {"created": datetime.now().isoformat(timespec="seconds"), "files": files},
+            f,
+            separators=(",", ":"),
+        )
+    os.replace(tmp_path, path)
+
+
+def write_delta_manifest(state, previous, base_dir):
+    """Write the delta manifest for the overlay files under ``base_dir``."""
+    manifest = {
+        "generated": datetime.now().isoformat(timespec="seconds"),
+        "previous_run": previous.created,
+        "files": state.delta(previous, base_dir),
+    }
+    os.makedirs(base_dir, exist_ok=True)
+    with open(os.path.join(base_dir, DELTA_MANIFEST_NAME), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
@@ -0,0 +1,192 @@
+"""Optional per-phase profiling of a run (``python TSSK.py --profile``).
+
+Every phase of a run (each ``find_*`` finder, the Sonarr episode fetch of
+each instance, each movie category and the writer of each output file) is
+run under its own ``cProfile`` profiler. Calls of the same phase are
+accumulated. When the run ends the profiler writes, to
+``<output dir>/profile/<timestamp>/``:
+
+- ``<phase>.pstats`` - load with ``python -m pstats`` or snakeviz
+- ``tssk.collapsed`` - sampled stacks in collapsed format, one line per
+  stack prefixed with the phase, for flamegraph.pl or speedscope
+- ``<phase>.tracemalloc.txt`` - the top allocations made during the phase
+- ``phases.txt`` - wall time, call count and memory change per phase
+
+Phases run concurrently just like in a normal run (the YAML writer pool,
+the movie features), each thread with its own profiler. A phase started
+inside another one in the same thread is counted as part of the outer
+phase. Memory is traced process-wide, so the memory change of a phase also
+includes whatever concurrent phases and helper threads (e.g. concurrent
+HTTP requests) allocated meanwhile.
+"""
+
+import cProfile
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from functools import wraps
+
+# Interval of the stack sampler used for the collapsed stacks
+SAMPLE_INTERVAL = 0.005  # seconds
+TRACEMALLOC_FRAMES = 25
+TOP_ALLOCATIONS = 25
+
+
+class NullProfiler:
+    """Profiler used when profiling is off: phases cost nothing."""
+
+    enabled = False
+
+    @contextmanager
+    def phase(self, name):
+        yield
+
+    def wrap(self, name, func):
+        return func
+
+    def finish(self):
+        return None
+
+
+class PhaseProfiler:
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+        self.enabled = True
+        self.profiles = {}  # (phase, thread ident) -> cProfile.Profile
+        self.wall_time = defaultdict(float)
+        self.calls = Counter()
+        self.memory = defaultdict(int)  # phase -> change of traced memory
+        self.allocations = {}  # phase -> StatisticDiff list of the largest call
+        self.samples = Counter()
+        self._active = {}  # thread ident -> phase
+        self._lock = threading.RLock()
+        self._stop = threading.Event()
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+        self._sampler = threading.Thread(
+            target=self._sample, name="tssk-profiler", daemon=True
+        )
+        self._sampler.start()
+
+    @contextmanager
+    def phase(self, name):
+        thread_id = threading.get_ident()
+        if thread_id in self._active:
+            # Nested phases belong to the outer one
+            yield
+            return
+
+        # A profiler only ever runs in one thread, so each thread gets its own
+        with self._lock:
+            profile = self.profiles.setdefault((name, thread_id), cProfile.Profile())
+            self._active[thread_id] = name
+        before = tracemalloc.take_snapshot()
+        start = time.perf_counter()
+        try:
+            profile.enable()
+        except ValueError:
+            # Python 3.12+ allows one active profiler; time the phase anyway
+            profile = None
+        try:
+            yield
+        finally:
+            if profile is not None:
+                profile.disable()
+            wall_time = time.perf_counter() - start
+            diff = tracemalloc.take_snapshot().compare_to(before, "lineno")
+            grown = sum(stat.size_diff for stat in diff)
+            with self._lock:
+                del self._active[thread_id]
+                self.wall_time[name] += wall_time
+                self.calls[name] += 1
+                self.memory[name] += grown
+                if name not in self.allocations or grown > sum(
+                    stat.size_diff for stat in self.allocations[name]
+                ):
+                    self.allocations[name] = diff[:TOP_ALLOCATIONS]
+
+    def wrap(self, name, func):
+        @wraps(func)
+        def profiled(*args, **kwargs):
+            with self.phase(name):
+                return func(*args, **kwargs)
+
+        return profiled
+
+    def _sample(self):
+        while not self._stop.wait(SAMPLE_INTERVAL):
+            with self._lock:
+                active = dict(self._active)
+            if not active:
+                continue
+            frames = sys._current_frames()
+            for thread_id, name in active.items():
+                frame = frames.get(thread_id)
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(
+                        f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+                    )
+                    frame = frame.f_back
+                if stack:
+                    self.samples[";".join([name] + stack[::-1])] += 1
+
+    def finish(self):
+        """Stop profiling and write the results. Returns the output directory."""
+        self._stop.set()
+        self._sampler.join()
+        tracemalloc.stop()
+        os.makedirs(self.output_dir, exist_ok=True)
+
+        by_phase = defaultdict(list)
+        for (name, _), profile in self.profiles.items():
+            by_phase[name].append(profile)
+        for name, profiles in by_phase.items():
+            stats = pstats.Stats(*profiles)
+            stats.dump_stats(os.path.join(self.output_dir, f"{_file_name(name)}.pstats"))
+
+        with open(os.path.join(self.output_dir, "tssk.collapsed"), "w", encoding="utf-8") as f:
+            for stack, count in sorted(self.samples.items()):
+                f.write(f"{stack} {count}\n")
+
+        for name, stats in self.allocations.items():
+            path = os.path.join(self.output_dir, f"{_file_name(name)}.tracemalloc.txt")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(f"Top allocations kept by one {name} call:\n")
+                for stat in stats:
+                    f.write(f"{stat}\n")
+
+        with open(os.path.join(self.output_dir, "phases.txt"), "w", encoding="utf-8") as f:
+            width = max([45] + [len(name) for name in self.wall_time])
+            f.write(f"{'phase':<{width}} {'calls':>6} {'wall (s)':>10} {'memory delta':>12}\n")
+            for name, wall_time in sorted(
+                self.wall_time.items(), key=lambda item: item[1], reverse=True
+            ):
+                f.write(
+                    f"{name:<{width}} {self.calls[name]:>6} {wall_time:>10.3f} "
+                    f"{self.memory[name] / 1024:>9.1f} KB\n"
+                )
+        return self.output_dir
+
+
+def _file_name(name):
+    return "".join(c if c.isalnum() or c in "-_." else "_" for c in name)
+
+
+_active = NullProfiler()
+
+
+def get_profiler():
+    """Return the profiler of the current run (a no-op one unless profiling)."""
+    return _active
+
+
+def start_profiler(output_dir):
+    global _active
+    _active = PhaseProfiler(output_dir)
+    return _active
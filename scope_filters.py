@@ -0,0 +1,145 @@
+"""Include/exclude filters on the Sonarr series and Radarr movies TSSK processes.
+
+``sonarr_filters`` and ``radarr_filters`` (or ``filters`` on an entry of
+``sonarr_instances``/``radarr_instances``) are applied to a series or movie
+list as soon as it is fetched, so excluded series never have their episodes
+fetched or their TMDB status looked up. Supported keys:
+
+- ``include_tags`` / ``exclude_tags``: tag names or ids
+- ``root_folders`` / ``exclude_root_folders``: root folder paths
+- ``series_types``: ``standard``, ``anime`` and/or ``daily`` (Sonarr only)
+- ``monitored``: ``true`` for monitored items only, ``false`` for
+  unmonitored ones only
+
+Tag names are resolved through the instance's ``/tag`` endpoint the first
+time the filter is used. Problems with them are collected in
+:attr:`ScopeFilter.warnings` rather than failing the run.
+"""
+
+import posixpath
+import threading
+
+import requests
+
+import transport
+
+
+def _as_list(value):
+    if value is None:
+        return []
+    return list(value) if isinstance(value, (list, tuple)) else [value]
+
+
+def _folder(path):
+    return str(path).replace("\\", "/").rstrip("/").lower()
+
+
+class ScopeFilter:
+    """The filter settings of one Sonarr or Radarr instance."""
+
+    def __init__(self, settings, url, api_key, offline=False):
+        self.url = url
+        self.api_key = api_key
+        self.offline = offline
+        self.include_tags = _as_list(settings.get("include_tags"))
+        self.exclude_tags = _as_list(settings.get("exclude_tags"))
+        self.root_folders = [_folder(f) for f in _as_list(settings.get("root_folders"))]
+        self.exclude_root_folders = [
+            _folder(f) for f in _as_list(settings.get("exclude_root_folders"))
+        ]
+        self.series_types = [str(t).lower() for t in _as_list(settings.get("series_types"))]
+        monitored = settings.get("monitored")
+        self.monitored = None if monitored is None else str(monitored).lower() == "true"
+        self._tag_ids = None  # (include ids, exclude ids) once resolved
+        self.warnings = []
+        self._lock = threading.Lock()
+
+    def _resolve_tags(self):
+        """Return the include/exclude tags as ids, looking names up once."""
+        with self._lock:
+            if self._tag_ids is not None:
+                return self._tag_ids
+            names = [
+                t for t in self.include_tags + self.exclude_tags if not str(t).isdigit()
+            ]
+            labels = {}
+            if names:
+                try:
+                    if self.offline:
+                        raise requests.exceptions.RequestException("not contacting the server")
+                    response = transport.get(
+                        f"{self.url}/tag", headers={"X-Api-Key": self.api_key}, timeout=10
+                    )
+                    response.raise_for_status()
+                    labels = {
+                        str(tag.get("label", "")).lower(): tag.get("id")
+                        for tag in response.json()
+                    }
+                except requests.exceptions.RequestException as e:
+                    self.warnings.append(
+                        f"Can't resolve the filter tags of {self.url} ({e}) - tag filters not applied"
+                    )
+                    self._tag_ids = (None, None)
+                    return self._tag_ids
+                for name in names:
+                    if str(name).lower() not in labels:
+                        self.warnings.append(f"Filter tag '{name}' doesn't exist in {self.url}")
+
+            def ids(tags):
+                return {
+                    int(t) if str(t).isdigit() else labels.get(str(t).lower())
+                    for t in tags
+                } - {None}
+
+            self._tag_ids = (
+                ids(self.include_tags) if self.include_tags else None,
+                ids(self.exclude_tags),
+            )
+            return self._tag_ids
+
+    def matches(self, item):
+        include_tags, exclude_tags = self._resolve_tags()
+        tags = set(item.get("tags") or [])
+        if include_tags is not None and not tags & include_tags:
+            return False
+        if exclude_tags and tags & exclude_tags:
+            return False
+
+        root_folder = _folder(
+            item.get("rootFolderPath") or posixpath.dirname(_folder(item.get("path") or ""))
+        )
+        if self.root_folders and root_folder not in self.root_folders:
+            return False
+        if root_folder in self.exclude_root_folders:
+            return False
+
+        if self.series_types and str(item.get("seriesType", "")).lower() not in self.series_types:
+            return False
+        if self.monitored is not None and bool(item.get("monitored")) != self.monitored:
+            return False
+        return True
+
+    def apply(self, items):
+        return [item for item in items if self.matches(item)]
+
+
+_filters = {}  # instance API url -> ScopeFilter
+
+
+def set_scope_filter(url, api_key, settings, offline=False):
+    """Use ``settings`` (a filters mapping, may be empty) for the instance at ``url``."""
+    if settings:
+        _filters[url] = ScopeFilter(settings, url, api_key, offline)
+    else:
+        _filters.pop(url, None)
+
+
+def apply_scope_filter(url, items):
+    """Return the series/movies of the instance at ``url`` that pass its filters."""
+    scope_filter = _filters.get(url)
+    return scope_filter.apply(items) if scope_filter else items
+
+
+def get_scope_filters():
+    """Return ``{url: ScopeFilter}`` for every filtered instance."""
+    return dict(_filters)
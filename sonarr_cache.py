@@ -0,0 +1,79 @@
+"""Last-known-good cache of Sonarr responses.
+
+Every successful ``/series`` and ``/episode`` response is remembered and
+written to the state store (``config/cache/tssk.db``) at the end of a run.
+When Sonarr fails for a series (after retries), TSSK classifies that series
+from the cached episodes instead of aborting, so one flaky request no longer
+throws away the whole run.
+"""
+
+import threading
+
+from state_store import get_state_store
+
+
+class SonarrCache:
+    """Series list and per-series episodes for one Sonarr instance."""
+
+    def __init__(self, sonarr_url):
+        self.sonarr_url = sonarr_url
+        self.series = None
+        self._series_dirty = False
+        self._episodes = {}  # fresh episodes of this run, by series id
+        # Series ids that had to fall back to cached (or no) episodes this run
+        self.degraded = set()
+        self._lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        self.series = get_state_store().load_series(self.sonarr_url)
+
+    def save(self):
+        with self._lock:
+            series = self.series if self._series_dirty else None
+            episodes, self._episodes = self._episodes, {}
+            self._series_dirty = False
+        store = get_state_store()
+        if series is not None:
+            store.save_series(self.sonarr_url, series)
+        if episodes:
+            store.save_episodes(self.sonarr_url, episodes)
+
+    def discard_episodes(self):
+        """Forget the fresh episodes without saving them (dry runs write nothing)."""
+        with self._lock:
+            self._episodes = {}
+
+    def store_series(self, series):
+        with self._lock:
+            self.series = series
+            self._series_dirty = True
+
+    def store_episodes(self, series_id, episodes):
+        with self._lock:
+            self._episodes[series_id] = episodes
+
+    def cached_episodes(self, series_id):
+        with self._lock:
+            self.degraded.add(series_id)
+        return get_state_store().load_series_episodes(self.sonarr_url, series_id)
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_sonarr_cache(sonarr_url):
+    """Return the (lazily loaded) cache for ``sonarr_url``."""
+    with _caches_lock:
+        if sonarr_url not in _caches:
+            _caches[sonarr_url] = SonarrCache(sonarr_url)
+        return _caches[sonarr_url]
+
+
+def save_sonarr_caches():
+    """Persist every cache that received fresh data during this run."""
+    with _caches_lock:
+        caches = list(_caches.values())
+    for cache in caches:
+        cache.save()
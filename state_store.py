@@ -0,0 +1,432 @@
+"""Embedded SQLite store for TSSK's state between runs.
+
+The store (``config/cache/tssk.db``) holds the Sonarr library snapshot of
+every instance (series and episodes, with parsed air timestamps), TMDB
+lookups (including TMDB's now playing list per region), the category
+membership of each run and the ETag/Last-Modified validators of cacheable
+HTTP responses. It backs the Sonarr last-known-good cache, lets TMDB ids
+be reused across runs and keeps a history of which category every show was
+in.
+
+The database runs in WAL mode so it can be read while a run is writing to
+it. Dry runs use an in-memory snapshot of it so they never write to disk.
+The schema is versioned with ``PRAGMA user_version``; new versions are
+added to ``MIGRATIONS`` and applied in order when the store is opened, so an
+upgrade never needs a cold rebuild.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime
+
+STATE_DB_PATH = os.path.join("config", "cache", "tssk.db")
+# Category membership history is kept for this many runs
+RUN_HISTORY = 90
+
+# Each entry upgrades the schema by one version
+MIGRATIONS = [
+    """
+    CREATE TABLE series (
+        instance_url TEXT NOT NULL,
+        series_id INTEGER NOT NULL,
+        tvdb_id INTEGER,
+        tmdb_id INTEGER,
+        title TEXT,
+        status TEXT,
+        monitored INTEGER,
+        position INTEGER NOT NULL,
+        data TEXT NOT NULL,
+        updated_at TEXT NOT NULL,
+        PRIMARY KEY (instance_url, series_id)
+    );
+    CREATE INDEX idx_series_tvdb_id ON series (tvdb_id);
+
+    CREATE TABLE episodes (
+        instance_url TEXT NOT NULL,
+        episode_id INTEGER NOT NULL,
+        series_id INTEGER NOT NULL,
+        season_number INTEGER,
+        episode_number INTEGER,
+        air_date_utc TEXT,
+        air_ts INTEGER,
+        monitored INTEGER,
+        has_file INTEGER,
+        position INTEGER NOT NULL,
+        data TEXT NOT NULL,
+        PRIMARY KEY (instance_url, episode_id)
+    );
+    CREATE INDEX idx_episodes_series ON episodes (instance_url, series_id);
+    CREATE INDEX idx_episodes_air_ts ON episodes (air_ts);
+
+    CREATE TABLE tmdb_ids (
+        tvdb_id INTEGER PRIMARY KEY,
+        tmdb_id INTEGER,
+        fetched_at TEXT NOT NULL
+    );
+
+    CREATE TABLE tmdb_status (
+        tmdb_id INTEGER PRIMARY KEY,
+        status TEXT,
+        fetched_at TEXT NOT NULL
+    );
+
+    CREATE TABLE runs (
+        run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        started_at TEXT NOT NULL,
+        finished_at TEXT NOT NULL
+    );
+
+    CREATE TABLE category_members (
+        run_id INTEGER NOT NULL REFERENCES runs (run_id) ON DELETE CASCADE,
+        category TEXT NOT NULL,
+        item_id TEXT NOT NULL,
+        title TEXT,
+        PRIMARY KEY (run_id, category, item_id)
+    );
+    CREATE INDEX idx_category_members_item ON category_members (item_id);
+    """,
+    """
+    CREATE TABLE http_cache (
+        cache_key TEXT PRIMARY KEY,
+        etag TEXT,
+        last_modified TEXT,
+        content_type TEXT,
+        body BLOB NOT NULL,
+        stored_at TEXT NOT NULL
+    );
+    """,
+    """
+    CREATE TABLE tmdb_now_playing (
+        region TEXT PRIMARY KEY,
+        tmdb_ids TEXT NOT NULL,
+        fetched_at TEXT NOT NULL
+    );
+    """,
+]
+
+
+def parse_timestamp(value):
+    """Unix timestamp of a Sonarr ``airDateUtc`` value (None when missing/invalid)."""
+    if not value:
+        return None
+    try:
+        return int(datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp())
+    except ValueError:
+        return None
+
+
+def _now():
+    return datetime.now().isoformat(timespec="seconds")
+
+
+class StateStore:
+    """Connection to the state database, shared by all threads of a run."""
+
+    def __init__(self, path=STATE_DB_PATH, snapshot=False):
+        self.path = path
+        # An in-memory copy of ``path``: readable and writable, never saved
+        self.snapshot = snapshot
+        if snapshot:
+            self._conn = sqlite3.connect(":memory:", check_same_thread=False)
+            if path and os.path.exists(path):
+                # Without a write-ahead log no run is writing, so don't even
+                # create the -shm/-wal files a read-only WAL connection needs
+                mode = "ro" if os.path.exists(f"{path}-wal") else "ro&immutable=1"
+                source = sqlite3.connect(f"file:{path}?mode={mode}", uri=True)
+                try:
+                    source.backup(self._conn)
+                finally:
+                    source.close()
+        else:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.RLock()
+        self._conn.execute("PRAGMA foreign_keys=ON")
+        self.migrate()
+
+    def migrate(self):
+        """Bring the schema up to the latest version."""
+        with self._lock:
+            version = self._conn.execute("PRAGMA user_version").fetchone()[0]
+            for number, script in enumerate(MIGRATIONS[version:], start=version + 1):
+                # executescript() commits first, so wrap each step ourselves
+                self._conn.executescript(
+                    f"BEGIN;\n{script}\nPRAGMA user_version = {number};\nCOMMIT;"
+                )
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    # -- Sonarr library -----------------------------------------------------
+
+    def save_series(self, instance_url, series_list):
+        """Replace the series list stored for ``instance_url``."""
+        updated_at = _now()
+        rows = [
+            (
+                instance_url,
+                series["id"],
+                series.get("tvdbId") or None,
+                series.get("tmdbId") or None,
+                series.get("title"),
+                series.get("status"),
+                series.get("monitored"),
+                position,
+                json.dumps(series, separators=(",", ":")),
+                updated_at,
+            )
+            for position, series in enumerate(series_list)
+        ]
+        with self._lock, self._conn:
+            self._conn.execute(
+                "DELETE FROM series WHERE instance_url = ?", (instance_url,)
+            )
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO series VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            # Drop the episodes of series that are no longer in Sonarr
+            self._conn.execute(
+                "DELETE FROM episodes WHERE instance_url = ? AND series_id NOT IN "
+                "(SELECT series_id FROM series WHERE instance_url = ?)",
+                (instance_url, instance_url),
+            )
+
+    def save_episodes(self, instance_url, episodes_by_series):
+        """Replace the stored episodes of each series in ``{series_id: episodes}``."""
+        with self._lock, self._conn:
+            for series_id, episodes in episodes_by_series.items():
+                self._conn.execute(
+                    "DELETE FROM episodes WHERE instance_url = ? AND series_id = ?",
+                    (instance_url, series_id),
+                )
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO episodes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    [
+                        (
+                            instance_url,
+                            episode["id"],
+                            series_id,
+                            episode.get("seasonNumber"),
+                            episode.get("episodeNumber"),
+                            episode.get("airDateUtc"),
+                            parse_timestamp(episode.get("airDateUtc")),
+                            episode.get("monitored"),
+                            episode.get("hasFile"),
+                            position,
+                            json.dumps(episode, separators=(",", ":")),
+                        )
+                        for position, episode in enumerate(episodes)
+                    ],
+                )
+
+    def load_series(self, instance_url):
+        """Return the stored series list for ``instance_url`` (None if never stored)."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT data FROM series WHERE instance_url = ? ORDER BY position",
+                (instance_url,),
+            ).fetchall()
+        if not rows:
+            return None
+        return [json.loads(row["data"]) for row in rows]
+
+    def load_series_episodes(self, instance_url, series_id):
+        """Return the stored episodes of one series (None if never stored)."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT data FROM episodes WHERE instance_url = ? AND series_id = ? "
+                "ORDER BY position",
+                (instance_url, series_id),
+            ).fetchall()
+        if not rows:
+            return None
+        return [json.loads(row["data"]) for row in rows]
+
+    def load_episodes(self, instance_url):
+        """Return ``{series_id: episodes}`` for every stored series of ``instance_url``."""
+        episodes = {}
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT series_id, data FROM episodes WHERE instance_url = ? "
+                "ORDER BY series_id, position",
+                (instance_url,),
+            ).fetchall()
+        for row in rows:
+            episodes.setdefault(row["series_id"], []).append(json.loads(row["data"]))
+        return episodes
+
+    def episodes_airing_between(self, start_ts, end_ts):
+        """Return the stored episodes airing in ``[start_ts, end_ts)`` with their series."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT e.instance_url, e.series_id, s.title, s.tvdb_id, "
+                "e.season_number, e.episode_number, e.air_date_utc, e.has_file "
+                "FROM episodes e JOIN series s "
+                "ON s.instance_url = e.instance_url AND s.series_id = e.series_id "
+                "WHERE e.air_ts >= ? AND e.air_ts < ? ORDER BY e.air_ts, s.title",
+                (start_ts, end_ts),
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def instance_urls(self):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT DISTINCT instance_url FROM series ORDER BY instance_url"
+            ).fetchall()
+        return [row["instance_url"] for row in rows]
+
+    # -- TMDB ---------------------------------------------------------------
+
+    def save_tmdb_lookups(self, tmdb_ids, tmdb_statuses):
+        """Store ``{tvdbId: tmdb id}`` and ``{tmdb id: status}`` lookups."""
+        fetched_at = _now()
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO tmdb_ids VALUES (?, ?, ?)",
+                [(tvdb_id, tmdb_id, fetched_at) for tvdb_id, tmdb_id in tmdb_ids.items()],
+            )
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO tmdb_status VALUES (?, ?, ?)",
+                [
+                    (tmdb_id, status, fetched_at)
+                    for tmdb_id, status in tmdb_statuses.items()
+                ],
+            )
+
+    def load_tmdb_ids(self):
+        with self._lock:
+            rows = self._conn.execute("SELECT tvdb_id, tmdb_id FROM tmdb_ids").fetchall()
+        return {row["tvdb_id"]: row["tmdb_id"] for row in rows}
+
+    def load_tmdb_statuses(self):
+        with self._lock:
+            rows = self._conn.execute("SELECT tmdb_id, status FROM tmdb_status").fetchall()
+        return {row["tmdb_id"]: row["status"] for row in rows}
+
+    def save_now_playing(self, region, tmdb_ids):
+        """Store TMDB's now playing movie ids for ``region``, in TMDB's order."""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO tmdb_now_playing VALUES (?, ?, ?)",
+                (region, json.dumps(tmdb_ids), _now()),
+            )
+
+    def load_now_playing(self, region, max_age):
+        """Return the ids stored for ``region`` if younger than ``max_age`` (a timedelta)."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT tmdb_ids, fetched_at FROM tmdb_now_playing WHERE region = ?",
+                (region,),
+            ).fetchone()
+        if row is None or datetime.now() - datetime.fromisoformat(row["fetched_at"]) > max_age:
+            return None
+        return json.loads(row["tmdb_ids"])
+
+    # -- HTTP validators ----------------------------------------------------
+
+    def load_http_cache(self, cache_key):
+        """Return the stored validators and body for ``cache_key`` (None if unknown)."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT etag, last_modified, content_type, body FROM http_cache "
+                "WHERE cache_key = ?",
+                (cache_key,),
+            ).fetchone()
+        return dict(row) if row else None
+
+    def save_http_cache(self, cache_key, etag, last_modified, content_type, body):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO http_cache VALUES (?, ?, ?, ?, ?, ?)",
+                (cache_key, etag, last_modified, content_type, body, _now()),
+            )
+
+    # -- category membership ------------------------------------------------
+
+    def record_run(self, started_at, categories, keep=RUN_HISTORY):
+        """Store one run's ``{category: {id: title}}`` membership and prune old runs."""
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "INSERT INTO runs (started_at, finished_at) VALUES (?, ?)",
+                (started_at.isoformat(timespec="seconds"), _now()),
+            )
+            run_id = cursor.lastrowid
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO category_members VALUES (?, ?, ?, ?)",
+                [
+                    (run_id, category, item_id, title)
+                    for category, members in categories.items()
+                    for item_id, title in members.items()
+                ],
+            )
+            self._conn.execute(
+                "DELETE FROM runs WHERE run_id <= ?", (run_id - keep,)
+            )
+        return run_id
+
+    def last_run_membership(self):
+        """Return ``(finished_at, {category: {id: title}})`` of the last recorded run."""
+        with self._lock:
+            run = self._conn.execute(
+                "SELECT run_id, finished_at FROM runs ORDER BY run_id DESC LIMIT 1"
+            ).fetchone()
+            if run is None:
+                return None, {}
+            categories = {}
+            for row in self._conn.execute(
+                "SELECT category, item_id, title FROM category_members WHERE run_id = ?",
+                (run["run_id"],),
+            ):
+                categories.setdefault(row["category"], {})[row["item_id"]] = row["title"]
+        return run["finished_at"], categories
+
+    def category_history(self, item_id, limit=10):
+        """Return ``[(finished_at, [categories])]`` for the last ``limit`` runs, newest first."""
+        with self._lock:
+            runs = self._conn.execute(
+                "SELECT run_id, finished_at FROM runs ORDER BY run_id DESC LIMIT ?",
+                (limit,),
+            ).fetchall()
+            history = []
+            for run in runs:
+                rows = self._conn.execute(
+                    "SELECT category FROM category_members "
+                    "WHERE run_id = ? AND item_id = ? ORDER BY category",
+                    (run["run_id"], str(item_id)),
+                ).fetchall()
+                history.append((run["finished_at"], [row["category"] for row in rows]))
+        return history
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_state_store(path=STATE_DB_PATH, snapshot=False):
+    """Return the (lazily opened) state store of this process.
+
+    With ``snapshot`` the store is opened as an in-memory copy of ``path``
+    (empty without one), so nothing the run saves reaches the disk.
+    """
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = StateStore(path, snapshot)
+        return _store
+
+
+def close_state_store():
+    global _store
+    with _store_lock:
+        if _store is not None:
+            _store.close()
+            _store = None
@@ -0,0 +1,411 @@
+"""Check that the optimized Sonarr paths classify exactly like the plain finders.
+
+Generates random Sonarr libraries full of edge cases (specials, single
+episode seasons, downloaded future finales, unmonitored series/seasons/
+episodes, missing air dates and air times right around local midnight for
+the tested ``utc_offset``), serves them through a fake Sonarr API and runs
+the TV categories against a frozen clock through every fetch path:
+
+- ``reference``: the plain ``find_*`` functions wired up like the original
+  ``main()``, each fetching the series and every series' episodes itself
+- ``prefilter``: only series on Sonarr's calendar fetched, with the
+  episodes of a previous run in the state store, some of them out of date
+  (episodes added, rescheduled, (un)monitored or deleted and re-added since)
+- ``streaming``: per-batch classification of ``streaming_mode``
+- ``streaming+prefilter``
+
+Every category must come out identical to the reference. Run it before
+landing changes to the finders or the fetch paths:
+
+    python tools/verify_classification.py --seeds 200
+
+Nothing outside a temporary directory is written and no network is used.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+from datetime import datetime, timedelta, timezone
+
+import requests
+
+# Run from anywhere: TSSK's modules live one directory up
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import checkpoint
+import sonarr_cache
+import state_store
+import TSSK
+
+SONARR_URL = "http://sonarr.invalid/api/v3"
+INSTANCES = [{"name": "sonarr", "url": SONARR_URL, "api_key": "verify"}]
+UTC_OFFSETS = [-10, -5, 0, 1, 5.5, 13]
+
+
+class FrozenDatetime(datetime):
+    """``datetime`` whose ``now()`` is pinned to the generated library's clock."""
+
+    frozen = None
+
+    @classmethod
+    def now(cls, tz=None):
+        if tz is None:
+            return cls.frozen.replace(tzinfo=None)
+        return cls.frozen.astimezone(tz)
+
+
+def sonarr_time(value):
+    return value.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def generate_library(rng, now, utc_offset, series_count):
+    """Return ``(series, episodes by series id)`` with plenty of boundary cases."""
+    # Local midnight of today in UTC, to place episodes right around it
+    local_midnight = (now + timedelta(hours=utc_offset)).replace(
+        hour=0, minute=0, second=0, microsecond=0
+    ) - timedelta(hours=utc_offset)
+
+    def air_time():
+        kind = rng.random()
+        if kind < 0.35:
+            # Right around a local midnight within the category windows
+            return local_midnight + timedelta(
+                days=rng.randint(-25, 35), minutes=rng.choice([-1, 0, 1, 59, -59])
+            )
+        if kind < 0.45:
+            return now + timedelta(minutes=rng.choice([-1, 1]))
+        return now + timedelta(days=rng.randint(-700, 60), hours=rng.randint(0, 23))
+
+    series_list, episodes_by_series = [], {}
+    for series_id in range(1, series_count + 1):
+        season_count = rng.randint(1, 4)
+        seasons = [
+            {"seasonNumber": n, "monitored": rng.random() > 0.2}
+            for n in range(0, season_count + 1)
+        ]
+        episodes = []
+        episode_id = series_id * 1000
+        for season in range(0, season_count + 1):
+            count = rng.choice([0, 1, 1, 2, 3, 8]) if season else rng.randint(0, 2)
+            start = air_time()
+            for number in range(1, count + 1):
+                episode_id += 1
+                aired = start + timedelta(days=7 * (number - 1))
+                episode = {
+                    "id": episode_id,
+                    "seriesId": series_id,
+                    "seasonNumber": season,
+                    "episodeNumber": number,
+                    "monitored": rng.random() > 0.15,
+                    "hasFile": aired < now and rng.random() > 0.3
+                    or rng.random() < 0.1,
+                }
+                if rng.random() > 0.05:
+                    episode["airDateUtc"] = sonarr_time(aired)
+                episodes.append(episode)
+        rng.shuffle(episodes)
+
+        for season in seasons:
+            season["statistics"] = {
+                "totalEpisodeCount": sum(
+                    1 for e in episodes if e["seasonNumber"] == season["seasonNumber"]
+                )
+            }
+        series = {
+            "id": series_id,
+            "title": f"Series {series_id}",
+            "tvdbId": 100000 + series_id if rng.random() > 0.05 else None,
+            "status": rng.choice(["continuing", "continuing", "ended", "upcoming"]),
+            "monitored": rng.random() > 0.1,
+            "seasons": seasons,
+        }
+        # Sonarr fills these from monitored episodes only
+        monitored = [
+            e["airDateUtc"] for e in episodes if e["monitored"] and "airDateUtc" in e
+        ]
+        upcoming = [a for a in monitored if a >= sonarr_time(now)]
+        aired = [a for a in monitored if a < sonarr_time(now)]
+        if upcoming:
+            series["nextAiring"] = min(upcoming)
+        if aired:
+            series["previousAiring"] = max(aired)
+        series_list.append(series)
+        episodes_by_series[series_id] = episodes
+    return series_list, episodes_by_series
+
+
+class FakeSonarr:
+    """Serves a generated library in place of ``transport.get``."""
+
+    def __init__(self, series_list, episodes_by_series):
+        self.series_list = series_list
+        self.episodes_by_series = episodes_by_series
+        self.requests = 0
+
+    def get(self, url, headers=None, params=None, **kwargs):
+        self.requests += 1
+        if url.endswith("/series"):
+            return self._response(json.loads(json.dumps(self.series_list)))
+        if "/episode" in url:
+            # Like Sonarr, only a single seriesId is understood
+            series_id = (params or {}).get("seriesId")
+            if series_id is None and "seriesId=" in url:
+                series_id = url.rsplit("seriesId=", 1)[1]
+            if series_id is None or isinstance(series_id, (list, tuple)):
+                return self._response({"message": "seriesId is required"}, 400)
+            episodes = self.episodes_by_series.get(int(series_id), [])
+            return self._response(json.loads(json.dumps(episodes)))
+        if url.endswith("/calendar"):
+            return self._response(self._calendar(params))
+        return self._response({}, 404)
+
+    def _calendar(self, params):
+        """Episodes airing between the ``start`` and ``end`` dates, like Sonarr's calendar."""
+        start = f"{params['start']}T00:00:00Z"
+        end = f"{params['end']}T00:00:00Z"
+        monitored_series = {s["id"] for s in self.series_list if s["monitored"]}
+        return [
+            episode
+            for episodes in self.episodes_by_series.values()
+            for episode in episodes
+            if start <= episode.get("airDateUtc", "") <= end
+            and (
+                params.get("unmonitored") == "true"
+                or episode["monitored"]
+                and episode["seriesId"] in monitored_series
+            )
+        ]
+
+    @staticmethod
+    def _response(data, status=200):
+        response = requests.models.Response()
+        response.status_code = status
+        response._content = json.dumps(data).encode("utf-8")
+        response.encoding = "utf-8"
+        return response
+
+
+def store_previous_run(rng, series_list, episodes_by_series):
+    """Save the library as an earlier run would have, with some series out of date."""
+    store = state_store.get_state_store()
+    store.save_series(SONARR_URL, series_list)
+    stored = {}
+    for series_id, episodes in episodes_by_series.items():
+        episodes = json.loads(json.dumps(episodes))
+        regular = [e for e in episodes if e["seasonNumber"] > 0]
+        change = rng.random()
+        if regular and change < 0.4:
+            episode = rng.choice(regular)
+            if change < 0.1:
+                # Sonarr has added an episode since the last run
+                episodes.remove(episode)
+            elif change < 0.2:
+                # Rescheduled since the last run (the counts stay the same)
+                aired = episode.get("airDateUtc") or sonarr_time(FrozenDatetime.frozen)
+                aired = datetime.strptime(aired, "%Y-%m-%dT%H:%M:%SZ")
+                episode["airDateUtc"] = sonarr_time(
+                    aired - timedelta(days=rng.choice([-400, -30, 30, 400]))
+                )
+            elif change < 0.3:
+                # Monitored or unmonitored since the last run
+                episode["monitored"] = not episode["monitored"]
+            else:
+                # Deleted and re-added: a new id, and the old air date cached
+                episode["id"] += 500
+                episode["airDateUtc"] = sonarr_time(
+                    FrozenDatetime.frozen - timedelta(days=rng.randint(60, 700))
+                )
+        stored[series_id] = episodes
+    store.save_episodes(SONARR_URL, stored)
+
+
+def reset_run_state():
+    checkpoint.start_checkpoint(None, path=None)
+    sonarr_cache._caches.clear()
+
+
+def reference_categories(config):
+    """Classify like the original ``main()``: every finder fetches from Sonarr itself."""
+    settings = TSSK.get_tv_settings(config)
+    url, api_key = SONARR_URL, INSTANCES[0]["api_key"]
+    utc_offset = settings["utc_offset"]
+    skip_unmonitored = settings["skip_unmonitored"]
+    now = FrozenDatetime.frozen
+
+    season_finale = TSSK.find_recent_season_finales(
+        url, api_key, settings["recent_days_season_finale"], utc_offset, skip_unmonitored
+    )
+    final_episode = TSSK.find_recent_final_episodes(
+        url, api_key, settings["recent_days_final_episode"], utc_offset
+    )
+    excluded = {s["tvdbId"] for s in season_finale + final_episode if s.get("tvdbId")}
+
+    def not_excluded(shows):
+        return [s for s in shows if s.get("tvdbId") not in excluded]
+
+    new_season, skipped = TSSK.find_new_season_shows(
+        url,
+        api_key,
+        max(settings["future_days_new_season"], settings["future_days_new_show"]),
+        utc_offset,
+        skip_unmonitored,
+    )
+    new_show = [s for s in skipped if s.get("reason") == "New show (Season 1)"]
+    cutoff_new_season = (now + timedelta(days=settings["future_days_new_season"])).date()
+    cutoff_new_show = (now + timedelta(days=settings["future_days_new_show"])).date()
+    new_season = [
+        s for s in not_excluded(new_season) if s["airDate"] <= cutoff_new_season.isoformat()
+    ]
+    new_show = [
+        s for s in not_excluded(new_show) if s["airDate"] <= cutoff_new_show.isoformat()
+    ]
+    upcoming_episode = not_excluded(
+        TSSK.find_upcoming_regular_episodes(
+            url, api_key, settings["future_days_upcoming_episode"], utc_offset, skip_unmonitored
+        )[0]
+    )
+    upcoming_finale = not_excluded(
+        TSSK.find_upcoming_finales(
+            url, api_key, settings["future_days_upcoming_finale"], utc_offset, skip_unmonitored
+        )[0]
+    )
+    ended, cancelled = TSSK.find_ended_shows(url, api_key, None)
+    ended, cancelled = not_excluded(ended), not_excluded(cancelled)
+
+    included = {
+        s["tvdbId"]
+        for s in new_season + new_show + upcoming_episode + upcoming_finale + ended + cancelled
+        if s.get("tvdbId")
+    }
+    returning = not_excluded(TSSK.find_returning_shows(url, api_key, included))
+
+    return {
+        "TSSK_TV_SEASON_FINALE": season_finale,
+        "TSSK_TV_FINAL_EPISODE": final_episode,
+        "TSSK_TV_NEW_SHOW": new_show,
+        "TSSK_TV_NEW_SEASON": new_season,
+        "TSSK_TV_UPCOMING_EPISODE": upcoming_episode,
+        "TSSK_TV_UPCOMING_FINALE": upcoming_finale,
+        "TSSK_TV_ENDED": ended,
+        "TSSK_TV_CANCELLED": cancelled,
+        "TSSK_TV_RETURNING": returning,
+    }
+
+
+def run_path(path, config, library):
+    """Classify ``library`` through one fetch path; returns ``({category: shows}, requests)``."""
+    reset_run_state()
+    fake = FakeSonarr(*library)
+    original_get = TSSK.transport.get
+    TSSK.transport.get = fake.get
+    try:
+        if path == "reference":
+            with contextlib.redirect_stdout(io.StringIO()):
+                return reference_categories(config), fake.requests
+        profiles = TSSK.get_output_profiles(config)
+        prefilter_cutoff = (
+            TSSK.get_prefilter_cutoff(profiles) if "prefilter" in path else None
+        )
+        with contextlib.redirect_stdout(io.StringIO()):
+            if path.startswith("streaming"):
+                TSSK.stream_sonarr_library(
+                    INSTANCES,
+                    profiles,
+                    None,
+                    save_cache=False,
+                    prefilter_cutoff=prefilter_cutoff,
+                )
+            else:
+                TSSK.load_sonarr_library(INSTANCES, prefilter_cutoff)
+        return TSSK.classify_snapshot(config, INSTANCES, None), fake.requests
+    finally:
+        TSSK.transport.get = original_get
+
+
+def compare(reference, result):
+    """Return a description of the first difference, or None."""
+    for category in sorted(set(reference) | set(result)):
+        expected, actual = reference.get(category), result.get(category)
+        if expected != actual:
+            missing = [s for s in expected or [] if s not in (actual or [])]
+            extra = [s for s in actual or [] if s not in (expected or [])]
+            detail = f"missing {missing[:3]} extra {extra[:3]}"
+            if not missing and not extra:
+                detail = "same shows in a different order"
+            return f"{category}: {detail}"
+    return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--seeds", type=int, default=50, help="libraries to generate")
+    parser.add_argument("--first-seed", type=int, default=0)
+    parser.add_argument("--series", type=int, default=40, help="series per library")
+    parser.add_argument(
+        "--paths",
+        default="prefilter,streaming,streaming+prefilter",
+        help="comma separated paths to compare with the reference",
+    )
+    args = parser.parse_args(argv)
+    paths = args.paths.split(",")
+
+    original_datetime = TSSK.datetime
+    TSSK.datetime = FrozenDatetime
+    TSSK.STREAM_BATCH_SIZE = 7  # several batches per library
+    failures = 0
+    requests_made = {path: 0 for path in ["reference"] + paths}
+    with tempfile.TemporaryDirectory() as tmp:
+        state_store.get_state_store(os.path.join(tmp, "tssk.db"))
+        try:
+            for seed in range(args.first_seed, args.first_seed + args.seeds):
+                rng = random.Random(seed)
+                now = datetime(2025, 1, 1, tzinfo=timezone.utc) + timedelta(
+                    days=rng.randint(0, 730), minutes=rng.randint(0, 1439)
+                )
+                FrozenDatetime.frozen = now
+                utc_offset = rng.choice(UTC_OFFSETS)
+                config = {
+                    "utc_offset": utc_offset,
+                    "skip_unmonitored": rng.choice(["true", "false"]),
+                    "future_days": rng.choice([7, 14, 31]),
+                    "future_days_new_show": rng.choice([7, 31]),
+                    "recent_days_season_finale": rng.choice([3, 7, 14]),
+                    "recent_days_final_episode": rng.choice([7, 21]),
+                }
+                library = generate_library(rng, now, utc_offset, args.series)
+                store_previous_run(rng, *library)
+
+                reference, count = run_path("reference", config, library)
+                requests_made["reference"] += count
+                for path in paths:
+                    result, count = run_path(path, config, library)
+                    requests_made[path] += count
+                    difference = compare(reference, result)
+                    if difference:
+                        failures += 1
+                        print(
+                            f"seed {seed} ({path}, utc_offset {utc_offset}, "
+                            f"skip_unmonitored {config['skip_unmonitored']}): {difference}"
+                        )
+        finally:
+            TSSK.datetime = original_datetime
+            state_store.close_state_store()
+
+    print(
+        f"{args.seeds} libraries, {len(paths)} paths: "
+        f"{'all identical' if not failures else f'{failures} mismatches'}"
+    )
+    print(
+        "Sonarr requests: "
+        + ", ".join(f"{path} {count}" for path, count in requests_made.items())
+    )
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,426 @@
+"""Resilient HTTP transport used for outbound API calls.
+
+Requests are retried with jittered exponential backoff on connection
+errors, timeouts, HTTP 429 and 5xx responses. Each host has a circuit
+breaker: after several consecutive failures the host is skipped for a
+cool-down period so a dead Sonarr fails fast instead of timing out once
+per series.
+
+The number of requests in flight to each host adapts while the run goes
+(AIMD): it grows while responses stay fast and is halved on a timeout,
+HTTP 429/5xx or a response much slower than usual for its route. The
+worker pools size themselves for the maximum and wait for a slot here, so a
+fast local Sonarr gets many parallel requests and a Sonarr on a Raspberry
+Pi or a rate-limited TMDB only a few. The limits reached are part of the
+end-of-run report.
+
+Responses are requested compressed (brotli when a brotli module is
+installed, gzip otherwise). Callers can ask for a response to be
+revalidated: its ``ETag``/``Last-Modified`` validators and body are kept in
+the state store and sent as ``If-None-Match``/``If-Modified-Since`` on the
+next run, so an unchanged resource comes back as an empty 304. Transfer
+sizes are counted for the end-of-run report.
+
+With a :mod:`cassette` in use, responses are recorded to it, or served from
+it without touching the network when replaying.
+"""
+
+import importlib.util
+import random
+import re
+import threading
+import time
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import requests
+
+from state_store import get_state_store
+
+# urllib3 decodes brotli responses when one of these modules is installed
+ACCEPT_ENCODING = (
+    "br, gzip, deflate"
+    if any(importlib.util.find_spec(name) for name in ("brotli", "brotlicffi"))
+    else "gzip, deflate"
+)
+
+# Retry policy
+MAX_RETRIES = 3
+BACKOFF_BASE = 0.5  # seconds, doubled on every retry
+BACKOFF_MAX = 30.0
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# Circuit breaker policy
+BREAKER_FAILURE_THRESHOLD = 5
+BREAKER_RESET_TIMEOUT = 60.0  # seconds before a half-open trial request
+
+# Adaptive concurrency policy, per host
+CONCURRENCY_INITIAL = 4
+CONCURRENCY_MIN = 1
+CONCURRENCY_MAX = 32
+CONCURRENCY_DECREASE = 0.5  # limit multiplier when the host is overloaded
+LATENCY_SLOW_FACTOR = 3.0  # slower than this times the usual response
+LATENCY_SMOOTHING = 0.2  # weight of each response in a route's usual latency
+LATENCY_TOLERANCE = 0.1  # seconds, so fast hosts aren't judged on jitter
+
+_session = requests.Session()
+_session.mount(
+    "http://", requests.adapters.HTTPAdapter(pool_connections=8, pool_maxsize=32)
+)
+_session.mount(
+    "https://", requests.adapters.HTTPAdapter(pool_connections=8, pool_maxsize=32)
+)
+_session.headers["Accept-Encoding"] = ACCEPT_ENCODING
+
+# Query parameters never stored in cache keys
+SECRET_PARAMS = {"api_key", "apikey"}
+
+
+class CircuitOpenError(requests.exceptions.RequestException):
+    """Raised without touching the network while a host's breaker is open."""
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker for a single host."""
+
+    def __init__(
+        self,
+        failure_threshold=BREAKER_FAILURE_THRESHOLD,
+        reset_timeout=BREAKER_RESET_TIMEOUT,
+    ):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Return True if a request may be sent (closed or half-open)."""
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            now = time.monotonic()
+            if now - self.opened_at >= self.reset_timeout:
+                # Half-open: let one request through as a trial and keep the
+                # others out until it succeeds (or another timeout passes)
+                self.opened_at = now
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(url):
+    """Return the circuit breaker for the host of ``url``."""
+    host = urlsplit(url).netloc
+    with _breakers_lock:
+        if host not in _breakers:
+            _breakers[host] = CircuitBreaker()
+        return _breakers[host]
+
+
+class ConcurrencyLimiter:
+    """AIMD limit of the requests in flight to a single host.
+
+    Starts with slow start (the limit doubles over each window of successful
+    requests) until the first sign of overload, then grows by one request
+    per window. Overload halves the limit, at most once per window so the
+    requests already in flight don't halve it again.
+    """
+
+    def __init__(
+        self,
+        initial=CONCURRENCY_INITIAL,
+        minimum=CONCURRENCY_MIN,
+        maximum=CONCURRENCY_MAX,
+    ):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.peak = initial
+        self.decreases = 0
+        self.requests = 0
+        self.usual = {}  # route -> smoothed response time in seconds
+        self.in_flight = 0
+        self._slow_start = True
+        self._recovering_until = 0  # request count when the last window ends
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight += 1
+
+    def release(self, latency=None, overloaded=False, route=None):
+        """Free a slot and adapt the limit to the request's outcome.
+
+        ``latency`` is compared with the usual response time of the same
+        ``route``, as e.g. a whole /series listing is always slower than a
+        single series' episodes. The usual time is a moving average, so one
+        lucky response (e.g. on a warm connection) doesn't become the bar.
+        """
+        with self._condition:
+            # Only a limit that was actually reached is worth raising
+            saturated = self.in_flight >= int(self.limit)
+            self.in_flight -= 1
+            self.requests += 1
+            if latency is not None and not overloaded:
+                usual = self.usual.get(route, latency)
+                overloaded = latency > usual * LATENCY_SLOW_FACTOR + LATENCY_TOLERANCE
+                self.usual[route] = usual + LATENCY_SMOOTHING * (latency - usual)
+
+            if overloaded:
+                if self.requests > self._recovering_until:
+                    self.limit = max(self.minimum, self.limit * CONCURRENCY_DECREASE)
+                    self.decreases += 1
+                    self._slow_start = False
+                    self._recovering_until = self.requests + self.in_flight
+            elif saturated:
+                step = 1 if self._slow_start else 1 / self.limit
+                self.limit = min(self.maximum, self.limit + step)
+                self.peak = max(self.peak, int(self.limit))
+            self._condition.notify_all()
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(url):
+    """Return the concurrency limiter for the host of ``url``."""
+    host = urlsplit(url).netloc
+    with _limiters_lock:
+        if host not in _limiters:
+            _limiters[host] = ConcurrencyLimiter()
+        return _limiters[host]
+
+
+def get_concurrency_limits():
+    """Return ``{host: limiter}`` for every host contacted this run."""
+    with _limiters_lock:
+        return {host: limiter for host, limiter in _limiters.items() if limiter.requests}
+
+
+def _route(url):
+    """Path of ``url`` with ids replaced and its query's keys, e.g. ``/3/tv/{id}?api_key``."""
+    parts = urlsplit(url)
+    return re.sub(r"/\d+(?=/|$)", "/{id}", parts.path) + "?" + "&".join(
+        sorted(key for key, _ in parse_qsl(parts.query))
+    )
+
+
+def backoff_delay(attempt, response=None):
+    """Seconds to wait before retry ``attempt`` (0-based), with full jitter."""
+    if response is not None:
+        retry_after = response.headers.get("Retry-After")
+        if retry_after and retry_after.isdigit():
+            return min(float(retry_after), BACKOFF_MAX)
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2**attempt))
+
+
+def _wire_size(response):
+    """Body bytes ``response`` took on the wire (None when unknown)."""
+    if getattr(response, "raw", None) is None:
+        return None  # not read from the network (e.g. replayed)
+    length = response.headers.get("Content-Length")
+    if length and length.isdigit():
+        return int(length)  # the size of the (compressed) body
+    if response.headers.get("Content-Encoding", "identity") == "identity":
+        return len(response.content or b"")
+    try:
+        # urllib3 only counts what it read for responses that aren't chunked
+        return int(response.raw.tell()) or None
+    except (AttributeError, TypeError, ValueError, OSError):
+        return None
+
+
+class TransferStats:
+    """Requests and bytes transferred during this run."""
+
+    def __init__(self):
+        self.requests = 0
+        self.not_modified = 0
+        # Responses of known wire size (e.g. not replayed from a cassette)
+        self.bytes_received = 0  # body bytes on the wire (compressed)
+        self.bytes_decoded = 0  # body bytes after decompression
+        self.unknown_size = 0  # responses whose wire size is unknown
+        self._lock = threading.Lock()
+
+    def record(self, response):
+        decoded = len(response.content or b"")
+        received = _wire_size(response)
+        with self._lock:
+            self.requests += 1
+            if received is None:
+                self.unknown_size += 1
+            else:
+                self.bytes_received += received
+                self.bytes_decoded += decoded
+            if response.status_code == 304:
+                self.not_modified += 1
+
+
+_stats = TransferStats()
+
+
+def get_transfer_stats():
+    return _stats
+
+
+def cache_key(url, params=None):
+    """Stable key for a request with any API keys removed."""
+    parts = urlsplit(url)
+    query = parse_qsl(parts.query) + sorted(
+        (key, str(item))
+        for key, value in (params or {}).items()
+        for item in (value if isinstance(value, (list, tuple)) else [value])
+    )
+    query = [(key, value) for key, value in query if key.lower() not in SECRET_PARAMS]
+    return urlunsplit(parts._replace(query=urlencode(query)))
+
+
+def _conditional_headers(headers, cached):
+    headers = dict(headers or {})
+    if cached["etag"]:
+        headers["If-None-Match"] = cached["etag"]
+    if cached["last_modified"]:
+        headers["If-Modified-Since"] = cached["last_modified"]
+    return headers
+
+
+def _revalidated(response, key, cached):
+    """Serve a 304 from the stored body and remember new validators."""
+    if response.status_code == 304 and cached:
+        revived = requests.models.Response()
+        revived.status_code = 200
+        revived._content = cached["body"]
+        revived.headers = requests.structures.CaseInsensitiveDict(
+            {"Content-Type": cached["content_type"] or ""}
+        )
+        revived.url = response.url
+        revived.encoding = "utf-8"
+        return revived
+
+    etag = response.headers.get("ETag")
+    last_modified = response.headers.get("Last-Modified")
+    store = get_state_store()
+    # A dry run's snapshot store is thrown away, so don't bother
+    if response.status_code == 200 and (etag or last_modified) and not store.snapshot:
+        store.save_http_cache(
+            key, etag, last_modified, response.headers.get("Content-Type"), response.content
+        )
+    return response
+
+
+_cassette = None
+
+
+def use_cassette(cassette):
+    """Record every response to ``cassette`` (or replay it); None stops."""
+    global _cassette
+    _cassette = cassette
+
+
+def _secrets(url, headers, params):
+    """API keys sent with a request, to scrub from recorded bodies."""
+    query = parse_qsl(urlsplit(url).query) + list((params or {}).items())
+    secrets = [str(value) for key, value in query if key.lower() in SECRET_PARAMS]
+    secrets += [
+        str(value) for key, value in (headers or {}).items() if key.lower() == "x-api-key"
+    ]
+    return [secret for secret in secrets if secret]
+
+
+def get(
+    url,
+    headers=None,
+    params=None,
+    timeout=10,
+    retries=MAX_RETRIES,
+    revalidate=False,
+):
+    """GET ``url`` with retries, the per-host circuit breaker and concurrency limit.
+
+    Returns the final :class:`requests.Response`; callers still call
+    ``raise_for_status()``. Raises :class:`CircuitOpenError` when the host's
+    breaker is open, or the last ``RequestException`` once retries are
+    exhausted. With ``revalidate`` the stored copy of the resource is
+    revalidated and returned when the server answers 304 Not Modified.
+    """
+    if _cassette is None:
+        return _get(url, headers, params, timeout, retries, revalidate)
+
+    key = cache_key(url, params)
+    if _cassette.replaying:
+        response = _cassette.play(key)
+        _stats.record(response)
+        return response
+    # Recorded responses must be complete, so nothing is revalidated
+    try:
+        response = _get(url, headers, params, timeout, retries, revalidate=False)
+    except requests.exceptions.RequestException as e:
+        _cassette.add(key, error=e)
+        raise
+    _cassette.add(key, response, secrets=_secrets(url, headers, params))
+    return response
+
+
+def _get(url, headers, params, timeout, retries, revalidate):
+    breaker = get_breaker(url)
+    limiter = get_limiter(url)
+    if not breaker.allow():
+        raise CircuitOpenError(f"Circuit open for {urlsplit(url).netloc}")
+
+    key = cached = None
+    if revalidate:
+        key = cache_key(url, params)
+        cached = get_state_store().load_http_cache(key)
+        if cached:
+            headers = _conditional_headers(headers, cached)
+
+    for attempt in range(retries + 1):
+        response = None
+        limiter.acquire()
+        try:
+            response = _session.get(
+                url, headers=headers, params=params, timeout=timeout
+            )
+        except (
+            requests.exceptions.ConnectionError,
+            requests.exceptions.Timeout,
+        ):
+            limiter.release(overloaded=True)
+            breaker.record_failure()
+            if attempt >= retries or not breaker.allow():
+                raise
+        except BaseException:
+            limiter.release()
+            raise
+        else:
+            # Time to the response headers, so large bodies don't count as slow
+            limiter.release(
+                response.elapsed.total_seconds(),
+                overloaded=response.status_code in RETRY_STATUS_CODES,
+                route=_route(url),
+            )
+            _stats.record(response)
+            if response.status_code not in RETRY_STATUS_CODES:
+                breaker.record_success()
+                return _revalidated(response, key, cached) if revalidate else response
+            breaker.record_failure()
+            if attempt >= retries or not breaker.allow():
+                return response
+        time.sleep(backoff_delay(attempt, response))
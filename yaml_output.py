@@ -0,0 +1,240 @@
+"""Shared YAML rendering for the files TSSK writes for Kometa.
+
+All collection and overlay files go through :func:`dump_yaml`. It uses the
+libyaml C emitter when PyYAML was built with it and falls back to the pure
+Python emitter otherwise. Both give the same text for the ids, numbers and
+short strings TSSK writes. Two cases differ:
+
+- Empty keys (e.g. a collection without ``collection_name``) are only
+  written as ``? ''`` by the pure Python emitter, so documents with one
+  always use it.
+- Long strings with non-ASCII characters (e.g. a long collection summary in
+  another language) can be wrapped at different points. Kometa still reads
+  the same value.
+
+:func:`format_date` renders the user's ``date_format`` for the dated
+overlay blocks.
+"""
+
+import os
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from functools import lru_cache
+
+import yaml
+
+from label_manifest import get_label_manifest
+from membership import category_name
+from overlay_state import get_overlay_state
+from profiler import get_profiler
+
+IS_DOCKER = os.getenv("DOCKER", "false").lower() == "true"
+# Where the Kometa files are written unless a profile sets its own output_dir
+DEFAULT_OUTPUT_DIR = "/config/kometa/tssk" if IS_DOCKER else "kometa"
+
+try:
+    _BaseDumper = yaml.CSafeDumper
+except AttributeError:
+    _BaseDumper = yaml.SafeDumper
+
+
+class QuotedString(str):
+    """String that is always emitted double quoted (e.g. ``sort_title``)."""
+
+
+class TSSKDumper(_BaseDumper):
+    """Safe dumper with the TSSK representers registered once at import.
+
+    Overlay blocks may share nested config values, so anchors and aliases are
+    never emitted; each block is written out in full as Kometa expects.
+    """
+
+    def ignore_aliases(self, data):
+        return True
+
+
+class TSSKPythonDumper(yaml.SafeDumper):
+    """Pure Python :class:`TSSKDumper` for documents with an empty key."""
+
+    def ignore_aliases(self, data):
+        return True
+
+
+def _represent_ordereddict(dumper, data):
+    return dumper.represent_mapping("tag:yaml.org,2002:map", data.items())
+
+
+def _represent_quoted_str(dumper, data):
+    return dumper.represent_scalar("tag:yaml.org,2002:str", str(data), style='"')
+
+
+for _dumper in (TSSKDumper, TSSKPythonDumper):
+    _dumper.add_representer(OrderedDict, _represent_ordereddict)
+    _dumper.add_representer(QuotedString, _represent_quoted_str)
+
+
+def _has_empty_key(data):
+    if isinstance(data, dict):
+        return any(key == "" or _has_empty_key(value) for key, value in data.items())
+    if isinstance(data, (list, tuple)):
+        return any(_has_empty_key(item) for item in data)
+    return False
+
+
+# Tokens accepted in the user facing ``date_format`` and their strftime
+# equivalents. ``d`` (1-digit day) has no portable strftime directive and is
+# substituted with the day number when a date is formatted.
+DATE_FORMAT_MAPPING = {
+    "mmm": "%b",  # Abbreviated month name
+    "mmmm": "%B",  # Full month name
+    "mm": "%m",  # 2-digit month
+    "m": "%-m",  # 1-digit month
+    "dddd": "%A",  # Full weekday name
+    "ddd": "%a",  # Abbreviated weekday name
+    "dd": "%d",  # 2-digit day
+    "d": None,  # 1-digit day - direct integer conversion
+    "yyyy": "%Y",  # 4-digit year
+    "yyy": "%Y",  # 3+ digit year
+    "yy": "%y",  # 2-digit year
+    "y": "%y",  # Year without century
+}
+
+# Sort format patterns by length (longest first) to avoid partial matches
+DATE_FORMAT_PATTERNS = sorted(DATE_FORMAT_MAPPING.keys(), key=len, reverse=True)
+
+DAY_MARKER = "\0"
+
+
+@lru_cache(maxsize=None)
+def compile_date_format(date_format):
+    """Translate a user date format into strftime pieces split around the 1-digit day."""
+    # First, replace format patterns with temporary markers
+    temp_format = date_format
+    replacements = {}
+    for i, pattern in enumerate(DATE_FORMAT_PATTERNS):
+        marker = f"@@{i}@@"
+        if pattern in temp_format:
+            replacement = DATE_FORMAT_MAPPING[pattern]
+            replacements[marker] = DAY_MARKER if replacement is None else replacement
+            temp_format = temp_format.replace(pattern, marker)
+
+    # Now replace the markers with strftime formats
+    strftime_format = temp_format
+    for marker, replacement in replacements.items():
+        strftime_format = strftime_format.replace(marker, replacement)
+
+    return tuple(strftime_format.split(DAY_MARKER))
+
+
+@lru_cache(maxsize=4096)
+def format_date(yyyy_mm_dd, date_format, capitalize=False):
+    """Return ``(text, error)`` for ``yyyy_mm_dd`` in the user's ``date_format``.
+
+    With an invalid format the date is kept as it is and ``error`` holds the
+    message for the caller to print.
+    """
+    dt_obj = datetime.strptime(yyyy_mm_dd, "%Y-%m-%d")
+    strftime_format = str(dt_obj.day).join(compile_date_format(date_format))
+
+    try:
+        result = dt_obj.strftime(strftime_format)
+        if capitalize:
+            result = result.upper()
+        return result, None
+    except ValueError:
+        # Return original format as fallback
+        return yyyy_mm_dd, f"Error: Invalid date format '{date_format}'. Using default format."
+
+
+def render_yaml(data):
+    """Return ``data`` rendered as a YAML document string."""
+    dumper = TSSKPythonDumper if _has_empty_key(data) else TSSKDumper
+    return yaml.dump(data, Dumper=dumper, sort_keys=False)
+
+
+def dump_yaml(data, output_file):
+    """Render ``data`` and write it to ``output_file`` in a single write."""
+    with open(output_file, "w", encoding="utf-8") as f:
+        f.write(render_yaml(data))
+
+
+def write_placeholder(output_file, message):
+    """Write a comment-only file used when a category has no matches."""
+    with open(output_file, "w", encoding="utf-8") as f:
+        f.write(message)
+
+
+class OutputWriter:
+    """Write YAML files from a small thread pool while the caller keeps working.
+
+    Writers are queued with :meth:`submit` and :meth:`wait` blocks until all of
+    them finished, re-raising the first failure so errors still surface in
+    ``main()``. With a ``checkpoint``, finished files are recorded and files
+    already written by an interrupted run are skipped.
+
+    Every ``create_*_yaml`` writer takes ``(output_file, items, ...)``; the
+    items of each file are recorded in ``membership``. A writer may return
+    the state it recorded (``{"overlay_blocks": {file: blocks}}`` and, in
+    label mode, ``{"labels": {file: labels}}``), which is journaled with the
+    file and put back when the file is skipped. Problems to report (such as an
+    invalid date format) go in its ``"errors"`` and are returned by
+    :meth:`wait`, so they are printed by the main thread. With ``dry_run``
+    only the membership is recorded and nothing is written.
+    """
+
+    def __init__(self, max_workers=4, checkpoint=None, membership=None, dry_run=False):
+        self._pool = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="tssk-writer"
+        )
+        self._pending = []
+        self._checkpoint = checkpoint
+        self.membership = membership
+        self.dry_run = dry_run
+
+    def submit(self, func, output_file, items, *args, **kwargs):
+        if self.membership is not None:
+            self.membership.record(
+                category_name(output_file, kwargs.get("base_dir")), items
+            )
+        if self.dry_run:
+            return
+
+        # Files are keyed by their output directory too, for output profiles
+        key = os.path.join(kwargs.get("base_dir") or DEFAULT_OUTPUT_DIR, output_file)
+        if self._checkpoint is not None and self._checkpoint.output_done(key):
+            self._restore(
+                kwargs.get("base_dir") or DEFAULT_OUTPUT_DIR,
+                self._checkpoint.output_state(key),
+            )
+            return
+        self._pending.append(
+            self._pool.submit(self._write, func, output_file, key, items, args, kwargs)
+        )
+
+    def _write(self, func, output_file, key, items, args, kwargs):
+        with get_profiler().phase(f"{func.__name__}:{key}"):
+            state = func(output_file, items, *args, **kwargs)
+        errors = (state or {}).pop("errors", [])
+        if self._checkpoint is not None:
+            self._checkpoint.record_output(key, state)
+        return errors
+
+    @staticmethod
+    def _restore(base_dir, state):
+        """Re-record the state of a file the interrupted run already wrote."""
+        for state_file, blocks in (state or {}).get("overlay_blocks", {}).items():
+            get_overlay_state().restore(base_dir, state_file, blocks)
+        for state_file, labels in (state or {}).get("labels", {}).items():
+            get_label_manifest().restore(base_dir, state_file, labels)
+
+    def wait(self):
+        """Wait for the queued writers; returns their errors, each reported once."""
+        pending, self._pending = self._pending, []
+        errors = {}
+        for future in pending:
+            errors.update(dict.fromkeys(future.result()))
+        return list(errors)
+
+    def shutdown(self):
+        self._pool.shutdown(wait=True)